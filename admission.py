@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Admission control for /ws. Every connection runs a kernel, so connections
+# are admitted against:
+#   - MAX_KERNELS running kernels. Beyond that, connections wait in a FIFO
+#     queue of at most QUEUE_SIZE and are told their position as it changes.
+#   - MAX_PER_USER / MAX_PER_IP connections (running or queued) per user id
+#     and per client address. Behind a proxy, run uvicorn with
+#     --proxy-headers so the address is the client's.
+#   - token buckets on kernel starts: host-wide START_RATE per second with
+#     bursts of START_BURST (a start waits for its token), and per user
+#     USER_START_RATE with bursts of USER_START_BURST (a user starting
+#     kernels faster is refused with a retry hint, which is what stops a
+#     reconnect storm).
+# Re-attaching to a kernel that is still running takes a slot but no start
+# token. Refused connections get {"type": "rejected", "reason", "retryAfter"}
+# and are closed with 1013 (try again later).
+
+MAX_KERNELS = int(os.environ.get("LUNA_MAX_KERNELS", 50))
+QUEUE_SIZE = int(os.environ.get("LUNA_ADMISSION_QUEUE", 100))
+MAX_PER_USER = int(os.environ.get("LUNA_MAX_CONNECTIONS_PER_USER", 5))
+MAX_PER_IP = int(os.environ.get("LUNA_MAX_CONNECTIONS_PER_IP", 20))
+START_RATE = float(os.environ.get("LUNA_KERNEL_START_RATE", 2))
+START_BURST = int(os.environ.get("LUNA_KERNEL_START_BURST", 10))
+USER_START_RATE = 0.1
+USER_START_BURST = 5
+# Suggested wait for a client turned away because the queue is full
+QUEUE_FULL_RETRY = 30
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: float = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def try_take(self) -> float:
+        """Take a token: 0 if one was taken, else seconds until one is available."""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Ticket:
+    """A connection's place: queued until granted, then holding a kernel slot."""
+
+    def __init__(self, user_id: str, ip: str):
+        self.user_id = user_id
+        self.ip = ip
+        self.granted = False
+        self.changed = asyncio.Event()  # set when the queue moves
+        self.created = time.monotonic()
+
+
+class AdmissionController:
+    def __init__(self, max_kernels=MAX_KERNELS, queue_size=QUEUE_SIZE, max_per_user=MAX_PER_USER,
+                 max_per_ip=MAX_PER_IP, start_rate=START_RATE, start_burst=START_BURST,
+                 user_start_rate=USER_START_RATE, user_start_burst=USER_START_BURST):
+        self.max_kernels = max_kernels
+        self.queue_size = queue_size
+        self.max_per_user = max_per_user
+        self.max_per_ip = max_per_ip
+        self.starts = TokenBucket(start_rate, start_burst)
+        self.user_start_rate = user_start_rate
+        self.user_start_burst = user_start_burst
+        self.user_starts = {}  # user_id -> TokenBucket
+        self.active = set()
+        self.queue = []
+        self.per_user = Counter()
+        self.per_ip = Counter()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = Counter()  # reason -> count
+        self.max_wait = 0.0
+
+    def enter(self, user_id: str, ip: str, starts_kernel: bool = True) -> Ticket:
+        """Register a connection (granted, or queued), or raise Rejected."""
+        try:
+            if self.per_user[user_id] >= self.max_per_user:
+                raise Rejected("Too many connections for this user")
+            if self.per_ip[ip] >= self.max_per_ip:
+                raise Rejected("Too many connections from this address")
+            free = len(self.active) < self.max_kernels and not self.queue
+            if not free and len(self.queue) >= self.queue_size:
+                raise Rejected("Server is at capacity", retry_after=QUEUE_FULL_RETRY)
+            if starts_kernel:
+                bucket = self.user_starts.get(user_id)
+                if bucket is None:
+                    bucket = self.user_starts[user_id] = TokenBucket(self.user_start_rate, self.user_start_burst)
+                wait = bucket.try_take()
+                if wait:
+                    raise Rejected("Kernels are being started too often for this user", retry_after=wait)
+            ticket = Ticket(user_id, ip)
+            if free:
+                self._grant(ticket)
+            else:
+                self.queue.append(ticket)
+                self.queued += 1
+        except Rejected as e:
+            self.rejected[e.reason] += 1
+            logger.info(f"Refused connection of user {user_id} from {ip}: {e.reason}")
+            raise
+        self.per_user[user_id] += 1
+        self.per_ip[ip] += 1
+        return ticket
+
+    async def wait(self, ticket: Ticket, on_position):
+        """Wait for a slot, awaiting on_position(position, queue length) whenever it changes."""
+        last = None
+        while not ticket.granted:
+            position = (self.queue.index(ticket) + 1, len(self.queue))
+            if position != last:
+                last = position
+                await on_position(*position)
+                continue  # the queue may have moved meanwhile
+            ticket.changed.clear()
+            await ticket.changed.wait()
+
+    async def start_token(self):
+        """Wait for a host-wide kernel start token."""
+        while True:
+            wait = self.starts.try_take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def leave(self, ticket: Ticket):
+        self.per_user[ticket.user_id] -= 1
+        if self.per_user[ticket.user_id] <= 0:
+            del self.per_user[ticket.user_id]
+        self.per_ip[ticket.ip] -= 1
+        if self.per_ip[ticket.ip] <= 0:
+            del self.per_ip[ticket.ip]
+        if ticket in self.active:
+            self.active.discard(ticket)
+        elif ticket in self.queue:
+            self.queue.remove(ticket)
+        while self.queue and len(self.active) < self.max_kernels:
+            self._grant(self.queue.pop(0))
+        for waiting in self.queue:
+            waiting.changed.set()
+
+    def _grant(self, ticket: Ticket):
+        ticket.granted = True
+        self.active.add(ticket)
+        self.admitted += 1
+        self.max_wait = max(self.max_wait, time.monotonic() - ticket.created)
+        ticket.changed.set()
+
+    def metrics(self):
+        return {
+            "kernels": len(self.active),
+            "max_kernels": self.max_kernels,
+            "queued": len(self.queue),
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "queued_total": self.queued,
+            "max_wait_s": round(self.max_wait, 3),
+            "rejected": dict(self.rejected),
+            "start_tokens": round(self.starts.tokens, 2),
+        }
@@ -1,5 +1,5 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Header, HTTPException, Body
+from fastapi.responses import HTMLResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import jupyter_client
@@ -10,10 +10,32 @@ import json
 import asyncio
 import uuid
 import logging
-import queue
 import tempfile
 import shutil
-import glob
+import ast
+import time
+import signal
+import subprocess
+import sys
+import re
+import math
+import base64
+import datetime
+from collections import OrderedDict
+from luna import datasets as shared_datasets
+from session_store import create_session_store, HOSTNAME
+from notebook_store import NotebookStore, VersionConflict
+from output_store import OutputStore, QuotaExceeded
+from execution_log import ExecutionLog, code_hash, summarize as summarize_history
+from cpu_scheduler import CpuScheduler
+from admission import AdmissionController, Rejected
+import kernel_runtime
+import protocol
+import workspace_io
+from loop_monitor import LoopMonitor
+import crash_monitor
+from crash_monitor import CrashStats, KernelDied
+from replay_buffer import ReplayBuffer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -31,11 +53,216 @@ app.add_middleware(
 )
 
 WORKING_DIR = os.getcwd()
+output_store = OutputStore(os.path.join(WORKING_DIR, "storage"))
+notebook_store = NotebookStore(os.path.join(WORKING_DIR, "storage"), output_store)
+execution_log = ExecutionLog(os.path.join(WORKING_DIR, "storage"))
+# Renices/pins the kernels of users taking more than their share of the host
+cpu_scheduler = CpuScheduler()
+# Limits on running kernels, connections and kernel starts for /ws
+admission = AdmissionController()
+loop_monitor = LoopMonitor()
+crash_stats = CrashStats()
+# Plots and HTML bigger than this are sent as a content-addressed URL instead
+# of inline: identical output from a re-run is then served from the browser
+# cache instead of being sent again
+HTML_INLINE_LIMIT = int(os.environ.get("LUNA_HTML_INLINE_LIMIT", 32 * 1024))
+OUTPUT_TYPES = {"png": "image/png", "webp": "image/webp", "svg": "image/svg+xml",
+                "html": "text/html; charset=utf-8"}
+# Figures (luna/figures.py) are rendered in the kernel as PNG, SVG or WebP at
+# a DPI fitted to the client's output width and pixel ratio, which a client
+# sets per session with a "figures" message. LUNA_FIGURE_FORMAT and
+# LUNA_FIGURE_THREADS (render threads, 0 = render in the cell) are read by
+# the kernels themselves.
+FIGURE_FORMATS = ("png", "svg", "webp")
+FIGURE_MAX_THREADS = 4
+# permessage-deflate on /ws (used when the client offers it; browsers do).
+# Stream output, tracebacks and HTML tables compress several-fold; turn it
+# off only when CPU matters more than bandwidth.
+WS_DEFLATE = os.environ.get("LUNA_WS_DEFLATE", "1") == "1"
+
+# Admin endpoints (shared dataset catalog) are disabled unless a token is set
+ADMIN_TOKEN = os.environ.get("LUNA_ADMIN_TOKEN")
 
 # Store active sessions: {session_id: KernelSession}
 sessions = {}
 
+# Session metadata (user, kernel connection file, host, last activity).
+# With a persistent store (LUNA_SESSION_STORE=sqlite:///path/sessions.db)
+# a restarted backend re-adopts kernels that are still running.
+session_store = create_session_store(os.environ.get("LUNA_SESSION_STORE"))
+# How long a re-adopted kernel gets to answer before we give up on it
+ADOPT_TIMEOUT = 5
+# Kernels run detached from the backend. On a server restart (deploy) they
+# are left running for the next process to re-adopt; recovered kernels that
+# nobody reclaims within ORPHAN_TTL seconds are shut down.
+KEEP_KERNELS_ON_RESTART = os.environ.get("LUNA_KEEP_KERNELS", "1") == "1"
+ORPHAN_TTL = float(os.environ.get("LUNA_ORPHAN_TTL", 300))
+# A connection that drops (page reload, network blip) rather than closing
+# leaves its session parked this long: running cells go on, their outputs
+# are buffered, and a reconnect with the sessionId picks it up again.
+RECONNECT_GRACE = float(os.environ.get("LUNA_RECONNECT_GRACE", 60))
+
+# Completion/inspection requests fired on every keystroke: wait this long for
+# a newer request before bothering the kernel, and give up after the timeout
+# (the kernel answers shell requests only between cells).
+LOOKUP_DEBOUNCE = 0.05
+LOOKUP_TIMEOUT = 5
+
+# Cells running longer than this (seconds, excluding time spent waiting for
+# input()) are interrupted automatically. 0 disables the limit; clients may
+# ask for a shorter one per cell but never a longer one.
+CELL_TIMEOUT = float(os.environ.get("LUNA_CELL_TIMEOUT", 0))
+# How long an interrupted cell gets to unwind before we report failure
+INTERRUPT_GRACE = 5
+
+# input() prompts left unanswered this long (seconds) interrupt the cell, so
+# an abandoned tab doesn't hold the kernel forever. 0 disables.
+INPUT_TIMEOUT = float(os.environ.get("LUNA_INPUT_TIMEOUT", 900))
+
+# Names bound by the startup block of every kernel
+STARTUP_ALIASES = {
+    "sys": "sys",
+    "os": "os",
+    "matplotlib": "matplotlib",
+    "plt": "matplotlib.pyplot",
+    "pd": "pandas",
+    "np": "numpy",
+    "luna": "luna",
+}
+
+# "np.ar" -> ("np.", "ar"), "pd.DataFrame." -> ("pd.DataFrame.", "")
+DOTTED_TAIL = re.compile(r"((?:[A-Za-z_]\w*\.)+)(\w*)$")
+
+
+class CompletionCache:
+    """Attribute names of module-level objects (numpy, pandas.DataFrame, ...).
+
+    These are identical in every kernel, so one kernel round trip per dotted
+    path serves every session on the host. Modules from a user's package
+    overlay are keyed by the store directory they link to as well: users
+    with different versions get different entries.
+    """
+
+    def __init__(self, max_entries=512):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        names = self.entries.get(key)
+        if names is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return names
+
+    def put(self, key, names):
+        self.entries[key] = names
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+completion_cache = CompletionCache()
+
+
+class PendingInput:
+    """An input() prompt in the kernel waiting for the client's input_reply."""
+
+    def __init__(self, cell_id: str, prompt: str, password: bool = False):
+        self.cell_id = cell_id
+        self.prompt = prompt
+        self.password = password
+        self.created = time.monotonic()
+        self.expiry = None  # TimerHandle for INPUT_TIMEOUT
+
+    def waited(self):
+        return time.monotonic() - self.created
+
+    def cancel(self):
+        if self.expiry:
+            self.expiry.cancel()
+
+    def resolve(self):
+        self.cancel()
+        return self.waited()
+
+
+def figure_settings(message: dict) -> dict:
+    """The figure settings a "figures" message sets, validated, as luna.figures.configure() takes them."""
+    settings = {}
+    if message.get("format") is not None:
+        if message["format"] not in FIGURE_FORMATS:
+            raise ValueError(f"Unsupported figure format {message['format']!r}")
+        settings["format"] = message["format"]
+    if message.get("width") is not None:
+        settings["width"] = min(max(float(message["width"]), 0), 8192)  # 0: unknown
+    if message.get("pixelRatio") is not None:
+        settings["pixel_ratio"] = min(max(float(message["pixelRatio"]), 0.5), 4)
+    if message.get("threads") is not None:
+        settings["threads"] = min(max(int(message["threads"]), 0), FIGURE_MAX_THREADS)
+    return settings
+
+
+def cell_timeout(value) -> float:
+    """The per-cell time limit an "execute" message asks for, in seconds; None when absent or invalid."""
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return None
+    return timeout if math.isfinite(timeout) and timeout > 0 else None
+
+
+def int_field(message: dict, key: str, default: int, low: int = None, high: int = None) -> int:
+    """message[key] as an int clamped to [low, high], default when absent; ValueError when not a number."""
+    value = message.get(key)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"Invalid {key} {value!r}") from None
+    if low is not None:
+        number = max(low, number)
+    return number if high is None else min(number, high)
+
+
+def parse_module_aliases(code: str):
+    """Return ({alias: module path} imported by `code`, {names it rebinds})."""
+    # Drop IPython magics and shell escapes so the rest parses as Python
+    source = "\n".join(
+        "" if line.lstrip().startswith(("%", "!")) else line
+        for line in code.splitlines()
+    )
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return {}, set()
+
+    imported, rebound = {}, set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    imported[alias.asname] = alias.name
+                else:
+                    root = alias.name.split(".")[0]
+                    imported[root] = root
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            for alias in node.names:
+                if alias.name != "*":
+                    imported[alias.asname or alias.name] = f"{node.module}.{alias.name}"
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            rebound.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            rebound.add(node.name)
+    return imported, rebound - set(imported)
+
 class KernelSession:
+    engine = "ipykernel"
+
     def __init__(self, session_id: str):
         self.session_id = session_id
         self.km = None
@@ -45,45 +272,69 @@ class KernelSession:
         self.is_executing = False
         self.temp_dir = None  # Dedicated storage for this session
         self.user_dir = None
+        self.user_id = None
+        self.kernel_pid = None
+        self.adopted = False  # kernel launched by a previous backend process
+        self.pending_input = None  # PendingInput while an input() prompt is open
+        self.input_wait_total = 0.0
+        self.timeout_handle = None
+        self.run_stats = None  # outputs/errors of the running cell, for the execution log
+        self.idle = asyncio.Event()  # set whenever no cell holds the execution slot
+        self.idle.set()
+        self.tasks = set()  # executions and lookups running alongside the socket loop
+        self.lookups = {}  # kind -> (request_id, task), newest request only
+        self.shell_waiters = {}  # msg_id -> Future resolved by _read_shell
+        self.shell_reader = None
+        self.module_aliases = dict(STARTUP_ALIASES)
+        self.watcher = None  # liveness check of the kernel process
+        self.crash = None  # why the kernel died, until it is restarted
+        self.client = None  # the socket that last talked to this session
+        self.execution_task = None
+        self.restarts = []  # monotonic times of automatic restarts
+        self.last_checkpoint = None
+        self.oom_kills = None
+        self.outputs = ReplayBuffer()  # recent outputs per cell, for clients that reconnect
+        self.figure_settings = {}  # set by the client's "figures" messages
 
-    async def start(self, user_id: str):
-        logger.info(f"Starting kernel for session {self.session_id} user {user_id}")
-        
-        # PERSISTENCE: Use consistent directory for the user
-        base_storage = os.path.join(WORKING_DIR, "storage")
-        os.makedirs(base_storage, exist_ok=True)
-        
-        self.user_dir = os.path.join(base_storage, user_id)
-        
-        if not os.path.exists(self.user_dir):
-            os.makedirs(self.user_dir)
+    async def _prepare(self, user_id: str):
+        """Set up the user's workspace and runtime dir; returns the kernel's environment."""
+        self.user_id = user_id
+
+        # PERSISTENCE: Use consistent directory for the user, seeded with the
+        # default data files the first time
+        self.user_dir = os.path.join(WORKING_DIR, "storage", user_id)
+        if await workspace_io.run("workspace", workspace_io.prepare_workspace, self.user_dir, WORKING_DIR):
             logger.info(f"Created new persistent workspace for user {user_id}")
-            
-            # Initialize with default data files using HARD LINKS (fast, low space)
-            try:
-                for ext in ['*.csv', '*.xlsx', '*.json', '*.txt', '*.png', '*.jpg']:
-                    for file_path in glob.glob(os.path.join(WORKING_DIR, ext)):
-                        filename = os.path.basename(file_path)
-                        dest_path = os.path.join(self.user_dir, filename)
-                        if not os.path.exists(dest_path):
-                            try:
-                                os.link(file_path, dest_path)
-                            except OSError:
-                                # Fallback to copy if hard links fail (different drive etc)
-                                shutil.copy(file_path, dest_path)
-            except Exception as e:
-                logger.warning(f"Failed to populate user workspace: {e}")
         else:
             logger.info(f"Resuming existing workspace for user {user_id}")
-            
+
         self.temp_dir = self.user_dir # logical alias for backwards compat in class
 
 
-        self.km = AsyncKernelManager(kernel_name='python3')
-        # Use isolated directory as CWD
-        await self.km.start_kernel(cwd=self.temp_dir)
+        # pip installs land in a per-user overlay of links into the shared
+        # package store (luna.packages); it shadows the base site-packages
+        overlay = os.path.join(self.user_dir, ".packages")
+        await workspace_io.run("makedirs", os.makedirs, overlay, 0o777, True)
+        await workspace_io.run("makedirs", os.makedirs, kernel_runtime.RUNTIME_DIR, 0o777, True)
+        return dict(os.environ, LUNA_OVERLAY=overlay,
+                    PYTHONPATH=os.pathsep.join(p for p in (overlay, os.environ.get("PYTHONPATH")) if p))
+
+    async def start(self, user_id: str):
+        logger.info(f"Starting kernel for session {self.session_id} user {user_id}")
+        kernel_env = await self._prepare(user_id)
+        self.km = AsyncKernelManager(kernel_name='python3',
+                                     connection_file=kernel_runtime.connection_path(self.session_id))
+        # Use isolated directory as CWD. independent=True: the kernel must not
+        # exit with this process, so a redeploy can re-adopt it.
+        kernel_log = await workspace_io.run("open", open, kernel_runtime.log_path(self.session_id), "ab")
+        with kernel_log:
+            await self.km.start_kernel(cwd=self.temp_dir, independent=True, env=kernel_env,
+                                       stdout=kernel_log, stderr=subprocess.STDOUT)
+        self.adopted = False
         self.kc = self.km.client()
         self.kc.start_channels()
+        self.shell_reader = asyncio.create_task(self._read_shell())
+        self.module_aliases = dict(STARTUP_ALIASES)
         
         try:
             await self.kc.wait_for_ready(timeout=60)
@@ -102,9 +353,21 @@ import matplotlib
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
+from luna import variables as _luna_variables
+from luna import frames as _luna_frames
+from luna import checkpoint as _luna_checkpoint
+_luna_frames.install()
+import luna.datasets
+import luna.packages
+luna.packages.install_magic()
 %matplotlib inline
+from luna import figures as _luna_figures
+_luna_figures.install(**{self.figure_settings!r})
 """
             await self.execute_silent(startup_code) # Wait for idle
+            self.kernel_pid = getattr(self.km.provisioner, "pid", None)
+            await workspace_io.run("record", self._save_record)
+            self._watch()
 
             
         except Exception as e:
@@ -112,6 +375,48 @@ import numpy as np
             await self.shutdown()
             raise
 
+    def _save_record(self):
+        session_store.save({
+            "session_id": self.session_id,
+            "user_id": self.user_id,
+            "connection_file": self.km.connection_file,
+            "host": HOSTNAME,
+            "pid": self.kernel_pid,
+        })
+        kernel_runtime.write_meta(self.session_id, {
+            "user_id": self.user_id,
+            "host": HOSTNAME,
+            "pid": self.kernel_pid,
+        })
+        cpu_scheduler.register(self.session_id, self.user_id, self.kernel_pid)
+
+    async def adopt(self, record: dict):
+        # Reconnect to a kernel left running by a previous backend process.
+        # Its namespace (and startup imports) are intact, so no startup code.
+        logger.info(f"Re-adopting kernel {record['connection_file']} for session {self.session_id}")
+        self.user_id = record["user_id"]
+        self.user_dir = os.path.join(WORKING_DIR, "storage", self.user_id)
+        self.temp_dir = self.user_dir
+        try:
+            self.km = AsyncKernelManager(kernel_name='python3', connection_file=record["connection_file"])
+            self.km.load_connection_file()
+            self.kc = self.km.client()
+            self.kc.start_channels()
+            self.shell_reader = asyncio.create_task(self._read_shell())
+            await self.kc.wait_for_ready(timeout=ADOPT_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Kernel for session {record['session_id']} is gone: {e}")
+            await self.detach()
+            await workspace_io.run("forget", forget_session, record["session_id"])
+            return False
+        self.kernel_pid = record.get("pid")
+        self.adopted = True
+        self.started = True
+        self.module_aliases = dict(STARTUP_ALIASES)
+        await workspace_io.run("record", self._save_record)
+        self._watch()
+        return True
+
     async def execute_silent(self, code: str):
         if not self.kc: return
         msg_id = self.kc.execute(code, silent=True)
@@ -121,17 +426,372 @@ import numpy as np
         # Actually, let's wait for idle to be safe.
         await self._wait_for_idle(msg_id)
 
-    async def execute(self, websocket: WebSocket, code: str, cell_id: str):
+    async def call_helper(self, expression: str, timeout: float = 10, raw: bool = False):
+        # Evaluate a luna helper expression via user_expressions: nothing is
+        # printed, nothing lands in history, and the result comes back on the
+        # shell reply instead of being streamed through iopub.
+        msg_id = self.kc.execute('', silent=True, store_history=False,
+                                 user_expressions={'result': expression})
+        reply = await self._wait_for_shell_reply(msg_id, timeout)
+        result = reply['content'].get('user_expressions', {}).get('result', {})
+        if result.get('status') != 'ok':
+            raise RuntimeError(f"{result.get('ename')}: {result.get('evalue')}")
+        # Helpers return a JSON string, which arrives as its Python repr.
+        # raw: the JSON is only relayed to the client, so don't parse it here
+        text = ast.literal_eval(result['data']['text/plain'])
+        return protocol.RawJSON(text) if raw else protocol.loads(text)
+
+    async def inspect_variables(self, websocket: WebSocket, message: dict):
+        request_id = message.get("requestId")
+        if not self.started:
+            await websocket.send_json({"type": "variables", "requestId": request_id, "error": "Kernel not running"})
+            return
+
+        name = message.get("name")
+        result = None
+        try:
+            offset = int_field(message, "offset", 0, low=0)
+            limit = int_field(message, "limit", 50, low=1, high=500)
+            preview_rows = int_field(message, "previewRows", 5, low=0, high=50)
+        except ValueError as e:
+            await websocket.send_json({"type": "variables", "requestId": request_id, "error": str(e)})
+            return
+        try:
+            if name:
+                # Paging through one large frame/array
+                result = await self.call_helper(f"_luna_variables.page({name!r}, {offset}, {limit})", raw=True)
+                response = {"type": "variable_page", "requestId": request_id}
+            else:
+                result = await self.call_helper(f"_luna_variables.summarize({offset}, {limit}, {preview_rows})",
+                                                raw=True)
+                response = {"type": "variables", "requestId": request_id}
+        except Exception as e:
+            logger.error(f"Variable inspection failed for session {self.session_id}: {e}")
+            response = {"type": "variables", "requestId": request_id, "error": str(e)}
+        await websocket.send_json(response, raw=result)
+
+    async def fetch_rows(self, websocket: WebSocket, message: dict):
+        request_id = message.get("requestId")
+        if not self.started:
+            await websocket.send_json({"type": "rows", "requestId": request_id, "error": "Kernel not running"})
+            return
+
+        try:
+            options = {
+                "handle": message.get("handle"),
+                "offset": int_field(message, "offset", 0, low=0),
+                "limit": int_field(message, "limit", 50, low=1, high=1000),
+                "sortBy": message.get("sortBy"),
+                "ascending": message.get("ascending", True),
+                "filters": message.get("filters") or [],
+            }
+        except ValueError as e:
+            await websocket.send_json({"type": "rows", "requestId": request_id, "error": str(e)})
+            return
+        result = None
+        try:
+            result = await self.call_helper(f"_luna_frames.fetch({json.dumps(options)!r})", raw=True)
+            response = {"type": "rows", "requestId": request_id}
+        except Exception as e:
+            logger.error(f"Row fetch failed for session {self.session_id}: {e}")
+            response = {"type": "rows", "requestId": request_id, "error": str(e)}
+        await websocket.send_json(response, raw=result)
+
+    async def route(self, websocket: WebSocket, message: dict):
+        # Everything that can take a while runs as its own task, so input
+        # replies, interrupts, lookups and pings are never stuck behind a
+        # running cell or an open input() prompt
+        msg_type = message.get("type")
+        self.client = websocket
+        now = time.time()
+        if session_store.touch_due(self.session_id, now):
+            # A commit with the SQLite store: off the event loop
+            self.spawn(workspace_io.run("touch", session_store.write_activity, self.session_id, now))
+
+        if msg_type == "execute":
+            code = message.get("code")
+            cell_id = message.get("cellId")
+            self.spawn(self.execute(websocket, code, cell_id, cell_timeout(message.get("timeout"))))
+
+        elif msg_type == "input_reply":
+            await self.input(message.get("value"), message.get("cellId"))
+
+        elif msg_type == "inspect_variables":
+            self.spawn(self.inspect_variables(websocket, message))
+
+        elif msg_type == "fetch_rows":
+            self.spawn(self.fetch_rows(websocket, message))
+
+        elif msg_type == "interrupt":
+            self.spawn(self.interrupt(websocket))
+
+        elif msg_type in ("complete", "inspect"):
+            await self.submit_lookup(websocket, message)
+
+        elif msg_type == "ping":
+            await websocket.send_json({
+                "type": "pong",
+                "t": message.get("t"),
+                "executing": self.current_execution,
+                "awaitingInput": self.awaiting_input,
+            })
+
+        elif msg_type == "restart":
+            await self.restart(websocket)
+
+        elif msg_type == "replay":
+            await self.replay(websocket, message)
+
+        elif msg_type == "figures":
+            self.spawn(self.configure_figures(websocket, message))
+
+        else:
+            logger.warning(f"Ignored unknown message type {msg_type} for session {self.session_id}")
+
+    async def restart(self, websocket: WebSocket):
+        logger.info(f"Restarting kernel for session {self.session_id}")
+        await self.shutdown()
+        await self.start(self.user_id)
+        await websocket.send_json({"type": "restart_success", "content": "Kernel restarted successfully"})
+
+    async def configure_figures(self, websocket: WebSocket, message: dict):
+        try:
+            settings = figure_settings(message)
+        except (TypeError, ValueError) as e:
+            await websocket.send_json({"type": "figures", "error": str(e)})
+            return
+        # Kept for the startup code of a restarted kernel
+        self.figure_settings.update(settings)
+        if self.started:
+            try:
+                await self.call_helper(f"_luna_figures.configure(**{settings!r})")
+            except Exception as e:
+                # Queued behind a running cell: it still applies once the cell ends
+                logger.warning(f"Figure settings not confirmed for session {self.session_id}: {e}")
+                await websocket.send_json({"type": "figures", "error": str(e)})
+                return
+        await websocket.send_json(self.figure_reply())
+
+    def figure_reply(self):
+        reply = {"type": "figures"}
+        for key, value in self.figure_settings.items():
+            reply["pixelRatio" if key == "pixel_ratio" else key] = value
+        return reply
+
+    async def replay(self, websocket: WebSocket, message: dict):
+        # Snapshot and reply without awaiting in between: every output sent
+        # before this reply is in it, every one after is not
+        pending = self.pending_input
+        await websocket.send_json({
+            "type": "replay",
+            "cells": self.outputs.replay(message.get("cellId")),
+            "executing": self.current_execution,
+            "inputRequest": {"cellId": pending.cell_id, "prompt": pending.prompt,
+                             "password": pending.password} if pending else None,
+        })
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def submit_lookup(self, websocket: WebSocket, message: dict):
+        # Only the newest completion/inspection per kind matters; anything
+        # older is cancelled (before it reaches the kernel if still debouncing)
+        kind = message.get("type")
+        previous = self.lookups.get(kind)
+        if previous and not previous[1].done():
+            previous[1].cancel()
+            await websocket.send_json({"type": f"{kind}_reply", "requestId": previous[0], "cancelled": True})
+        handler = self.complete if kind == "complete" else self.inspect
+        self.lookups[kind] = (message.get("requestId"), self.spawn(handler(websocket, message)))
+
+    def _completion_key(self, code: str, cursor_pos: int):
+        match = DOTTED_TAIL.search(code[:cursor_pos])
+        if not match:
+            return None
+        base, partial = match.group(1)[:-1], match.group(2)
+        root, _, rest = base.partition(".")
+        module = self.module_aliases.get(root)
+        # Private names are hidden by default completion, so don't cache them
+        if module is None or partial.startswith("_"):
+            return None
+        return (module + "." + rest if rest else module), base, partial
+
+    def _overlay_entry(self, module: str):
+        # The module as installed in the user's package overlay, if it is: a
+        # link into the package store, whose path names the version
+        top = os.path.join(self.user_dir, ".packages", module.partition(".")[0])
+        for path in (top, top + ".py"):
+            if os.path.lexists(path):
+                return os.path.realpath(path)
+        return None
+
+    async def _kernel_complete(self, code: str, cursor_pos: int):
+        await asyncio.sleep(LOOKUP_DEBOUNCE)
+        msg_id = self.kc.complete(code, cursor_pos)
+        reply = await self._wait_for_shell_reply(msg_id, LOOKUP_TIMEOUT)
+        return reply['content']
+
+    def _lookup_fields(self, message: dict):
+        code = message.get("code", "")
+        if not isinstance(code, str):
+            raise ValueError(f"Invalid code {code!r}")
+        return code, int_field(message, "cursorPos", len(code), low=0, high=len(code))
+
+    async def complete(self, websocket: WebSocket, message: dict):
+        request_id = message.get("requestId")
+        response = {"type": "complete_reply", "requestId": request_id}
+        if not self.started:
+            response.update({"matches": [], "error": "Kernel not running"})
+            await websocket.send_json(response)
+            return
+        try:
+            code, cursor_pos = self._lookup_fields(message)
+        except ValueError as e:
+            response.update({"matches": [], "error": str(e)})
+            await websocket.send_json(response)
+            return
+        try:
+            cache_key = self._completion_key(code, cursor_pos)
+            if cache_key:
+                key, base, partial = cache_key
+                # Overlay packages may be another version than the base environment's
+                key = (key, await workspace_io.run("stat", self._overlay_entry, key))
+                names = completion_cache.get(key)
+                response["cached"] = names is not None
+                if names is None:
+                    # Fetch the full attribute list once, filter locally afterwards
+                    content = await self._kernel_complete(base + ".", len(base) + 1)
+                    names = sorted({m.rsplit(".", 1)[-1] for m in content.get('matches', [])})
+                    if names:
+                        completion_cache.put(key, names)
+                response.update({
+                    "matches": [n for n in names if n.startswith(partial)],
+                    "cursorStart": cursor_pos - len(partial),
+                    "cursorEnd": cursor_pos,
+                })
+            else:
+                content = await self._kernel_complete(code, cursor_pos)
+                response.update({
+                    "matches": content.get('matches', []),
+                    "cursorStart": content.get('cursor_start', cursor_pos),
+                    "cursorEnd": content.get('cursor_end', cursor_pos),
+                    "cached": False,
+                })
+        except TimeoutError:
+            response.update({"matches": [], "error": "Kernel is busy"})
+        except Exception as e:
+            logger.error(f"Completion failed for session {self.session_id}: {e}")
+            response.update({"matches": [], "error": str(e)})
+        await websocket.send_json(response)
+
+    async def inspect(self, websocket: WebSocket, message: dict):
+        request_id = message.get("requestId")
+        response = {"type": "inspect_reply", "requestId": request_id}
+        if not self.started:
+            response.update({"found": False, "error": "Kernel not running"})
+            await websocket.send_json(response)
+            return
+        try:
+            code, cursor_pos = self._lookup_fields(message)
+            detail_level = int_field(message, "detailLevel", 0, low=0, high=1)
+        except ValueError as e:
+            response.update({"found": False, "error": str(e)})
+            await websocket.send_json(response)
+            return
+        try:
+            await asyncio.sleep(LOOKUP_DEBOUNCE)
+            msg_id = self.kc.inspect(code, cursor_pos, detail_level=detail_level)
+            content = (await self._wait_for_shell_reply(msg_id, LOOKUP_TIMEOUT))['content']
+            response.update({"found": content.get('found', False), "data": content.get('data', {})})
+        except TimeoutError:
+            response.update({"found": False, "error": "Kernel is busy"})
+        except Exception as e:
+            logger.error(f"Inspection failed for session {self.session_id}: {e}")
+            response.update({"found": False, "error": str(e)})
+        await websocket.send_json(response)
+
+    async def interrupt(self, websocket: WebSocket, reason: str = "user"):
+        cell_id = self.current_execution
+        if not self.is_executing or not self.started:
+            await websocket.send_json({"type": "interrupt_reply", "status": "idle", "reason": reason})
+            return
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if self.run_stats is not None:
+            self.run_stats["interrupted"] = reason
+        logger.info(f"Interrupting cell {cell_id} in session {self.session_id} ({reason})")
+        await self._send_interrupt()
+        # The KeyboardInterrupt traceback and the final idle status flow
+        # through the running execute loop, which then releases the slot
+        try:
+            await asyncio.wait_for(self.idle.wait(), INTERRUPT_GRACE)
+            status = "ok"
+        except asyncio.TimeoutError:
+            status = "timeout"
+            logger.warning(f"Cell {cell_id} did not stop within {INTERRUPT_GRACE}s of interrupt")
+        elapsed = loop.time() - started
+        logger.info(f"Interrupt of cell {cell_id} took {elapsed * 1000:.1f}ms ({status})")
+        await websocket.send_json({
+            "type": "interrupt_reply",
+            "cellId": cell_id,
+            "status": status,
+            "reason": reason,
+            "elapsed": round(elapsed * 1000, 1),
+        })
+
+    async def _send_interrupt(self):
+        if self.adopted:
+            # Not our child process: signal its process group directly
+            os.killpg(self.kernel_pid, signal.SIGINT)
+        else:
+            await self.km.interrupt_kernel()
+
+    def _arm_timeout(self, websocket: WebSocket, cell_id: str, limit: float, started: float):
+        loop = asyncio.get_running_loop()
+
+        def check():
+            if self.current_execution != cell_id:
+                return
+            waited = self.input_wait_total
+            if self.pending_input is not None:
+                waited += self.pending_input.waited()
+            active = loop.time() - started - waited
+            if active < limit:
+                # Time spent at an input() prompt doesn't count
+                self.timeout_handle = loop.call_later(limit - active, check)
+                return
+            self.spawn(self._expire(websocket, cell_id, limit))
+
+        self.timeout_handle = loop.call_later(limit, check)
+
+    async def _expire(self, websocket: WebSocket, cell_id: str, limit: float):
+        await websocket.send_json({
+            "cellId": cell_id,
+            "type": "stream",
+            "name": "stderr",
+            "text": f"Cell exceeded the {limit:g}s time limit and was interrupted.\n",
+        })
+        await self.interrupt(websocket, reason="timeout")
+
+    async def execute(self, websocket: WebSocket, code: str, cell_id: str, timeout: float = None):
         if not self.started:
             await websocket.send_json({"type": "error", "cellId": cell_id, "content": "Kernel not running"})
             return
 
         # Check if already executing
         if self.is_executing:
+            if self.awaiting_input:
+                reason = "Kernel is waiting for input. Please complete the input prompt first or Restart Runtime."
+            else:
+                reason = f"Kernel is busy executing cell {self.current_execution}. Please wait or restart kernel."
             await websocket.send_json({
                 "type": "error", 
                 "cellId": cell_id, 
-                "traceback": [f"Kernel is busy executing cell {self.current_execution}. Please wait or restart kernel."]
+                "traceback": [reason]
             })
             await websocket.send_json({"type": "complete", "cellId": cell_id})
             return
@@ -139,105 +799,222 @@ import numpy as np
         # Mark as executing
         self.is_executing = True
         self.current_execution = cell_id
+        self.execution_task = asyncio.current_task()
+        self.idle.clear()
+        self.input_wait_total = 0.0
+        self.timeout_handle = None
+        self.run_stats = {"outputs": 0, "output_bytes": 0, "ename": None, "interrupted": None}
+        self.outputs.start(cell_id)
+        started_at = time.time()
         logger.info(f"Starting execution for cell {cell_id}")
 
-        try:
-            msg_id = self.kc.execute(code)
-            
-            # Poll for messages
-            while True:
-                try:
-                    # Check iopub
-                    try:
-                        msg = await self.kc.get_iopub_msg(timeout=0.02)  # Reduced from 0.05 to 0.02
-                        await self._handle_iopub(websocket, msg, cell_id, msg_id)
-                        
-                        if msg['header']['msg_type'] == 'status' and \
-                           msg['content']['execution_state'] == 'idle' and \
-                           msg['parent_header']['msg_id'] == msg_id:
-                            logger.info(f"Execution finished for cell {cell_id}")
-                            break
-                    except (asyncio.QueueEmpty, queue.Empty):
-                        pass
-                    except Exception as e:
-                        logger.error(f"Error checking iopub: {e}")
-                    
-                    # Check stdin - FASTER timeout for quicker input detection
-                    try:
-                        msg = await self.kc.get_stdin_msg(timeout=0.01)
-                        if msg['parent_header']['msg_id'] == msg_id:
-                             if msg['header']['msg_type'] == 'input_request':
-                                logger.info(f"Input requested for cell {cell_id}: {msg['content']['prompt']}")
-                                # Send input request to frontend IMMEDIATELY
-                                await websocket.send_json({
-                                    "type": "input_request",
-                                    "cellId": cell_id,
-                                    "prompt": msg['content']['prompt']
-                                })
-                                
-                                # Wait for input reply from frontend
-                                while True:
-                                    data = await websocket.receive_text()
-                                    message = json.loads(data)
-                                    
-                                    if message.get("type") == "input_reply":
-                                        value = message.get("value")
-                                        self.kc.input(value)
-                                        logger.info(f"Input received for cell {cell_id}: {value}")
-                                        break
-                                    
-                                    elif message.get("type") == "restart":
-                                        logger.info("Restart requested while waiting for input")
-                                        self.is_executing = False
-                                        self.current_execution = None
-                                        await self.shutdown()
-                                        await self.start()
-                                        await websocket.send_json({"type": "restart_success", "content": "Kernel restarted successfully"})
-                                        return # Exit execution immediately
-                                    
-                                    elif message.get("type") == "execute":
-                                        # Another cell trying to execute
-                                        await websocket.send_json({
-                                            "type": "error",
-                                            "cellId": message.get("cellId"),
-                                            "traceback": ["Kernel is waiting for input. Please complete the input prompt first or Restart Runtime."]
-                                        })
-                                        await websocket.send_json({"type": "complete", "cellId": message.get("cellId")})
-                                    else:
-                                        logger.warning(f"Ignored message type {message.get('type')} while waiting for input")
-                    except (asyncio.QueueEmpty, queue.Empty):
-                        pass
-                    except Exception as e:
-                        logger.error(f"Error checking stdin: {e}")
-                    
-                    # PERFORMANCE FIX: Increased sleep time to reduce CPU usage
-                    # 1ms is too aggressive for 10+ users. 10ms (0.01) is sufficient/smooth.
-                    await asyncio.sleep(0.01)
+        limits = [t for t in (CELL_TIMEOUT, timeout) if t and t > 0]
+        if limits:
+            self._arm_timeout(websocket, cell_id, min(limits), asyncio.get_running_loop().time())
 
-                except Exception as e:
-                    logger.error(f"Error during execution: {e}")
-                    break
-            
+        try:
+            await self._run(websocket, code, cell_id)
+        except asyncio.CancelledError:
+            if self.crash is None:
+                raise
+            # The kernel died mid-cell (see _on_crash)
+            self.run_stats["ename"] = "KernelDied"
+            response = {
+                "cellId": cell_id,
+                "type": "error",
+                "ename": "KernelDied",
+                "evalue": self.crash,
+                "traceback": [f"Kernel died while running this cell: {self.crash}"],
+            }
+            self.outputs.record(cell_id, response)
+            await websocket.send_json(response)
         finally:
             # Always clear execution state
+            if self.timeout_handle:
+                self.timeout_handle.cancel()
+            if self.pending_input:
+                # Interrupted or timed out while the prompt was open
+                self.pending_input.cancel()
+                self.pending_input = None
+                await websocket.send_json({"type": "input_cancelled", "cellId": cell_id})
             self.is_executing = False
             self.current_execution = None
+            self.execution_task = None
+            self.idle.set()
+            self.outputs.finish(cell_id)
+            succeeded = not (self.run_stats["ename"] or self.run_stats["interrupted"])
+            self._log_execution(code, cell_id, started_at)
             logger.info(f"Cleared execution state for cell {cell_id}")
         
         await websocket.send_json({"type": "complete", "cellId": cell_id})
+        if succeeded and self._checkpoint_due():
+            self.spawn(self.checkpoint())
+
+    async def _run(self, websocket: WebSocket, code: str, cell_id: str):
+        # Run the cell and forward its output until the kernel is idle again
+        stdin_watcher = None
+        try:
+            msg_id = self.kc.execute(code)
+            self._track_imports(code)
+            # input() prompts are handled by their own task, so this loop only
+            # awaits iopub: no polling, no sleeps, nothing to do while idle
+            stdin_watcher = self.spawn(self._watch_stdin(websocket, cell_id, msg_id))
+
+            while True:
+                try:
+                    msg = await self.kc.get_iopub_msg()
+                except Exception as e:
+                    logger.error(f"Error during execution: {e}")
+                    break
+                try:
+                    await self._handle_iopub(websocket, msg, cell_id, msg_id)
+                except Exception as e:
+                    logger.error(f"Error forwarding iopub message: {e}")
 
-    async def input(self, value: str):
+                if msg['header']['msg_type'] == 'status' and \
+                   msg['content']['execution_state'] == 'idle' and \
+                   msg['parent_header'].get('msg_id') == msg_id:
+                    logger.info(f"Execution finished for cell {cell_id}")
+                    break
+        finally:
+            if stdin_watcher:
+                stdin_watcher.cancel()
+
+    def _log_execution(self, code: str, cell_id: str, started_at: float):
+        stats, self.run_stats = self.run_stats, None
+        ended_at = time.time()
+        status = stats["interrupted"] or ("error" if stats["ename"] else "ok")
+        # Only queued here; the log's own thread does the writing
+        execution_log.record(self.user_id, {
+            "start": round(started_at, 3),
+            "end": round(ended_at, 3),
+            "duration_ms": round((ended_at - started_at) * 1000, 1),
+            "session": self.session_id,
+            "kernel": getattr(self.km, "kernel_id", None),
+            "cell": cell_id,
+            "code_sha": code_hash(code),
+            "code_len": len(code),
+            "status": status,
+            "ename": stats["ename"],
+            "outputs": stats["outputs"],
+            "output_bytes": stats["output_bytes"],
+            "input_wait_ms": round(self.input_wait_total * 1000, 1),
+        })
+
+    async def _watch_stdin(self, websocket: WebSocket, cell_id: str, msg_id: str):
+        while True:
+            msg = await self.kc.get_stdin_msg()
+            if msg['parent_header'].get('msg_id') != msg_id or \
+               msg['header']['msg_type'] != 'input_request':
+                continue
+            await self._open_prompt(websocket, cell_id, msg['content']['prompt'],
+                                    msg['content'].get('password', False))
+
+    async def _open_prompt(self, websocket: WebSocket, cell_id: str, prompt: str, password: bool):
+        logger.info(f"Input requested for cell {cell_id}: {prompt}")
+        self.pending_input = PendingInput(cell_id, prompt, password)
+        if INPUT_TIMEOUT > 0:
+            self.pending_input.expiry = asyncio.get_running_loop().call_later(
+                INPUT_TIMEOUT, lambda: self.spawn(self._input_expired(websocket, cell_id))
+            )
+        # Send input request to frontend IMMEDIATELY; the reply comes back
+        # through route() as input_reply
+        await websocket.send_json({
+            "type": "input_request",
+            "cellId": cell_id,
+            "prompt": prompt,
+            "password": self.pending_input.password,
+        })
+
+    async def _input_expired(self, websocket: WebSocket, cell_id: str):
+        if not self.pending_input or self.pending_input.cell_id != cell_id:
+            return
+        logger.info(f"Input prompt for cell {cell_id} timed out after {INPUT_TIMEOUT:g}s")
+        await websocket.send_json({
+            "cellId": cell_id,
+            "type": "stream",
+            "name": "stderr",
+            "text": f"No input received within {INPUT_TIMEOUT:g}s, interrupting.\n",
+        })
+        await self.interrupt(websocket, reason="input_timeout")
+
+    @property
+    def awaiting_input(self):
+        return self.pending_input is not None
+
+    async def input(self, value: str, cell_id: str = None):
+        pending = self.pending_input
+        if not self.started or not pending:
+            logger.warning(f"Ignoring input reply for session {self.session_id}: no prompt is open")
+            return
+        if cell_id and cell_id != pending.cell_id:
+            logger.warning(f"Ignoring input reply for cell {cell_id}: prompt belongs to {pending.cell_id}")
+            return
+        self.pending_input = None
+        self.input_wait_total += pending.resolve()
+        self._send_input(value)
+
+    def _send_input(self, value: str):
+        self.kc.input(value)
+
+    def _track_imports(self, code: str):
+        imported, rebound = parse_module_aliases(code)
+        for name in rebound:
+            self.module_aliases.pop(name, None)
+        self.module_aliases.update(imported)
+
+    async def _stop_tasks(self):
+        current = asyncio.current_task()
+        pending = [t for t in self.tasks if t is not current]
+        if self.shell_reader:
+            pending.append(self.shell_reader)
+            self.shell_reader = None
+        if self.watcher and self.watcher is not current:
+            # (a watcher restarting a crashed kernel stops itself)
+            pending.append(self.watcher)
+            self.watcher = None
+        for task in pending:
+            task.cancel()
+        if pending:
+            # wait(), not gather(): if we are cancelled meanwhile it surfaces as
+            # our own cancellation, not as one of the tasks'
+            done, _ = await asyncio.wait(pending)
+            for task in done:
+                if not task.cancelled() and task.exception():
+                    logger.info(f"Task of session {self.session_id} ended with {task.exception()!r}")
+        if self.pending_input:
+            self.pending_input.cancel()
+            self.pending_input = None
+        self.is_executing = False
+        self.current_execution = None
+        self.idle.set()
+
+    async def detach(self):
+        # Drop our connection but leave the kernel (and its store record) alive
+        # so the next backend process can re-adopt it
+        await self._stop_tasks()
+        cpu_scheduler.unregister(self.session_id)
         if self.kc:
-            self.kc.input(value)
+            self.kc.stop_channels()
+        self.started = False
+        self.km = None
+        self.kc = None
+
+    async def shutdown(self, keep_checkpoint: bool = False):
+        await self._stop_tasks()
+        cpu_scheduler.unregister(self.session_id)
 
-    async def shutdown(self):
         if self.km:
             logger.info(f"Shutting down kernel for session {self.session_id}")
             try:
-                await self.km.shutdown_kernel()
+                if self.adopted:
+                    await self._shutdown_adopted()
+                else:
+                    await self.km.shutdown_kernel()
             except Exception as e:
                 logger.warning(f"Error shutting down kernel: {e}")
             self.started = False
+            self.adopted = False
             self.km = None
             self.kc = None
             
@@ -245,6 +1022,135 @@ import numpy as np
             # But we might want to clean up if it was a temp/guest user?
             # For now, keep it for persistence.
 
+        # Only once the kernel is gone: a record outliving its kernel is
+        # harmless, a kernel without one is never cleaned up
+        await workspace_io.run("forget", forget_session, self.session_id)
+        if self.user_dir and not keep_checkpoint:
+            await workspace_io.run("forget", remove_file, self.checkpoint_path)
+
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.user_dir, ".checkpoints", f"{self.session_id}.pkl")
+
+    def _checkpoint_due(self):
+        if crash_monitor.CHECKPOINT_INTERVAL <= 0 or not self.started:
+            return False
+        return self.last_checkpoint is None or \
+            time.monotonic() - self.last_checkpoint >= crash_monitor.CHECKPOINT_INTERVAL
+
+    async def checkpoint(self):
+        # Pickled in the kernel, between the user's cells
+        self.last_checkpoint = time.monotonic()
+        try:
+            summary = await self.call_helper(f"_luna_checkpoint.save({self.checkpoint_path!r}, "
+                                             f"{crash_monitor.CHECKPOINT_MAX_BYTES})", timeout=60)
+        except Exception as e:
+            logger.warning(f"Checkpoint of session {self.session_id} failed: {e}")
+            return None
+        logger.info(f"Checkpointed {len(summary['saved'])} variable(s) ({summary['bytes']} bytes) "
+                    f"of session {self.session_id}")
+        return summary
+
+    async def restore_checkpoint(self):
+        """Names restored from the session's last checkpoint (none if there is no checkpoint)."""
+        if not await workspace_io.run("stat", os.path.exists, self.checkpoint_path):
+            return []
+        try:
+            summary = await self.call_helper(f"_luna_checkpoint.restore({self.checkpoint_path!r})", timeout=60)
+        except Exception as e:
+            logger.warning(f"Restoring the checkpoint of session {self.session_id} failed: {e}")
+            return []
+        if summary["failed"]:
+            logger.info(f"Could not restore {summary['failed']} in session {self.session_id}")
+        return summary["restored"]
+
+    def _watch(self):
+        self.crash = None
+        self.oom_kills = crash_monitor.read_oom_kills()
+        if crash_monitor.HEARTBEAT_INTERVAL > 0:
+            self.watcher = asyncio.create_task(self._watch_kernel())
+
+    async def _watch_kernel(self):
+        while True:
+            await asyncio.sleep(crash_monitor.HEARTBEAT_INTERVAL)
+            if self.adopted:
+                # Not our child: no exit status, only whether the pid is gone
+                if kernel_runtime.pid_alive(self.kernel_pid):
+                    continue
+                returncode = None
+            else:
+                provisioner = self.km.provisioner if self.km else None
+                returncode = await provisioner.poll() if provisioner else None
+                if returncode is None:
+                    continue
+            await self._on_crash(returncode)
+            return
+
+    async def _on_crash(self, returncode):
+        kind, reason = crash_monitor.describe_exit(returncode, self.oom_kills, crash_monitor.read_oom_kills())
+        cell_id = self.current_execution
+        logger.error(f"Kernel {self.kernel_pid} of session {self.session_id} (user {self.user_id}) died: {reason}")
+        crash_stats.record(self.session_id, self.user_id, kind, reason, cell_id)
+        self.crash = reason
+        self.started = False
+        for waiter in list(self.shell_waiters.values()):
+            if not waiter.done():
+                waiter.set_exception(KernelDied(reason))
+        if self.execution_task:
+            # Fails the cell with the reason instead of waiting forever for its idle status
+            task = self.execution_task
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        restart = crash_monitor.AUTO_RESTART and self._may_restart()
+        await self._notify({"type": "kernel_died", "reason": reason, "kind": kind, "cellId": cell_id,
+                            "restarting": restart})
+        if restart:
+            await self._recover()
+
+    def _may_restart(self):
+        now = time.monotonic()
+        self.restarts = [t for t in self.restarts if now - t < crash_monitor.RESTART_WINDOW]
+        if len(self.restarts) >= crash_monitor.MAX_RESTARTS:
+            crash_stats.restarts_refused += 1
+            logger.warning(f"Not restarting kernel of session {self.session_id}: "
+                           f"{len(self.restarts)} restarts in {crash_monitor.RESTART_WINDOW}s")
+            return False
+        self.restarts.append(now)
+        return True
+
+    async def _recover(self):
+        logger.info(f"Restarting crashed kernel of session {self.session_id}")
+        try:
+            await self.shutdown(keep_checkpoint=True)
+            await self.start(self.user_id)
+        except Exception as e:
+            crash_stats.restart_failures += 1
+            logger.error(f"Could not restart kernel of session {self.session_id}: {e}")
+            await self._notify({"type": "kernel_restart_failed", "reason": str(e)})
+            return
+        restored = await self.restore_checkpoint()
+        crash_stats.restarts += 1
+        crash_stats.variables_restored += len(restored)
+        await self._notify({"type": "kernel_restarted", "restored": restored})
+
+    async def _notify(self, message: dict):
+        if self.client is None:
+            return
+        try:
+            await self.client.send_json(message)
+        except Exception as e:
+            logger.info(f"Could not notify session {self.session_id}: {e}")
+
+    async def _shutdown_adopted(self):
+        # The kernel manager has no process handle for a re-adopted kernel:
+        # ask politely over the control channel, then kill by pid
+        self.kc.shutdown()
+        self.kc.stop_channels()
+        if not await kernel_runtime.wait_for_exit(self.kernel_pid, 1):
+            os.killpg(self.kernel_pid, signal.SIGKILL)
+        self.km.cleanup_connection_file()
 
     async def _wait_for_idle(self, msg_id):
         # Helper to wait for a specific message to be done without sending anything to WS
@@ -258,6 +1164,41 @@ import numpy as np
             except:
                 break
 
+    async def _read_shell(self):
+        # Single reader for the shell channel so concurrent helper calls,
+        # completions and inspections each get their own reply. Replies
+        # nobody waits for (user cells, cancelled lookups) are dropped.
+        while True:
+            try:
+                msg = await self.kc.get_shell_msg()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Shell reader stopped for session {self.session_id}: {e}")
+                return
+            waiter = self.shell_waiters.pop(msg['parent_header'].get('msg_id'), None)
+            if waiter and not waiter.done():
+                waiter.set_result(msg)
+
+    async def _wait_for_shell_reply(self, msg_id, timeout):
+        waiter = asyncio.get_running_loop().create_future()
+        self.shell_waiters[msg_id] = waiter
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No shell reply for {msg_id} within {timeout}s") from None
+        finally:
+            self.shell_waiters.pop(msg_id, None)
+
+    async def _store_output(self, payload: bytes, kind: str):
+        # URL of the stored output, or None to fall back to sending it inline
+        try:
+            digest = await asyncio.to_thread(output_store.put, self.user_id, payload)
+        except (QuotaExceeded, ValueError, OSError) as e:
+            logger.warning(f"Sending output inline for user {self.user_id}: {e}")
+            return None
+        return f"/outputs/{self.user_id}/{digest}.{kind}"
+
     async def _handle_iopub(self, websocket: WebSocket, msg, cell_id, parent_msg_id):
         if msg['parent_header'].get('msg_id') != parent_msg_id:
             return
@@ -266,44 +1207,662 @@ import numpy as np
         content = msg['content']
         
         response = {"cellId": cell_id, "type": msg_type}
+        stats = self.run_stats
+        if stats is not None and msg_type in ('stream', 'execute_result', 'display_data', 'update_display_data',
+                                              'error'):
+            stats["outputs"] += 1
+            if msg_type == 'stream':
+                stats["output_bytes"] += len(content['text'])
+            elif msg_type == 'error':
+                stats["ename"] = content['ename']
+            else:
+                stats["output_bytes"] += sum(len(v) for v in content['data'].values() if isinstance(v, str))
 
         if msg_type == 'stream':
             response["text"] = content['text']
             response["name"] = content['name']
+            self.outputs.record(cell_id, response)
             await websocket.send_json(response)
             
-        elif msg_type in ('execute_result', 'display_data'):
+        elif msg_type in ('execute_result', 'display_data', 'update_display_data'):
             data = content['data']
+            display_id = (content.get('transient') or {}).get('display_id')
+            if display_id is not None:
+                # display(..., display_id=...) and its later updates
+                response["displayId"] = display_id
             if 'text/html' in data:
-                 response["html"] = data['text/html']
-            if 'image/png' in data:
-                response["image"] = data['image/png']
+                html = data['text/html']
+                url = None
+                if len(html) > HTML_INLINE_LIMIT:
+                    url = await self._store_output(html.encode("utf-8"), "html")
+                if url:
+                    response["htmlUrl"] = url
+                else:
+                    response["html"] = html
+            for kind in FIGURE_FORMATS:
+                mime = OUTPUT_TYPES[kind]
+                if mime not in data:
+                    continue
+                payload = data[mime].encode("utf-8") if kind == "svg" else base64.b64decode(data[mime])
+                url = await self._store_output(payload, kind)
+                if url:
+                    response["imageUrl"] = url
+                else:
+                    response["image"] = data[mime] if kind != "svg" else base64.b64encode(payload).decode("ascii")
+                    if kind != "png":
+                        response["imageType"] = mime
+                # Size in CSS pixels of a figure rendered for a high-DPI screen
+                width = ((content.get('metadata') or {}).get(mime) or {}).get('width')
+                if width:
+                    response["imageWidth"] = width
+                break
             if 'text/plain' in data:
                 response["text"] = data['text/plain']
+            if 'application/vnd.luna.frame+json' in data:
+                # DataFrame rendered as a first page only; more via fetch_rows
+                response["frame"] = data['application/vnd.luna.frame+json']
+            self.outputs.record(cell_id, response)
             await websocket.send_json(response)
             
         elif msg_type == 'error':
             response["ename"] = content['ename']
             response["evalue"] = content['evalue']
             response["traceback"] = content['traceback']
+            self.outputs.record(cell_id, response)
             await websocket.send_json(response)
 
 
+class LiteSession(KernelSession):
+    """A session on a plain Python worker (luna/lite.py) instead of an ipykernel.
+
+    Cells, streamed output, input(), interrupts and crash recovery work as
+    with a kernel; the worker speaks JSON lines over its stdin/stdout, so
+    there is no ZMQ and no IPython, and it costs a fraction of a kernel's
+    memory and start time. Completions, the variable explorer and namespace
+    checkpoints need the kernel helpers and aren't available. The worker
+    exits with the backend (EOF on its stdin), so it is never re-adopted.
+    """
+    engine = "lite"
+    WORKER = os.path.join(WORKING_DIR, "luna", "lite.py")
+    FRAME_LIMIT = 64 * 1024 * 1024  # longest protocol line (a large figure)
+    UNAVAILABLE = "Not available in the lite engine"
+
+    def __init__(self, session_id: str):
+        super().__init__(session_id)
+        self.process = None
+        self.frames = None  # queue of the running cell's frames
+
+    async def start(self, user_id: str):
+        logger.info(f"Starting lite worker for session {self.session_id} user {user_id}")
+        kernel_env = await self._prepare(user_id)
+        kernel_env.update(LUNA_APP_DIR=WORKING_DIR, MPLBACKEND="Agg")
+        worker_log = await workspace_io.run("open", open, kernel_runtime.log_path(self.session_id), "ab")
+        with worker_log:
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, self.WORKER, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=worker_log, cwd=self.user_dir, env=kernel_env, start_new_session=True,
+                limit=self.FRAME_LIMIT)
+        self.adopted = False
+        self.module_aliases = {}
+        try:
+            line = await asyncio.wait_for(self.process.stdout.readline(), 60)
+            if not line or json.loads(line).get("type") != "ready":
+                raise RuntimeError(f"lite worker exited with code {await self.process.wait()}")
+        except Exception as e:
+            logger.error(f"Failed to start lite worker: {e}")
+            await self.shutdown()
+            raise
+        self.kernel_pid = self.process.pid
+        self.started = True
+        cpu_scheduler.register(self.session_id, self.user_id, self.kernel_pid)
+        logger.info(f"Lite worker {self.kernel_pid} ready for session {self.session_id}")
+        if self.figure_settings:
+            self._write({"type": "figures", **self.figure_settings})
+        self._watch()
+
+    async def adopt(self, record: dict):
+        return False
+
+    async def detach(self):
+        # Nothing to leave behind for the next backend process
+        await self.shutdown()
+
+    async def shutdown(self, keep_checkpoint: bool = False):
+        await self._stop_tasks()
+        cpu_scheduler.unregister(self.session_id)
+        self.started = False
+        process, self.process = self.process, None
+        if process:
+            logger.info(f"Shutting down lite worker for session {self.session_id}")
+            if process.returncode is None:
+                # EOF on its stdin ends the worker between cells; a busy one is killed
+                process.stdin.close()
+                try:
+                    await asyncio.wait_for(process.wait(), 1)
+                except asyncio.TimeoutError:
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    await process.wait()
+        await workspace_io.run("forget", forget_session, self.session_id)
+
+    def _watch(self):
+        # The frame reader doubles as the liveness check: EOF means the worker died
+        self.crash = None
+        self.oom_kills = crash_monitor.read_oom_kills()
+        self.watcher = asyncio.create_task(self._read_frames())
+
+    async def _read_frames(self):
+        process = self.process
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            try:
+                frame = json.loads(line)
+            except ValueError:
+                logger.warning(f"Dropped malformed frame from lite worker {process.pid}")
+                continue
+            if self.frames is not None:
+                self.frames.put_nowait(frame)
+        returncode = await process.wait()
+        if self.started:
+            await self._on_crash(returncode)
+
+    def _write(self, message: dict):
+        try:
+            self.process.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+        except (AttributeError, OSError) as e:
+            # The worker is gone; the frame reader reports why
+            logger.warning(f"Could not write to lite worker of session {self.session_id}: {e}")
+
+    async def _run(self, websocket: WebSocket, code: str, cell_id: str):
+        self.frames = asyncio.Queue()
+        try:
+            self._write({"type": "execute", "code": code})
+            while True:
+                frame = await self.frames.get()
+                kind = frame.pop("type", None)
+                if kind == "done":
+                    logger.info(f"Execution finished for cell {cell_id}")
+                    break
+                if kind == "input_request":
+                    await self._open_prompt(websocket, cell_id, frame.get("prompt", ""),
+                                            frame.get("password", False))
+                    continue
+                # Frames are shaped like iopub contents: forward them the same way
+                msg = {"parent_header": {"msg_id": self.session_id}, "header": {"msg_type": kind},
+                       "content": frame}
+                try:
+                    await self._handle_iopub(websocket, msg, cell_id, self.session_id)
+                except Exception as e:
+                    logger.error(f"Error forwarding lite frame: {e}")
+        finally:
+            self.frames = None
+
+    def _send_input(self, value: str):
+        self._write({"type": "input_reply", "value": value})
+
+    async def _send_interrupt(self):
+        os.killpg(self.kernel_pid, signal.SIGINT)
+
+    def _checkpoint_due(self):
+        return False
+
+    async def restore_checkpoint(self):
+        return []
+
+    async def complete(self, websocket: WebSocket, message: dict):
+        await websocket.send_json({"type": "complete_reply", "requestId": message.get("requestId"),
+                                   "matches": [], "error": self.UNAVAILABLE})
+
+    async def inspect(self, websocket: WebSocket, message: dict):
+        await websocket.send_json({"type": "inspect_reply", "requestId": message.get("requestId"),
+                                   "found": False, "error": self.UNAVAILABLE})
+
+    async def inspect_variables(self, websocket: WebSocket, message: dict):
+        await websocket.send_json({"type": "variables", "requestId": message.get("requestId"),
+                                   "error": self.UNAVAILABLE})
+
+    async def fetch_rows(self, websocket: WebSocket, message: dict):
+        await websocket.send_json({"type": "rows", "requestId": message.get("requestId"),
+                                   "error": self.UNAVAILABLE})
+
+    async def configure_figures(self, websocket: WebSocket, message: dict):
+        try:
+            settings = figure_settings(message)
+        except (TypeError, ValueError) as e:
+            await websocket.send_json({"type": "figures", "error": str(e)})
+            return
+        self.figure_settings.update(settings)
+        # The worker reads it between cells, before it shows the next figures
+        self._write({"type": "figures", **settings})
+        await websocket.send_json(self.figure_reply())
+
+class SharedWorker:
+    """The one process hosting the namespaces of all "shared" sessions (luna/shared.py).
+
+    Started by the first shared session and kept for the next ones; frames
+    are routed to sessions by namespace id. If it dies, every session in it
+    goes through crash recovery, and the first one to restart starts a new
+    worker.
+    """
+    WORKER = os.path.join(WORKING_DIR, "luna", "shared.py")
+
+    def __init__(self):
+        self.process = None
+        self.reader = None
+        self.sessions = {}  # namespace id (= session id) -> SharedSession
+        self.starting = asyncio.Lock()
+        self.cpu_seconds = 0.0
+        self.cells = 0
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def open(self, session):
+        """Give the session a namespace; returns the worker's pid."""
+        async with self.starting:
+            if not self.running:
+                await self._start()
+        self.sessions[session.session_id] = session
+        self.send({"type": "open", "ns": session.session_id, "cwd": session.user_dir,
+                   "cpuLimit": SHARED_CPU_LIMIT})
+        return self.process.pid
+
+    def close(self, session):
+        if self.sessions.pop(session.session_id, None) is not None:
+            self.send({"type": "close", "ns": session.session_id})
+
+    async def _start(self):
+        logger.info("Starting shared worker")
+        await workspace_io.run("makedirs", os.makedirs, kernel_runtime.RUNTIME_DIR, 0o777, True)
+        env = dict(os.environ, LUNA_APP_DIR=WORKING_DIR, MPLBACKEND="Agg",
+                   PYTHONPATH=os.pathsep.join(p for p in (WORKING_DIR, os.environ.get("PYTHONPATH")) if p))
+        worker_log = await workspace_io.run("open", open, kernel_runtime.log_path("shared"), "ab")
+        with worker_log:
+            # Not in anyone's workspace: each namespace's thread changes to its user's
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, self.WORKER, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=worker_log, cwd=kernel_runtime.RUNTIME_DIR, env=env, start_new_session=True,
+                limit=LiteSession.FRAME_LIMIT)
+        try:
+            line = await asyncio.wait_for(process.stdout.readline(), 60)
+            ready = json.loads(line) if line else {}
+            if ready.get("type") != "ready":
+                raise RuntimeError(f"shared worker exited with code {await process.wait()}")
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        self.process = process
+        self.reader = asyncio.create_task(self._read_frames(process))
+        logger.info(f"Shared worker {process.pid} ready")
+        if not ready.get("threadCwd"):
+            logger.warning(f"Shared worker {process.pid} cannot give namespaces their own working directory: "
+                           "relative paths only resolve through open()")
+
+    def send(self, message: dict):
+        try:
+            self.process.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+        except (AttributeError, OSError) as e:
+            # Gone; the frame reader reports why
+            logger.warning(f"Could not write to the shared worker: {e}")
+
+    async def _read_frames(self, process):
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            try:
+                frame = json.loads(line)
+            except ValueError:
+                logger.warning(f"Dropped malformed frame from shared worker {process.pid}")
+                continue
+            session = self.sessions.get(frame.pop("ns", None))
+            if frame.get("type") == "done":
+                self.cpu_seconds += frame.get("cpu", 0)
+                self.cells += 1
+            if session is not None and session.frames is not None:
+                session.frames.put_nowait(frame)
+        returncode = await process.wait()
+        if process is not self.process:
+            return
+        logger.error(f"Shared worker {process.pid} exited with code {returncode}")
+        crashed, self.sessions = list(self.sessions.values()), {}
+        for session in crashed:
+            if session.started:
+                # The session's own watcher: it may restart the session
+                session.watcher = asyncio.create_task(session._on_crash(returncode))
+
+    async def stop(self):
+        self.sessions.clear()
+        self.starting = asyncio.Lock()  # a new event loop may start the next one
+        process, self.process = self.process, None
+        if self.reader:
+            self.reader.cancel()
+            self.reader = None
+        if process and process.returncode is None:
+            process.stdin.close()
+            try:
+                await asyncio.wait_for(process.wait(), 1)
+            except asyncio.TimeoutError:
+                os.killpg(process.pid, signal.SIGKILL)
+                await process.wait()
+
+    def metrics(self):
+        pid = self.process.pid if self.running else None
+        rss = kernel_runtime.rss_bytes(pid) if pid else None
+        return {
+            "running": pid is not None,
+            "pid": pid,
+            "namespaces": len(self.sessions),
+            "rss_bytes": rss,
+            "bytes_per_namespace": rss // len(self.sessions) if rss and self.sessions else None,
+            "cells": self.cells,
+            "cpu_seconds": round(self.cpu_seconds, 3),
+        }
+
+
+class SharedSession(LiteSession):
+    """A session on a namespace of the shared worker instead of a process of its own.
+
+    Runs the lite protocol (tagged with the session id), so execution,
+    input, interrupts and crash recovery are LiteSession's. Cells get at
+    most SHARED_CPU_LIMIT CPU seconds each. Relative paths are the user's
+    workspace; where the worker can't give namespaces a working directory
+    of their own ("threadCwd" false in its ready frame) only open() resolves
+    them.
+    """
+    engine = "shared"
+
+    async def start(self, user_id: str):
+        logger.info(f"Opening shared namespace for session {self.session_id} user {user_id}")
+        await self._prepare(user_id)
+        self.adopted = False
+        self.module_aliases = {}
+        self.kernel_pid = await shared_worker.open(self)
+        self.crash = None
+        self.oom_kills = crash_monitor.read_oom_kills()
+        self.started = True
+
+    async def shutdown(self, keep_checkpoint: bool = False):
+        await self._stop_tasks()
+        self.started = False
+        shared_worker.close(self)
+
+    def _write(self, message: dict):
+        shared_worker.send(dict(message, ns=self.session_id))
+
+    async def _send_interrupt(self):
+        self._write({"type": "interrupt"})
+
+    async def configure_figures(self, websocket: WebSocket, message: dict):
+        # pyplot's figures are process-wide: the shared worker shows none
+        await websocket.send_json({"type": "figures", "error": "Not available in the shared engine"})
+
+# CPU seconds a cell on the shared worker may use before it is stopped
+SHARED_CPU_LIMIT = float(os.environ.get("LUNA_SHARED_CPU_LIMIT", 10))
+shared_worker = SharedWorker()
+
+# Per-session execution backends, chosen with ?engine= on /ws (or "engine"
+# on a multiplexed attach)
+ENGINES = {"ipykernel": KernelSession, "lite": LiteSession, "shared": SharedSession}
+DEFAULT_ENGINE = os.environ.get("LUNA_DEFAULT_ENGINE", "ipykernel")
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def forget_session(session_id: str):
+    # Drop a kernel's record from the session store and the runtime dir
+    session_store.remove(session_id)
+    kernel_runtime.remove(session_id)
+
+
+async def recover_kernels():
+    # Find kernels left running by a previous backend process (runtime dir
+    # and any persistent store), keep the ones that answer a heartbeat and
+    # forget the rest. Heartbeats run concurrently: one slow kernel doesn't
+    # delay the others.
+    started = time.monotonic()
+    candidates = {m["session_id"]: m for m in kernel_runtime.scan() if m.get("host") == HOSTNAME}
+    for record in session_store.all(HOSTNAME):
+        candidates.setdefault(record["session_id"], record)
+
+    ids = list(candidates)
+    beats = await asyncio.gather(*(kernel_runtime.heartbeat(candidates[i]["connection_file"]) for i in ids))
+    live = 0
+    for session_id, alive in zip(ids, beats):
+        meta = candidates[session_id]
+        if alive and meta.get("user_id"):
+            session_store.save({
+                "session_id": session_id,
+                "user_id": meta["user_id"],
+                "connection_file": meta["connection_file"],
+                "host": HOSTNAME,
+                "pid": meta.get("pid"),
+            })
+            live += 1
+        else:
+            forget_session(session_id)
+    logger.info(f"Recovered {live} running kernel(s), discarded {len(ids) - live} "
+                f"in {(time.monotonic() - started) * 1000:.0f}ms")
+    return live
+
+async def reap_unclaimed_kernels(ttl: float):
+    # Recovered kernels whose users never came back get a graceful shutdown
+    await asyncio.sleep(ttl)
+    for record in session_store.all(HOSTNAME):
+        if record["session_id"] in sessions:
+            continue
+        session = KernelSession(record["session_id"])
+        if await session.adopt(record):
+            logger.info(f"Shutting down unclaimed kernel for user {record['user_id']}")
+            await session.shutdown()
+
 @app.on_event("startup")
 async def startup_event():
-    # Clean up any leftover kernels if necessary
-    pass
+    if await recover_kernels():
+        asyncio.create_task(reap_unclaimed_kernels(ORPHAN_TTL))
+    if cpu_scheduler.interval > 0:
+        asyncio.create_task(cpu_scheduler.run())
+    if loop_monitor.interval > 0:
+        loop_monitor.start()
 
 @app.on_event("shutdown") 
 async def shutdown_event():
-    for session in sessions.values():
-        await session.shutdown()
+    await loop_monitor.stop()
+    for session_id in list(parked):
+        parked.pop(session_id)[3].cancel()
+    for session in list(sessions.values()):
+        if KEEP_KERNELS_ON_RESTART:
+            await session.detach()
+        else:
+            await session.shutdown()
+    await shared_worker.stop()
+    await asyncio.to_thread(execution_log.flush)
 
 app.mount("/assets", StaticFiles(directory="dist/assets"), name="assets")
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "luna-book"}
+    # Degraded while the event loop has recently been blocked: every
+    # connection's output was delayed by that much
+    status = "degraded" if loop_monitor.degraded else "healthy"
+    return {"status": status, "service": "luna-book", "loop_lag_ms": loop_monitor.metrics()["max_lag_ms"]}
+
+@app.get("/metrics/loop")
+async def loop_metrics():
+    return loop_monitor.metrics()
+
+@app.get("/debug/loop")
+async def debug_loop():
+    # Recent stalls with the stack of the code that blocked the loop
+    return loop_monitor.debug()
+
+@app.get("/metrics/admission")
+async def admission_metrics():
+    return admission.metrics()
+
+@app.get("/metrics/io")
+async def io_metrics():
+    # Latency of workspace file operations, run in the workspace I/O pool
+    return workspace_io.metrics()
+
+@app.get("/metrics/kernels")
+async def kernel_metrics():
+    # Kernel crashes by kind, automatic restarts and restored variables
+    return crash_stats.metrics()
+
+@app.get("/metrics/shared")
+async def shared_metrics():
+    # The shared worker's namespaces, memory and CPU use
+    return shared_worker.metrics()
+
+@app.get("/metrics/replay")
+async def replay_metrics():
+    # Parked sessions and the outputs kept for replay
+    buffers = [session.outputs.metrics() for session in sessions.values()]
+    totals = {key: sum(b[key] for b in buffers) for key in ("cells", "messages", "bytes", "dropped")}
+    return {"parked": len(parked), "sessions": len(buffers), **totals}
+
+@app.get("/metrics/cpu")
+async def cpu_metrics():
+    # Per-user CPU rates and shares, and each kernel's scheduling level
+    return cpu_scheduler.metrics()
+
+def require_admin(token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled (set LUNA_ADMIN_TOKEN)")
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/datasets")
+async def list_datasets():
+    # Shared read-only datasets, loadable in any kernel via luna.datasets.load(name)
+    return {"datasets": shared_datasets.catalog()}
+
+@app.post("/admin/datasets")
+async def publish_dataset(file: UploadFile = File(...), name: str = None,
+                          x_admin_token: str = Header(None)):
+    require_admin(x_admin_token)
+    suffix = os.path.splitext(file.filename)[1]
+    fd, upload_path = tempfile.mkstemp(suffix=suffix)
+    try:
+        os.close(fd)
+        await workspace_io.run("upload", workspace_io.save_upload, file.file, upload_path)
+        dataset_name = name or os.path.splitext(os.path.basename(file.filename))[0]
+        # Parsing and conversion can take seconds for big files; keep it off the loop
+        manifest = await asyncio.to_thread(shared_datasets.publish, upload_path, dataset_name)
+        logger.info(f"Published shared dataset {dataset_name} ({manifest['rows']} rows)")
+        return {"status": "published", "dataset": manifest}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.remove(upload_path)
+
+@app.delete("/admin/datasets/{name}")
+async def remove_dataset(name: str, x_admin_token: str = Header(None)):
+    require_admin(x_admin_token)
+    try:
+        await workspace_io.run("rmtree", shared_datasets.remove, name)
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=404, detail=f"Unknown dataset {name}")
+    return {"status": "removed", "name": name}
+
+async def notebook_call(fn, *args, **kwargs):
+    # Notebook I/O (hashing, fsync) runs in a worker thread, off the event loop
+    try:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    except VersionConflict as e:
+        raise HTTPException(status_code=409, detail={"error": str(e), "version": e.current})
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Notebook not found")
+    except (ValueError, TypeError, IndexError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/notebooks/{user_id}")
+async def list_notebooks(user_id: str):
+    return {"notebooks": await notebook_call(notebook_store.list, user_id)}
+
+@app.get("/notebooks/{user_id}/{notebook_id}")
+async def load_notebook(user_id: str, notebook_id: str, version: int = None, refs: bool = False):
+    # refs=true leaves outputs as hashes for clients that cache them
+    return await notebook_call(notebook_store.load, user_id, notebook_id, version, refs)
+
+@app.get("/notebooks/{user_id}/{notebook_id}/versions")
+async def notebook_versions(user_id: str, notebook_id: str):
+    return {"versions": await notebook_call(notebook_store.versions, user_id, notebook_id)}
+
+@app.put("/notebooks/{user_id}/{notebook_id}")
+async def save_notebook(user_id: str, notebook_id: str, notebook: dict = Body(...)):
+    document = await notebook_call(notebook_store.save, user_id, notebook_id, notebook,
+                                   notebook.get("baseVersion"))
+    return {"id": notebook_id, "version": document["version"]}
+
+@app.patch("/notebooks/{user_id}/{notebook_id}")
+async def patch_notebook(user_id: str, notebook_id: str, patch: dict = Body(...)):
+    # {"baseVersion": n, "ops": [...]}: see NotebookStore.patch
+    ops = patch.get("ops", [])
+    document = await notebook_call(notebook_store.patch, user_id, notebook_id, ops, patch.get("baseVersion"))
+    # Hashes of the outputs just stored: the client can send {"$ref": hash}
+    # for unchanged outputs next time instead of re-uploading them
+    touched = {op["cell"]["id"] for op in ops if op.get("op") == "upsert"}
+    return {"id": notebook_id, "version": document["version"],
+            "outputs": {c["id"]: c["outputs"] for c in document["cells"] if c["id"] in touched}}
+
+@app.get("/notebooks/{user_id}/outputs/{digest}")
+async def notebook_output(user_id: str, digest: str):
+    return await notebook_call(notebook_store.get_output, user_id, digest)
+
+def parse_time(value: str):
+    # Epoch seconds or an ISO date/datetime (UTC unless it says otherwise)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid time {value!r}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+@app.get("/history/{user_id}")
+async def execution_history(user_id: str, since: str = None, until: str = None, session: str = None,
+                            status: str = None, limit: int = 100):
+    try:
+        entries = await asyncio.to_thread(execution_log.query, user_id, parse_time(since), parse_time(until),
+                                          session, status, min(limit, 10_000))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"summary": summarize_history(entries), "entries": entries}
+
+@app.get("/outputs/{user_id}/{name}")
+async def serve_output(user_id: str, name: str):
+    digest, _, kind = name.partition(".")
+    if kind not in OUTPUT_TYPES:
+        raise HTTPException(status_code=404, detail="Unknown output type")
+    try:
+        payload = await asyncio.to_thread(output_store.get, user_id, digest)
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=404, detail="Output not found")
+    # The name is the content hash: it can be cached forever
+    return Response(payload, media_type=OUTPUT_TYPES[kind],
+                    headers={"Cache-Control": "private, max-age=31536000, immutable", "ETag": f'"{digest}"'})
 
 @app.get("/")
 async def get_index():
@@ -338,8 +1897,7 @@ async def get_file(filename: str):
 async def upload_file(file: UploadFile = File(...)):
     try:
         file_path = os.path.join(WORKING_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await workspace_io.run("upload", workspace_io.save_upload, file.file, file_path)
         return {"filename": file.filename, "status": "uploaded"}
     except Exception as e:
         return {"error": str(e)}
@@ -352,49 +1910,360 @@ async def restart_kernel_endpoint():
     # We will rely on page refresh -> new websocket -> new kernel.
     return {"status": "Use WebSocket execution to manage state"}
 
+async def find_orphaned_sessions(user_id: str, session_id: str = None):
+    # Kernels recorded for this user on this host that no live connection owns
+    # (left behind by a previous backend process) and that this connection may
+    # take over: the requested one, or without a request the user's only one.
+    # Never an arbitrary one: it could be another notebook's kernel
+    records = await workspace_io.run("record", session_store.find_for_user, user_id)
+    records = [r for r in records if r["session_id"] not in sessions]
+    if session_id:
+        return [r for r in records if r["session_id"] == session_id]
+    return records if len(records) == 1 else []
+
+async def claim_session(user_id: str, orphans, engine: str = None):
+    """(session, resumed): the first orphaned kernel that answers, else a new, unstarted session.
+
+    Either way the session is registered in `sessions`. New sessions run on
+    `engine` (DEFAULT_ENGINE if None).
+    """
+    for record in orphans:
+        candidate = KernelSession(record["session_id"])
+        sessions[candidate.session_id] = candidate  # claim it before awaiting
+        try:
+            adopted = await candidate.adopt(record)
+        except BaseException:
+            del sessions[candidate.session_id]
+            raise
+        if adopted:
+            return candidate, True
+        del sessions[candidate.session_id]
+    session = ENGINES[engine or DEFAULT_ENGINE](str(uuid.uuid4()))
+    sessions[session.session_id] = session
+    return session, False
+
+class Relay:
+    """What a connection's session sends through; re-pointed when a parked session is resumed.
+
+    While parked (target None) messages are dropped: outputs are in the
+    session's replay buffer.
+    """
+
+    def __init__(self, target):
+        self.target = target
+
+    def __getattr__(self, attr):
+        return getattr(self.target, attr)
+
+    async def send_json(self, message: dict, raw=None):
+        if self.target is not None:
+            await self.target.send_json(message, raw=raw)
+
+# session_id -> (session, admission ticket, relay, expiry TimerHandle)
+parked = {}
+
+def park(session: KernelSession, ticket, relay: Relay):
+    relay.target = None
+    logger.info(f"Parking session {session.session_id} for {RECONNECT_GRACE:g}s")
+    expiry = asyncio.get_running_loop().call_later(
+        RECONNECT_GRACE, lambda: asyncio.ensure_future(expire_parked(session.session_id)))
+    parked[session.session_id] = (session, ticket, relay, expiry)
+
+def unpark(user_id: str, session_id: str):
+    """(session, ticket, relay) of the user's parked session, or None."""
+    entry = parked.get(session_id)
+    if entry is None or entry[0].user_id != user_id:
+        return None
+    del parked[session_id]
+    entry[3].cancel()
+    return entry[:3]
+
+async def expire_parked(session_id: str):
+    entry = parked.pop(session_id, None)
+    if entry is None:
+        return
+    session, ticket, _, _ = entry
+    logger.info(f"Parked session {session_id} was not resumed, shutting down")
+    try:
+        await session.shutdown()
+        sessions.pop(session_id, None)
+    finally:
+        admission.leave(ticket)
+
+class Channel:
+    """A named session on a multiplexed connection: tags everything it sends."""
+
+    def __init__(self, connection, name: str):
+        self.connection = connection
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self.connection, attr)
+
+    async def send_json(self, message: dict, raw=None):
+        await self.connection.send_json({**message, "channel": self.name}, raw=raw)
+
+class Multiplexer:
+    """Named sessions (channels) attached to a connection besides its own session.
+
+    {"type": "attach", "channel": name} gives the channel a kernel of its own
+    (admitted like a connection; "sessionId" re-attaches to one still
+    running), {"type": "attach", "channel": name, "shareWith": other} runs it
+    on the kernel of channel `other` ("" = the connection's own session).
+    Messages carrying "channel" go to that channel's kernel and what it sends
+    back is tagged with the channel; untagged messages are the connection's
+    own session, as before. {"type": "detach", "channel": name} closes the
+    channel and its kernel, unless another channel still shares it. A
+    dropped connection parks the channels' kernels like its own session, and
+    attaching with their "sessionId" resumes them.
+    """
+
+    def __init__(self, connection, user_id: str, ip: str, primary: KernelSession):
+        self.connection = connection
+        self.user_id = user_id
+        self.ip = ip
+        self.primary = primary
+        self.channels = {}  # name -> (Relay to a Channel, KernelSession)
+        self.owned = {}  # session_id -> (KernelSession, admission ticket, Relay) started for channels
+        self.attaching = {}  # name -> task
+
+    async def route(self, message: dict):
+        name = message.get("channel")
+        msg_type = message.get("type")
+        if not isinstance(name, str) or not name or len(name) > 128:
+            await self.connection.send_json({"type": "detached", "channel": name, "error": "Invalid channel name"})
+        elif msg_type == "attach":
+            if name in self.channels:
+                # Attaching twice is harmless: repeat the answer
+                session = self.channels[name][1]
+                await self.channels[name][0].send_json(
+                    {"type": "attached", "sessionId": session.session_id, "resumed": True})
+            elif name not in self.attaching:
+                self.attaching[name] = asyncio.create_task(self.attach(name, message))
+        elif msg_type == "detach":
+            await self.detach(name)
+        elif name in self.channels:
+            channel, session = self.channels[name]
+            await session.route(channel, message)
+        else:
+            await self.connection.send_json({"type": "detached", "channel": name, "error": "Channel not attached"})
+
+    async def attach(self, name: str, message: dict):
+        channel = Channel(self.connection, name)
+        relay = Relay(channel)
+        try:
+            share = message.get("shareWith")
+            if share is not None:
+                session = self.primary if share == "" else self.channels.get(share, (None, None))[1]
+                if session is None:
+                    await channel.send_json({"type": "detached", "error": f"No channel {share!r} to share"})
+                    return
+                self.channels[name] = (relay, session)
+                await channel.send_json({"type": "attached", "sessionId": session.session_id,
+                                         "resumed": False, "shared": True})
+                return
+
+            requested = message.get("sessionId")
+            resuming = unpark(self.user_id, requested) if requested else None
+            if resuming:
+                # Parked by a dropped connection: its outputs now come to this channel
+                session, ticket, relay = resuming
+                relay.target = channel
+                self.owned[session.session_id] = (session, ticket, relay)
+                self.channels[name] = (relay, session)
+                await channel.send_json({"type": "attached", "sessionId": session.session_id,
+                                         "resumed": True, "shared": False, "engine": session.engine})
+                return
+
+            engine = message.get("engine") or DEFAULT_ENGINE
+            if engine not in ENGINES:
+                await channel.send_json({"type": "detached", "error": f"Unknown engine {engine!r}"})
+                return
+            orphans = []
+            if requested and engine == "ipykernel":
+                orphans = await find_orphaned_sessions(self.user_id, requested)
+            try:
+                ticket = admission.enter(self.user_id, self.ip, starts_kernel=not orphans)
+            except Rejected as e:
+                await channel.send_json({"type": "rejected", "reason": e.reason, "retryAfter": e.retry_after})
+                return
+
+            async def report(position, length):
+                await channel.send_json({"type": "queued", "position": position, "queueLength": length})
+
+            try:
+                await admission.wait(ticket, report)
+                session, resumed = await claim_session(self.user_id, orphans, engine)
+            except BaseException:
+                admission.leave(ticket)
+                raise
+            self.owned[session.session_id] = (session, ticket, relay)
+            session.client = relay
+            if not resumed:
+                try:
+                    await admission.start_token()
+                    await session.start(user_id=self.user_id)
+                except asyncio.CancelledError:
+                    # Detached (or disconnected) while starting
+                    await self._close(session.session_id, keep=False)
+                    raise
+                except Exception as e:
+                    await self._close(session.session_id, keep=False)
+                    await channel.send_json({"type": "detached", "error": f"Kernel failed to start: {e}"})
+                    return
+            self.channels[name] = (relay, session)
+            await channel.send_json({"type": "attached", "sessionId": session.session_id,
+                                     "resumed": resumed, "shared": False, "engine": session.engine})
+        finally:
+            self.attaching.pop(name, None)
+
+    async def detach(self, name: str):
+        if name in self.attaching:
+            self.attaching.pop(name).cancel()
+        if name in self.channels:
+            _, session = self.channels.pop(name)
+            shared = session is self.primary or any(s is session for _, s in self.channels.values())
+            if not shared and session.session_id in self.owned:
+                await self._close(session.session_id, keep=False)
+        await self.connection.send_json({"type": "detached", "channel": name})
+
+    async def _close(self, session_id: str, keep: bool):
+        session, ticket, _ = self.owned.pop(session_id)
+        try:
+            if keep:
+                await session.detach()
+            else:
+                await session.shutdown()
+            sessions.pop(session_id, None)
+        finally:
+            admission.leave(ticket)
+
+    async def close(self, keep: bool = False, park_sessions: bool = False):
+        tasks = list(self.attaching.values())
+        for task in tasks:
+            task.cancel()
+        # Let cancelled attaches give their admission tickets back first
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for relay, _ in self.channels.values():
+            relay.target = None
+        self.channels.clear()
+        for session_id in list(self.owned):
+            session, ticket, relay = self.owned[session_id]
+            if park_sessions and session.started:
+                del self.owned[session_id]
+                park(session, ticket, relay)
+            else:
+                await self._close(session_id, keep)
+
+async def wait_for_admission(websocket, ticket):
+    # Queued: report the position until a kernel slot is free, and notice a
+    # client that gives up meanwhile (its messages are dropped until then)
+    async def report(position, length):
+        await websocket.send_json({"type": "queued", "position": position, "queueLength": length})
+
+    waiter = asyncio.ensure_future(admission.wait(ticket, report))
+    try:
+        while not waiter.done():
+            receiver = asyncio.ensure_future(websocket.receive_json())
+            await asyncio.wait({waiter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver.done():
+                receiver.result()  # raises WebSocketDisconnect
+            else:
+                receiver.cancel()
+        waiter.result()
+    finally:
+        waiter.cancel()
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, userId: str = "guest"):
-    await websocket.accept()
-    
-    # Create new session for this connection
-    session_id = str(uuid.uuid4())
-    session = KernelSession(session_id)
-    sessions[session_id] = session
+async def websocket_endpoint(websocket: WebSocket, userId: str = "guest", sessionId: str = None,
+                             engine: str = None):
+    subprotocol = protocol.negotiate(websocket.scope.get("subprotocols"))
+    await websocket.accept(subprotocol=subprotocol)
+    # Sessions send through the connection in whichever encoding was negotiated
+    websocket = protocol.Connection(websocket, subprotocol)
+
+    engine = engine or DEFAULT_ENGINE
+    if engine not in ENGINES:
+        await websocket.send_json({"type": "rejected", "reason": f"Unknown engine {engine!r}"})
+        await websocket.close(code=1008)
+        return
+    ip = websocket.client.host if websocket.client else ""
+    # A session this user's dropped connection left parked comes back with its slot
+    resuming = unpark(userId, sessionId) if sessionId else None
+    if resuming:
+        session, ticket, relay = resuming
+    else:
+        session, relay = None, None
+        # Only kernels are re-adopted: lite workers don't outlive their backend
+        resumable = engine == "ipykernel"
+        orphans = await find_orphaned_sessions(userId, sessionId) if resumable else []
+        try:
+            ticket = admission.enter(userId, ip, starts_kernel=not orphans)
+        except Rejected as e:
+            await websocket.send_json({"type": "rejected", "reason": e.reason, "retryAfter": e.retry_after})
+            await websocket.close(code=1013)
+            return
+
+    channels = None
+    detach = False
+    keep_parked = False
     
     try:
-        await session.start(user_id=userId)
+        if resuming:
+            # Its running cell's outputs now come here; earlier ones via replay
+            relay.target = websocket
+            resumed = True
+            logger.info(f"Resumed parked session {session.session_id} for user {userId}")
+        else:
+            if not ticket.granted:
+                await wait_for_admission(websocket, ticket)
+                orphans = await find_orphaned_sessions(userId, sessionId) if resumable else []
 
-        
-        while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
-            
-            msg_type = message.get("type")
-            
-            if msg_type == "execute":
-                code = message.get("code")
-                cell_id = message.get("cellId")
-                await session.execute(websocket, code, cell_id)
-            
-            elif msg_type == "input_reply":
-                value = message.get("value")
-                await session.input(value)
+            # Prefer a kernel this user left running before a backend restart
+            session, resumed = await claim_session(userId, orphans, engine)
+            relay = Relay(websocket)
+            session.client = relay  # notified of crashes even before its first message
+            if not resumed:
+                await admission.start_token()
+                await session.start(user_id=userId)
+        session_id = session.session_id
+        await websocket.send_json({"type": "session", "sessionId": session_id, "resumed": resumed,
+                                   "engine": session.engine})
 
-            elif msg_type == "restart":
-                # Handle restart request
-                logger.info(f"Restarting kernel for session {session_id}")
-                await session.shutdown()
-                await session.start()
-                await websocket.send_json({"type": "restart_success", "content": "Kernel restarted successfully"})
+        channels = Multiplexer(websocket, userId, ip, session)
+        while True:
+            message = await websocket.receive_json()
+            if "channel" in message:
+                await channels.route(message)
+            else:
+                await session.route(relay, message)
                 
-    except WebSocketDisconnect:
-        logger.info(f"WebSocket disconnected for session {session_id}")
+    except WebSocketDisconnect as e:
+        logger.info(f"WebSocket disconnected for user {userId}")
+        # 1012 = server restarting: keep the kernel for the next process
+        detach = e.code == 1012 and KEEP_KERNELS_ON_RESTART
+        # Dropped rather than closed (1000): the client may be back in a moment
+        keep_parked = e.code not in (1000, 1012) and RECONNECT_GRACE > 0
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
     finally:
-        await session.shutdown()
-        if session_id in sessions:
-            del sessions[session_id]
+        try:
+            if channels:
+                await channels.close(keep=detach, park_sessions=keep_parked)
+            if session:
+                if keep_parked and session.started:
+                    park(session, ticket, relay)
+                    ticket = None  # the parked session keeps the slot
+                else:
+                    if detach:
+                        await session.detach()
+                    else:
+                        await session.shutdown()
+                    sessions.pop(session.session_id, None)
+        finally:
+            # Even if cancelled while shutting down: the slot must come back
+            if ticket is not None:
+                admission.leave(ticket)
 
 if __name__ == "__main__":
     import uvicorn
@@ -402,4 +2271,4 @@ if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8020))
     # Bind to 0.0.0.0 for external access in cloud environments
     print(f"Starting Luna Book with Real Jupyter Backend on http://0.0.0.0:{port}")
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=port, ws_per_message_deflate=WS_DEFLATE)
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""Start latency, memory and users per GB of each engine: ipykernel, lite, shared.
+
+Starts N sessions of an engine through the backend's own session classes
+(workspace, startup code and all), keeps them all open, runs a small cell
+in each, then sums the resident memory of the distinct processes behind
+them from /proc/<pid>/status (Linux): N kernels or lite workers, or the one
+shared worker hosting N namespaces. Memory per user is that sum over N, so
+the shared worker's fixed cost is spread over the users it holds; run it
+with the number of users you expect per backend (--shared-sessions).
+Latency is until the session accepts cells, as a user sees it.
+
+    python benchmarks/bench_engines.py --sessions 5 --shared-sessions 200
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # the backend resolves its storage and worker paths from the cwd
+
+import backend  # noqa: E402
+import kernel_runtime  # noqa: E402
+
+USER = "bench_engines"
+CELL = "numbers = [i * i for i in range(1000)]\ntotal = sum(numbers)\nprint(total)"
+
+
+class Sink:
+    async def send_json(self, message, raw=None):
+        pass
+
+
+async def measure(engine, count):
+    sessions, starts = [], []
+    try:
+        for i in range(count):
+            session = backend.ENGINES[engine](f"bench-{engine}-{i}")
+            sessions.append(session)
+            started = time.perf_counter()
+            await session.start(USER)
+            starts.append(time.perf_counter() - started)
+            await session.execute(Sink(), CELL, "bench")
+        total = sum(kernel_runtime.rss_bytes(pid) or 0 for pid in {s.kernel_pid for s in sessions})
+    finally:
+        for session in sessions:
+            await session.shutdown()
+        await backend.shared_worker.stop()
+    return starts, total / count
+
+
+async def run(counts):
+    return {engine: await measure(engine, count) for engine, count in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=5, help="sessions of ipykernel and lite")
+    parser.add_argument("--shared-sessions", type=int, default=200, help="namespaces on the shared worker")
+    parser.add_argument("--engines", nargs="+", default=list(backend.ENGINES), choices=list(backend.ENGINES))
+    args = parser.parse_args()
+
+    kernel_runtime.RUNTIME_DIR = tempfile.mkdtemp(prefix="luna-bench-")
+    backend.crash_monitor.CHECKPOINT_INTERVAL = 0
+    counts = {e: args.shared_sessions if e == "shared" else args.sessions for e in args.engines}
+    try:
+        results = asyncio.run(run(counts))
+    finally:
+        shutil.rmtree(kernel_runtime.RUNTIME_DIR, ignore_errors=True)
+        shutil.rmtree(os.path.join(ROOT, "storage", USER), ignore_errors=True)
+
+    mib = 2 ** 20
+    print(f"{'engine':<12}{'sessions':>9}{'start p50 ms':>14}{'start max ms':>14}{'MiB/user':>10}{'users/GB':>10}")
+    for engine, (starts, per_user) in results.items():
+        print(f"{engine:<12}{len(starts):>9}{statistics.median(starts) * 1000:>14.1f}"
+              f"{max(starts) * 1000:>14.1f}{per_user / mib:>10.2f}{2 ** 30 / per_user:>10.0f}")
+    if "ipykernel" in results:
+        kernel = results["ipykernel"][1]
+        for engine, (_, per_user) in results.items():
+            if engine != "ipykernel":
+                print(f"{engine} vs ipykernel: {kernel / per_user:.1f}x users per GB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Per-figure render latency and payload size: inline PNG vs luna.figures.
+
+Figures like those of the plotting notebooks (a line plot, a 5000-point
+scatter, a heatmap with a colorbar, a 2x2 grid of histograms) rendered:
+
+  inline        what `%matplotlib inline` does: PNG at the figure's DPI,
+                bbox_inches="tight", base64
+  png/svg/webp  luna.figures.render() in each format for a desktop output
+                area (1x screen, 1000px) and a phone (2x screen, 360px)
+  cached        render() again of a figure that hasn't changed
+
+Size is what goes to the backend: base64 for raster, text for SVG. Then N
+figures rendered one after the other versus handed to render threads, as
+plt.show() does with LUNA_FIGURE_THREADS (wall time; a gain needs more
+than one core).
+
+    python benchmarks/bench_figures.py --rounds 5 --threads 2
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import matplotlib  # noqa: E402
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+from IPython.core.pylabtools import print_figure  # noqa: E402
+
+from luna import figures  # noqa: E402
+
+SCREENS = {"desktop": {"width": 1000, "pixel_ratio": 1}, "phone": {"width": 360, "pixel_ratio": 2}}
+
+
+def line():
+    fig, ax = plt.subplots()
+    x = np.linspace(0, 10, 500)
+    ax.plot(x, np.sin(x), marker="o", markersize=2)
+    ax.set_title("line")
+    return fig
+
+
+def scatter():
+    fig, ax = plt.subplots()
+    rng = np.random.default_rng(0)
+    ax.scatter(rng.normal(size=5000), rng.normal(size=5000), s=3, alpha=0.5)
+    return fig
+
+
+def heatmap():
+    fig, ax = plt.subplots()
+    image = ax.imshow(np.random.default_rng(1).random((50, 50)))
+    fig.colorbar(image)
+    return fig
+
+
+def histograms():
+    fig, axes = plt.subplots(2, 2)
+    rng = np.random.default_rng(2)
+    for ax in axes.flat:
+        ax.hist(rng.gamma(2, size=2000), bins=40)
+    fig.tight_layout()
+    return fig
+
+
+FIGURES = [line, scatter, heatmap, histograms]
+
+
+def timed(render, fig, rounds):
+    times = []
+    for _ in range(rounds):
+        fig.stale = True  # force a render; the cache is measured separately
+        started = time.perf_counter()
+        size = render(fig)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times), size
+
+
+def bundle_size(bundle):
+    return sum(len(v) for v in bundle[0].values())
+
+
+def measure(rounds):
+    rows = []
+    for make in FIGURES:
+        fig = make()
+        rows.append((make.__name__, "inline", "-", *timed(lambda f: len(print_figure(f, "png", base64=True,
+                                                                                    bbox_inches="tight")),
+                                                         fig, rounds)))
+        for screen, settings in SCREENS.items():
+            for format in figures.FORMATS:
+                figures.configure(format=format, **settings)
+                rows.append((make.__name__, format, screen,
+                             *timed(lambda f: bundle_size(figures.render(f)), fig, rounds)))
+        figures.render(fig)
+        started = time.perf_counter()
+        size = bundle_size(figures.render(fig))
+        rows.append((make.__name__, "cached", screen, time.perf_counter() - started, size))
+        plt.close(fig)
+    return rows
+
+
+def measure_threads(threads, count, rounds):
+    figures.configure(format="png", **SCREENS["desktop"])
+    serial, pooled = [], []
+    with ThreadPoolExecutor(threads) as pool:
+        for _ in range(rounds):
+            batch = [FIGURES[i % len(FIGURES)]() for i in range(count)]
+            started = time.perf_counter()
+            for fig in batch:
+                fig.stale = True
+                figures.render(fig)
+            serial.append(time.perf_counter() - started)
+            for fig in batch:
+                fig.stale = True
+            started = time.perf_counter()
+            for future in [pool.submit(figures.render, fig) for fig in batch]:
+                future.result()
+            pooled.append(time.perf_counter() - started)
+            plt.close("all")
+    return statistics.median(serial), statistics.median(pooled)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=2, help="render threads for the batch")
+    parser.add_argument("--batch", type=int, default=8, help="figures per batch")
+    args = parser.parse_args()
+
+    print(f"{'figure':<12}{'render':<8}{'screen':<9}{'p50 ms':>9}{'KiB':>9}")
+    for name, render, screen, seconds, size in measure(args.rounds):
+        print(f"{name:<12}{render:<8}{screen:<9}{seconds * 1000:>9.1f}{size / 1024:>9.1f}")
+
+    serial, pooled = measure_threads(args.threads, args.batch, args.rounds)
+    print(f"\n{args.batch} figures: {serial * 1000:.0f} ms in the cell, "
+          f"{pooled * 1000:.0f} ms on {args.threads} threads ({os.cpu_count()} CPUs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""CPU cost of encoding outbound /ws messages as JSON text.
+
+Message mixes, each encoded with:
+
+  stdlib        json.dumps as Starlette's send_json does it
+  fallback      protocol without orjson (cached stream envelopes)
+  protocol      protocol with orjson, when installed
+
+plus, for kernel helper results (variables/rows), parsing the helper's JSON
+and re-encoding it versus splicing it in as RawJSON.
+
+    python benchmarks/bench_json_encode.py --rounds 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import protocol  # noqa: E402
+from protocol import Connection, RawJSON  # noqa: E402
+
+
+def make_mixes():
+    rng = random.Random(0)
+    cell = "cell-0f8fad5b-d9cb-469f-a165-70867728950e"
+    stream = [{"cellId": cell, "type": "stream", "text": f"epoch {i}: loss={rng.random():.4f}\n", "name": "stdout"}
+              for i in range(100)]
+    html = "<table class=\"dataframe\"><tbody>" + "".join(
+        f"<tr><th>{i}</th>" + "".join(f"<td>{rng.random():.6f}</td>" for _ in range(8)) + "</tr>" for i in range(200)
+    ) + "</tbody></table>"
+    table = [{"cellId": cell, "type": "execute_result", "html": html, "text": "<DataFrame 200x8>"}]
+    frame = [{"cellId": cell, "type": "execute_result", "frame": {
+        "handle": "f1", "columns": [{"name": f"c{j}", "dtype": "float64"} for j in range(10)],
+        "rows": [[rng.random() for _ in range(10)] for _ in range(50)], "total": 10000}}]
+    traceback = [{"cellId": cell, "type": "error", "ename": "KeyError", "evalue": "'x'",
+                  "traceback": ["\x1b[0;31m" + "-" * 75 + "\x1b[0m"] + [f"File \x1b[0;32m/lib/mod{i}.py:{i}\x1b[0m, in f{i}" for i in range(30)]}]
+    return {"stream chunks": stream, "html table": table, "frame page": frame, "traceback": traceback}
+
+
+def per_message_us(encode, messages, rounds):
+    started = time.process_time()
+    for _ in range(rounds):
+        for message in messages:
+            encode(message)
+    return (time.process_time() - started) / rounds / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rounds", type=int, default=500)
+    args = parser.parse_args()
+
+    def stdlib(message):
+        return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+    orjson = protocol.orjson
+    print(f"orjson: {'installed' if orjson else 'not installed'}\n")
+    print(f"{'mix':<14} {'KB/msg':>7} {'stdlib us':>10} {'fallback us':>12} {'protocol us':>12}")
+    for name, messages in make_mixes().items():
+        size = sum(len(stdlib(m)) for m in messages) / len(messages) / 1024
+        baseline = per_message_us(stdlib, messages, args.rounds)
+        protocol.orjson = None
+        try:
+            fallback = per_message_us(Connection(None).encode_text, messages, args.rounds)
+        finally:
+            protocol.orjson = orjson
+        fast = per_message_us(Connection(None).encode_text, messages, args.rounds) if orjson else float("nan")
+        print(f"{name:<14} {size:>7.2f} {baseline:>10.2f} {fallback:>12.2f} {fast:>12.2f}")
+
+    # A variables summary as returned by the kernel helper
+    rng = random.Random(1)
+    summary = json.dumps({"variables": [{"name": f"v{i}", "type": "DataFrame", "shape": [1000, 8], "preview": [
+        [rng.random() for _ in range(8)] for _ in range(5)]} for i in range(50)], "total": 50})
+    head = {"type": "variables", "requestId": 7}
+    rounds = max(1, args.rounds // 5)
+    reencode = per_message_us(lambda raw: protocol.dumps({**head, **protocol.loads(raw)}), [summary], rounds)
+    spliced = per_message_us(lambda raw: protocol.splice(protocol.dumps(head), RawJSON(raw)), [summary], rounds)
+    print(f"\nhelper result ({len(summary) / 1024:.1f} KB): parse + re-encode {reencode:.1f} us, splice {spliced:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Save latency for a large notebook: whole-document writes vs per-cell patches.
+
+Builds a notebook with --cells cells of which --plots carry a base64 PNG of
+--plot-kb KB, then times:
+
+  full-json    json.dumps the whole document (outputs inline) + atomic write,
+               i.e. what saving the client's document on every edit costs
+  store-save   NotebookStore.save of the same document (outputs deduplicated)
+  patch-code   NotebookStore.patch editing one cell's code
+  patch-plot   NotebookStore.patch re-running one plot cell (new image)
+
+    python benchmarks/bench_notebook_save.py --cells 200 --plots 60 --rounds 50
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from notebook_store import NotebookStore, _write_atomic  # noqa: E402
+
+
+def make_notebook(cells, plots, plot_kb):
+    notebook = {"name": "bench", "cells": []}
+    for i in range(cells):
+        cell = {"id": f"cell-{i}", "code": f"# cell {i}\n" + "x = compute(x)\n" * 10, "outputs": []}
+        if i % max(1, cells // max(plots, 1)) == 0 and sum(1 for c in notebook["cells"] if c["outputs"]) < plots:
+            png = base64.b64encode(os.urandom(plot_kb * 768)).decode()
+            cell["outputs"] = [{"type": "image", "data": png}]
+        else:
+            cell["outputs"] = [{"type": "stream", "text": f"result {i}\n"}]
+        notebook["cells"].append(cell)
+    return notebook
+
+
+def timed(fn, rounds):
+    samples = []
+    for i in range(rounds):
+        started = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cells", type=int, default=200)
+    parser.add_argument("--plots", type=int, default=60)
+    parser.add_argument("--plot-kb", type=int, default=80)
+    parser.add_argument("--rounds", type=int, default=30)
+    parser.add_argument("--no-fsync", action="store_true")
+    args = parser.parse_args()
+
+    notebook = make_notebook(args.cells, args.plots, args.plot_kb)
+    fsync = not args.no_fsync
+    plot_cell = next(c for c in notebook["cells"] if c["outputs"][0]["type"] == "image")
+
+    with tempfile.TemporaryDirectory() as root:
+        store = NotebookStore(root, fsync=fsync)
+        full_path = os.path.join(root, "full.json")
+
+        def full_json(i):
+            _write_atomic(full_path, json.dumps(notebook).encode("utf-8"), fsync)
+
+        def store_save(i):
+            store.save("bench", "full", notebook)
+
+        store.save("bench", "nb", notebook)
+
+        def patch_code(i):
+            store.patch("bench", "nb", [{"op": "upsert", "cell": {
+                "id": "cell-7", "code": f"x = {i}", "outputs": [{"type": "stream", "text": f"{i}\n"}]}}])
+
+        def patch_plot(i):
+            png = base64.b64encode(os.urandom(args.plot_kb * 768)).decode()
+            store.patch("bench", "nb", [{"op": "upsert", "cell": dict(
+                plot_cell, outputs=[{"type": "image", "data": png}])}])
+
+        doc_kb = len(json.dumps(notebook)) / 1024
+        manifest_kb = os.path.getsize(os.path.join(root, "bench", ".notebooks", "nb", "notebook.json")) / 1024
+        print(f"{args.cells} cells, {args.plots} plots x {args.plot_kb} KB, fsync={'on' if fsync else 'off'}")
+        print(f"document {doc_kb:,.0f} KB inline, stored document {manifest_kb:,.0f} KB + outputs\n")
+        print(f"{'operation':<12} {'median ms':>10} {'p95 ms':>10}")
+        for name, fn in (("full-json", full_json), ("store-save", store_save),
+                         ("patch-code", patch_code), ("patch-plot", patch_plot)):
+            median, p95 = timed(fn, args.rounds)
+            print(f"{name:<12} {median:>10.2f} {p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Scientific-stack benchmark suite: kernel start, imports, NumPy/pandas cells, plots.
+
+Every benchmark runs --rounds times after a warm-up round and checks its
+output, so a broken stack fails instead of timing an error:
+
+  kernel_start        /ws connect until the "session" message: kernel
+                      ready and startup code (numpy, pandas, matplotlib) run
+  import_<module>     `import <module>` in a fresh interpreter
+  numpy_* pandas_*    cells run over /ws (the backend's own endpoint, in
+                      process), from "execute" to "complete"
+  plot_*              cells that draw figures, until every figure is received
+
+Results (samples, median, min, ...) and the environment are written as
+JSON under benchmarks/results/. Each median is compared with a baseline
+(--baseline, saved with --save-baseline); a benchmark slower than the
+baseline by more than --threshold and --min-delta is a regression, and
+the run exits with 1, so CI can gate on it. Baselines are per machine.
+
+    python benchmarks/bench_scientific_stack.py --rounds 5 --save-baseline
+    python benchmarks/bench_scientific_stack.py --rounds 5
+"""
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # the backend resolves its storage and worker paths from the cwd
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+BASELINE = os.path.join(RESULTS_DIR, "scientific_stack_baseline.json")
+USER = "bench_stack"
+IMPORTS = ["numpy", "pandas", "matplotlib.pyplot", "seaborn"]
+
+
+def stdout(seen):
+    return "".join(d.get("text", "") for d in seen if d["type"] == "stream" and d.get("name") == "stdout")
+
+
+def images(seen):
+    return [d for d in seen if d["type"] == "display_data" and (d.get("imageUrl") or d.get("image"))]
+
+
+# name -> (cell, check of the messages it produced)
+WORKLOADS = {
+    "numpy_vector": (
+        "x = np.random.default_rng(0).random(2_000_000)\n"
+        "print(round(float(np.sqrt(x).mean()), 2), round(float(np.sort(x)[len(x) // 2]), 1))",
+        lambda seen: stdout(seen) == "0.67 0.5\n",
+    ),
+    "numpy_linalg": (
+        "a = np.random.default_rng(1).random((300, 300)) + 300 * np.eye(300)\n"
+        "print(np.allclose(a @ np.linalg.inv(a), np.eye(300)), np.linalg.matrix_rank(a))",
+        lambda seen: stdout(seen) == "True 300\n",
+    ),
+    # The array demo of test_numpy_jupyter.py
+    "numpy_demo": (
+        "arr = np.array([10, 20, 30, 40, 50, 60])\n"
+        "print('Sum:', np.sum(arr), 'Mean:', np.mean(arr), 'Std:', round(float(np.std(arr)), 2))\n"
+        "print(arr.reshape(2, 3), np.sqrt(np.square(arr)))",
+        lambda seen: stdout(seen).startswith("Sum: 210 Mean: 35.0 Std: 17.08\n"),
+    ),
+    "pandas_groupby": (
+        "rng = np.random.default_rng(2)\n"
+        "df = pd.DataFrame({'key': rng.integers(0, 1000, 200_000), 'value': rng.random(200_000)})\n"
+        "stats = df.groupby('key')['value'].agg(['mean', 'count', 'max'])\n"
+        "merged = df.merge(stats, left_on='key', right_index=True)\n"
+        "print(stats.shape, len(merged), int(stats['count'].sum()))",
+        lambda seen: stdout(seen) == "(1000, 3) 200000 200000\n",
+    ),
+    # The DataFrame check of verify_scientific_stack.py
+    "pandas_demo": (
+        "df = pd.DataFrame({'A': [1, 2], 'B': [3, 4]})\nprint(df.to_string())",
+        lambda seen: "   A  B" in stdout(seen),
+    ),
+    # The line plot of test_matplotlib_jupyter.py
+    "plot_line": (
+        "plt.plot([1, 2, 3, 4, 5], [2, 4, 6, 8, 10], marker='o')\n"
+        "plt.xlabel('X values')\nplt.ylabel('Y values')\nplt.title('User Input Line Graph')\nplt.show()",
+        lambda seen: len(images(seen)) == 1,
+    ),
+    # The seaborn plots of test_pandas_seaborn.py
+    "plot_seaborn": (
+        "import seaborn as sns\n"
+        "df = pd.DataFrame({'Hours': [2, 4, 6, 8, 10], 'Marks': [50, 65, 75, 85, 95],\n"
+        "                   'Subject': ['Math', 'Science', 'English', 'History', 'Physics']})\n"
+        "df['Marks'] = df['Marks'].fillna(df['Marks'].mean())\n"
+        "sns.set_theme(style='darkgrid')\n"
+        "plt.figure(figsize=(10, 6))\nsns.lineplot(x='Hours', y='Marks', data=df)\nplt.show()\n"
+        "plt.figure(figsize=(10, 6))\nsns.barplot(x='Subject', y='Marks', data=df)\n"
+        "plt.xticks(rotation=45)\nplt.show()",
+        lambda seen: len(images(seen)) == 2,
+    ),
+}
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def receive_until(websocket, predicate):
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if predicate(data):
+            return seen
+
+
+def measure_kernel_start(client, rounds):
+    samples = []
+    for i in range(rounds + 1):
+        started = time.perf_counter()
+        with client.websocket_connect(f"/ws?userId={USER}&engine=ipykernel") as websocket:
+            hello = receive_until(websocket, lambda d: d["type"] in ("session", "rejected"))[-1]
+            elapsed = time.perf_counter() - started
+            if hello["type"] != "session":
+                raise CheckFailed(f"kernel_start: connection rejected: {hello}")
+        if i:  # the first start warms the OS caches
+            samples.append(elapsed)
+    return samples
+
+
+def measure_import(module, rounds):
+    code = f"import time\nstarted = time.perf_counter()\nimport {module}\nprint(time.perf_counter() - started)"
+    samples = []
+    for i in range(rounds + 1):
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT)
+        if result.returncode:
+            raise CheckFailed(f"import_{module}: {result.stderr.strip().splitlines()[-1]}")
+        if i:
+            samples.append(float(result.stdout))
+    return samples
+
+
+def measure_cells(client, names, rounds):
+    results = {}
+    with client.websocket_connect(f"/ws?userId={USER}&engine=ipykernel") as websocket:
+        receive_until(websocket, lambda d: d["type"] == "session")
+        for name in names:
+            code, check = WORKLOADS[name]
+            samples = []
+            for i in range(rounds + 1):
+                cell_id = f"{name}-{i}"
+                started = time.perf_counter()
+                websocket.send_json({"type": "execute", "code": code, "cellId": cell_id})
+                seen = receive_until(websocket, lambda d: d["type"] == "complete" and d.get("cellId") == cell_id)
+                elapsed = time.perf_counter() - started
+                errors = [d for d in seen if d["type"] == "error"]
+                if errors or not check(seen):
+                    detail = f"{errors[0]['ename']}: {errors[0]['evalue']}" if errors else stdout(seen)[:200]
+                    raise CheckFailed(f"{name}: unexpected output: {detail!r}")
+                if i:  # the first run imports and warms up
+                    samples.append(elapsed)
+            results[name] = samples
+    return results
+
+
+def summarize(samples):
+    return {
+        "unit": "s",
+        "samples": [round(s, 6) for s in samples],
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def environment():
+    versions = {}
+    for module in ("numpy", "pandas", "matplotlib", "seaborn", "IPython", "ipykernel"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            pass
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.node(),
+        "cpus": os.cpu_count(),
+        "versions": versions,
+    }
+
+
+def compare(results, baseline, threshold, min_delta):
+    """{name: (baseline median or None, status)}; status: ok, regression, improved or new."""
+    verdicts = {}
+    for name, result in results.items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if base is None:
+            verdicts[name] = (None, "new")
+            continue
+        median, reference = result["median"], base["median"]
+        if median > reference * (1 + threshold) and median - reference > min_delta:
+            status = "regression"
+        elif median < reference / (1 + threshold) and reference - median > min_delta:
+            status = "improved"
+        else:
+            status = "ok"
+        verdicts[name] = (reference, status)
+    return verdicts
+
+
+def run(selected, rounds):
+    from fastapi.testclient import TestClient
+    import backend
+    import kernel_runtime
+
+    kernel_runtime.RUNTIME_DIR = tempfile.mkdtemp(prefix="luna-bench-")
+    backend.admission.user_start_burst = 10 ** 6  # one user starting kernels back to back
+    backend.KEEP_KERNELS_ON_RESTART = False  # nothing to re-adopt: shut the kernels down at the end
+    samples = {}
+    try:
+        for module in IMPORTS:
+            name = f"import_{module.split('.')[0]}"
+            if name in selected and importlib.util.find_spec(module.split(".")[0]):
+                samples[name] = measure_import(module, rounds)
+        with TestClient(backend.app) as client:
+            if "kernel_start" in selected:
+                samples["kernel_start"] = measure_kernel_start(client, rounds)
+            cells = [name for name in WORKLOADS if name in selected]
+            if cells:
+                samples.update(measure_cells(client, cells, rounds))
+    finally:
+        shutil.rmtree(kernel_runtime.RUNTIME_DIR, ignore_errors=True)
+        shutil.rmtree(os.path.join(ROOT, "storage", USER), ignore_errors=True)
+    return {name: summarize(values) for name, values in samples.items()}
+
+
+def main():
+    names = ["kernel_start"] + [f"import_{m.split('.')[0]}" for m in IMPORTS] + list(WORKLOADS)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5, help="measured runs per benchmark")
+    parser.add_argument("--only", nargs="+", choices=names, default=names, metavar="NAME",
+                        help=f"benchmarks to run: {', '.join(names)}")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/scientific_stack-<time>.json)")
+    parser.add_argument("--baseline", default=BASELINE, help="results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="also save these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown that is a regression")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="ignore changes smaller than this (s)")
+    args = parser.parse_args()
+
+    try:
+        results = run(set(args.only), args.rounds)
+    except CheckFailed as e:
+        print(f"FAILED {e}")
+        sys.exit(2)
+    report = {
+        "suite": "scientific_stack",
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "rounds": args.rounds,
+        "environment": environment(),
+        "benchmarks": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"scientific_stack-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ("cpus", "python"):
+            if baseline.get("environment", {}).get(key) != report["environment"][key]:
+                print(f"warning: baseline was taken with {key}={baseline['environment'].get(key)}")
+    verdicts = compare(results, baseline, args.threshold, args.min_delta)
+
+    print(f"{'benchmark':<18}{'median ms':>11}{'min ms':>10}{'baseline ms':>13}{'change':>9}  status")
+    for name, result in results.items():
+        reference, status = verdicts[name]
+        base = f"{reference * 1000:>13.1f}{(result['median'] / reference - 1) * 100:>+8.0f}%" \
+            if reference else f"{'-':>13}{'-':>9}"
+        print(f"{name:<18}{result['median'] * 1000:>11.1f}{result['min'] * 1000:>10.1f}{base}  {status}")
+    print(f"results: {os.path.relpath(output, ROOT)}")
+    if args.save_baseline:
+        shutil.copyfile(output, args.baseline)
+        print(f"baseline: {os.path.relpath(args.baseline, ROOT)}")
+
+    regressions = [name for name, (_, status) in verdicts.items() if status == "regression"]
+    if regressions and not args.save_baseline:
+        print(f"REGRESSION in {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
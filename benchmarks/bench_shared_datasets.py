@@ -0,0 +1,110 @@
+"""Memory used by N kernels loading the same dataset: private copy vs shared mmap.
+
+Each "kernel" is a plain Python process that loads the dataset the way a
+notebook cell would and then idles, so the numbers isolate the data itself
+from ipykernel overhead. Memory is read from /proc/<pid>/smaps_rollup (Linux):
+PSS splits shared pages between the processes mapping them, so the PSS sum is
+the real host cost.
+
+    python benchmarks/bench_shared_datasets.py --kernels 50 --rows 1000000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from luna import datasets  # noqa: E402
+
+CHILD = """
+import sys, time
+sys.path.insert(0, {root!r})
+import pandas as pd
+if {mode!r} == "private":
+    df = pd.read_csv({csv!r})
+else:
+    from luna import datasets
+    df = datasets.load("bench", root={catalog!r})
+# Touch every column like a real analysis would (forces pages in)
+for c in df.columns:
+    df[c].iloc[::1000].tolist()
+    if df[c].dtype.kind in "if":
+        df[c].sum()
+print("ready", flush=True)
+time.sleep(3600)
+"""
+
+
+def rollup(pid):
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1]) * 1024
+    return values
+
+
+def make_csv(path, rows):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    pd.DataFrame({
+        "Name": rng.choice(["pu", "k", "s", "e", "anu", "ravi"], rows),
+        "Marks": rng.integers(0, 100, rows).astype(float),
+        "Score": rng.random(rows),
+        "Id": np.arange(rows),
+    }).to_csv(path, index=False)
+
+
+def run(mode, kernels, csv, catalog):
+    code = CHILD.format(root=ROOT, mode=mode, csv=csv, catalog=catalog)
+    procs = [subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True)
+             for _ in range(kernels)]
+    try:
+        for p in procs:
+            p.stdout.readline()
+        time.sleep(0.5)
+        stats = [rollup(p.pid) for p in procs]
+    finally:
+        for p in procs:
+            p.kill()
+            p.wait()
+    return {
+        "rss": sum(s.get("Rss", 0) for s in stats),
+        "pss": sum(s.get("Pss", 0) for s in stats),
+        "private": sum(s.get("Private_Clean", 0) + s.get("Private_Dirty", 0) for s in stats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kernels", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = os.path.join(tmp, "bench.csv")
+        catalog = os.path.join(tmp, "catalog")
+        make_csv(csv, args.rows)
+        manifest = datasets.publish(csv, "bench", root=catalog)
+        print(f"dataset: {args.rows} rows, {manifest['bytes'] / 2**20:.1f} MiB on disk")
+
+        results = {mode: run(mode, args.kernels, csv, catalog) for mode in ("private", "shared")}
+
+    mib = 2 ** 20
+    print(f"{'mode':<10}{'kernels':>8}{'sum RSS MiB':>14}{'sum PSS MiB':>14}{'private MiB':>14}")
+    for mode, r in results.items():
+        print(f"{mode:<10}{args.kernels:>8}{r['rss'] / mib:>14.1f}{r['pss'] / mib:>14.1f}{r['private'] / mib:>14.1f}")
+    saved = results["private"]["pss"] - results["shared"]["pss"]
+    print(f"host memory saved by sharing: {saved / mib:.1f} MiB "
+          f"({saved / max(results['private']['pss'], 1):.0%})")
+
+
+if __name__ == "__main__":
+    main()
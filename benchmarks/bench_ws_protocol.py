@@ -0,0 +1,140 @@
+"""Bytes on the wire and CPU per message for the /ws encodings.
+
+Replays a typical session's server->client traffic (a chatty print loop,
+repr results, a DataFrame as an HTML table, a colored traceback, completion
+markers) through each encoding, with and without permessage-deflate:
+
+  json          what JSONResponse-style send_json puts in a text frame
+  msgpack       protocol.Codec (integer keys/types, cell handles)
+  +deflate      the same frames through a context-takeover raw deflate
+                stream with the websockets server defaults (12-bit window,
+                memLevel 5, sync flush per message, trailer stripped)
+
+CPU is encode (+ compress) on the server and (decompress +) decode on the
+client, per message.
+
+    python benchmarks/bench_ws_protocol.py --cells 50 --lines 200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import protocol  # noqa: E402
+
+
+def make_traffic(cells, lines):
+    rng = random.Random(0)
+    messages = []
+    table = "<table border=\"1\" class=\"dataframe\"><thead><tr><th></th><th>a</th><th>b</th></tr></thead><tbody>" + "".join(
+        f"<tr><th>{i}</th><td>{rng.random():.6f}</td><td>{rng.randint(0, 10 ** 6)}</td></tr>" for i in range(40)
+    ) + "</tbody></table>"
+    traceback = [
+        "\x1b[0;31m---------------------------------------------------------------------------\x1b[0m",
+        "\x1b[0;31mKeyError\x1b[0m                                  Traceback (most recent call last)",
+        "Cell \x1b[0;32mIn[3], line 1\x1b[0m\n\x1b[0;32m----> 1\x1b[0m df[\x1b[38;5;124m'missing'\x1b[39m]",
+        "\x1b[0;31mKeyError\x1b[0m: 'missing'",
+    ]
+    for c in range(cells):
+        cell = f"cell-{uuid.UUID(int=rng.getrandbits(128))}"
+        kind = c % 4
+        if kind == 0:
+            for i in range(lines):
+                messages.append({"cellId": cell, "type": "stream", "name": "stdout",
+                                 "text": f"epoch {i}: loss={rng.random():.4f} acc={rng.random():.4f}\n"})
+        elif kind == 1:
+            messages.append({"cellId": cell, "type": "execute_result",
+                             "text": repr([round(rng.random(), 3) for _ in range(20)])})
+        elif kind == 2:
+            messages.append({"cellId": cell, "type": "execute_result", "html": table, "text": "<DataFrame 40x2>"})
+        else:
+            messages.append({"cellId": cell, "type": "error", "ename": "KeyError", "evalue": "'missing'",
+                             "traceback": traceback})
+        messages.append({"type": "complete", "cellId": cell})
+    return messages
+
+
+def json_encoder():
+    return lambda m: json.dumps(m, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def msgpack_encoder():
+    return protocol.Codec().encode
+
+
+def json_decoder():
+    return json.loads
+
+
+def msgpack_decoder():
+    return protocol.Codec(assign_handles=False).decode
+
+
+def deflated(encode):
+    # permessage-deflate: one raw deflate stream per connection, each message
+    # sync-flushed and sent without the final 00 00 ff ff
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -12, 5)
+    return lambda m: (compressor.compress(encode(m)) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+
+
+def inflated(decode):
+    decompressor = zlib.decompressobj(-12)
+    return lambda frame: decode(decompressor.decompress(frame + b"\x00\x00\xff\xff"))
+
+
+def measure(name, make_encode, make_decode, messages, rounds):
+    frames = []
+    started = time.process_time()
+    for _ in range(rounds):
+        encode = make_encode()
+        frames = [encode(m) for m in messages]
+    encode_us = (time.process_time() - started) / rounds / len(messages) * 1e6
+
+    started = time.process_time()
+    for _ in range(rounds):
+        decode = make_decode()
+        for frame in frames:
+            decode(frame)
+    decode_us = (time.process_time() - started) / rounds / len(messages) * 1e6
+    total = sum(len(f) for f in frames)
+    return name, total, total / len(messages), encode_us, decode_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cells", type=int, default=40)
+    parser.add_argument("--lines", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    messages = make_traffic(args.cells, args.lines)
+
+    encodings = [
+        ("json", json_encoder, json_decoder),
+        ("json+deflate", lambda: deflated(json_encoder()), lambda: inflated(json_decoder())),
+    ]
+    if protocol.msgpack is not None:
+        encodings += [
+            ("msgpack", msgpack_encoder, msgpack_decoder),
+            ("msgpack+deflate", lambda: deflated(msgpack_encoder()), lambda: inflated(msgpack_decoder())),
+        ]
+    else:
+        print("msgpack not installed: only JSON is measured\n")
+
+    rows = [measure(name, enc, dec, messages, args.rounds) for name, enc, dec in encodings]
+    baseline = rows[0][1]
+    print(f"{len(messages)} messages ({args.cells} cells)\n")
+    print(f"{'encoding':<16} {'total KB':>9} {'B/msg':>7} {'ratio':>6} {'encode us':>10} {'decode us':>10}")
+    for name, total, per_message, encode_us, decode_us in rows:
+        print(f"{name:<16} {total / 1024:>9.1f} {per_message:>7.1f} {total / baseline:>6.2f} "
+              f"{encode_us:>10.2f} {decode_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import os
+import shutil
+import signal
+import tempfile
+
+import pytest
+
+import backend
+import kernel_runtime
+
+
+@pytest.fixture(autouse=True, scope="session")
+def isolated_runtime_state():
+    # Kernels are launched detached, and TestClient can cancel a websocket
+    # endpoint before its shutdown has run: keep test kernels out of the real
+    # runtime directory and kill whatever is still recorded at the end.
+    old = kernel_runtime.RUNTIME_DIR
+    kernel_runtime.RUNTIME_DIR = tempfile.mkdtemp(prefix="luna-runtime-")
+    # The history writer runs in the background and would recreate the test
+    # users' storage directories after their tearDown
+    backend.execution_log.storage_root = tempfile.mkdtemp(prefix="luna-history-")
+    # Tests reconnect as the same user far more often than a person would
+    backend.admission.user_start_burst = 10 ** 6
+    yield
+    backend.execution_log.flush()
+    shutil.rmtree(backend.execution_log.storage_root, ignore_errors=True)
+    for meta in kernel_runtime.scan():
+        if kernel_runtime.pid_alive(meta.get("pid")):
+            os.killpg(meta["pid"], signal.SIGKILL)
+    shutil.rmtree(kernel_runtime.RUNTIME_DIR, ignore_errors=True)
+    kernel_runtime.RUNTIME_DIR = old
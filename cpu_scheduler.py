@@ -0,0 +1,231 @@
+import asyncio
+import glob
+import logging
+import math
+import os
+import resource
+import time
+
+logger = logging.getLogger(__name__)
+
+# Host-level fair sharing of CPU between users' kernels.
+#
+# Every INTERVAL seconds the scheduler reads the CPU time of each kernel's
+# process group (kernels run in their own session, so pgid == kernel pid)
+# from /proc and keeps an exponentially weighted rate in cores, with time
+# constant WINDOW: a kernel has to burn CPU for minutes before its rate gets
+# high, so short interactive cells never look heavy.
+#
+# While the host is contended (total rate above CONTENTION of the CPUs), a
+# user whose rate exceeds the fair share (CPUs / users with a kernel) gets
+# one level per doubling above it, and so do their busy kernels:
+#   - nice NICE_STEP per level, when the backend may renice back to 0 later
+#     (root, or an RLIMIT_NICE that allows it)
+#   - on hosts with at least PIN_MIN_CPUS CPUs, pinned to the batch CPUs:
+#     all but RESERVED_CPUS, which stay free for everyone else's cells.
+# A niced kernel still gets every idle cycle; levels drop back as soon as the
+# usage does. The decisions are reported at /metrics/cpu.
+
+INTERVAL = float(os.environ.get("LUNA_SCHED_INTERVAL", 5))
+WINDOW = float(os.environ.get("LUNA_SCHED_WINDOW", 120))
+CONTENTION = 0.75
+# Kernels using less than this (cores) are interactive and never demoted
+ACTIVE_RATE = 0.05
+NICE_STEP = 5
+MAX_LEVEL = 4
+PIN_MIN_CPUS = 4
+RESERVED_CPUS = int(os.environ.get("LUNA_SCHED_RESERVED_CPUS", 0))  # 0 = a quarter of the CPUs
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def read_group_cpu(pgids):
+    """{pgid: (cpu seconds, [pids])} for the process groups in `pgids`."""
+    groups = {}
+    for stat_path in glob.glob("/proc/[0-9]*/stat"):
+        try:
+            with open(stat_path, "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue  # exited while scanning
+        # The command name may contain spaces and parentheses
+        fields = stat[stat.rindex(b")") + 2:].split()
+        pgid = int(fields[2])
+        if pgid not in pgids:
+            continue
+        # utime, stime and the times of reaped children (shell commands, pip)
+        ticks = sum(int(v) for v in fields[11:15])
+        group = groups.setdefault(pgid, [0.0, []])
+        group[0] += ticks / _CLOCK_TICKS
+        group[1].append(int(stat_path.split("/")[2]))
+    return {pgid: tuple(group) for pgid, group in groups.items()}
+
+
+def can_renice_up():
+    # Lowering a nice value again needs privilege
+    return os.geteuid() == 0 or resource.getrlimit(resource.RLIMIT_NICE)[0] >= 20
+
+
+class _Kernel:
+    def __init__(self, session_id, user_id, pid):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.pid = pid
+        self.cpu = None  # cumulative CPU seconds at the last sample
+        self.rate = 0.0
+        self.pids = []
+        # None until first applied: a re-adopted kernel may still be niced
+        self.level = None
+        self.pinned = False
+
+
+class CpuScheduler:
+    def __init__(self, interval: float = INTERVAL, window: float = WINDOW):
+        self.interval = interval
+        self.window = window
+        self.kernels = {}  # session_id -> _Kernel
+        self.cpus = sorted(os.sched_getaffinity(0))
+        reserved = RESERVED_CPUS or max(1, len(self.cpus) // 4)
+        self.batch_cpus = set(self.cpus[reserved:]) if len(self.cpus) >= PIN_MIN_CPUS else None
+        self.renice = can_renice_up()
+        self.contended = False
+        self.load = 0.0
+        self.users = {}
+        self.demotions = 0
+        self.promotions = 0
+        self._sampled = None
+
+    def register(self, session_id: str, user_id: str, pid: int):
+        if pid:
+            self.kernels[session_id] = _Kernel(session_id, user_id, pid)
+
+    def unregister(self, session_id: str):
+        self.kernels.pop(session_id, None)
+
+    def update(self, samples: dict, now: float):
+        """Fold a read_group_cpu() sample taken at `now` into the rates."""
+        elapsed = now - self._sampled if self._sampled is not None else None
+        self._sampled = now
+        weight = 1 - math.exp(-elapsed / self.window) if elapsed else 0
+        for kernel in self._snapshot():
+            cpu, pids = samples.get(kernel.pid, (None, []))
+            kernel.pids = pids
+            if cpu is None:
+                continue
+            if kernel.cpu is not None and elapsed:
+                current = max(0.0, cpu - kernel.cpu) / elapsed
+                kernel.rate += (current - kernel.rate) * weight
+            kernel.cpu = cpu
+
+    def decide(self):
+        """Set each kernel's level from the current rates; returns the changed kernels."""
+        kernels = self._snapshot()
+        users = {}
+        for kernel in kernels:
+            users[kernel.user_id] = users.get(kernel.user_id, 0.0) + kernel.rate
+        self.load = sum(users.values())
+        threshold = len(self.cpus) * CONTENTION
+        # Some hysteresis, so the levels don't flap around the threshold
+        self.contended = self.load >= threshold or (self.contended and self.load >= threshold * 0.8)
+        fair = len(self.cpus) / max(1, len(users))
+
+        levels = {}
+        for user_id, rate in users.items():
+            level = 0
+            if self.contended and rate > fair:
+                level = min(MAX_LEVEL, max(1, math.ceil(math.log2(rate / fair))))
+            levels[user_id] = {"rate": rate, "level": level, "fair_share": fair}
+        self.users = levels
+
+        changed = []
+        for kernel in kernels:
+            level = levels[kernel.user_id]["level"] if kernel.rate >= ACTIVE_RATE else 0
+            if level != kernel.level:
+                if kernel.level is not None:
+                    if level > kernel.level:
+                        self.demotions += 1
+                    else:
+                        self.promotions += 1
+                    logger.info(f"CPU level of kernel {kernel.pid} (user {kernel.user_id}, "
+                                f"{kernel.rate:.2f} cores) {kernel.level} -> {level}")
+                kernel.level = level
+                changed.append(kernel)
+        return changed
+
+    def apply(self, kernel):
+        if self.renice:
+            try:
+                os.setpriority(os.PRIO_PGRP, kernel.pid, min(19, kernel.level * NICE_STEP))
+            except OSError as e:
+                logger.warning(f"Could not renice kernel {kernel.pid}: {e}")
+        if self.batch_cpus is not None:
+            self._pin(kernel, self.batch_cpus if kernel.level else set(self.cpus))
+
+    def _pin(self, kernel, cpus):
+        # Affinity is per thread: set it on every thread of the group
+        for pid in kernel.pids:
+            for task in glob.glob(f"/proc/{pid}/task/[0-9]*"):
+                try:
+                    os.sched_setaffinity(int(os.path.basename(task)), cpus)
+                except OSError:
+                    pass  # exited meanwhile
+        kernel.pinned = cpus != set(self.cpus)
+
+    def _snapshot(self):
+        # The tick runs in a worker thread while sessions come and go
+        return list(self.kernels.values())
+
+    def tick(self):
+        self.update(read_group_cpu({k.pid for k in self._snapshot()}), time.monotonic())
+        for kernel in self.decide():
+            self.apply(kernel)
+        if self.batch_cpus is not None:
+            # Threads and processes started since the last pinning
+            for kernel in self._snapshot():
+                if kernel.level:
+                    self._pin(kernel, self.batch_cpus)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.tick)
+            except Exception as e:
+                logger.error(f"CPU scheduler tick failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def metrics(self):
+        kernels = self._snapshot()
+        return {
+            "cpus": len(self.cpus),
+            "batch_cpus": sorted(self.batch_cpus) if self.batch_cpus is not None else None,
+            "renice": self.renice,
+            "interval": self.interval,
+            "window": self.window,
+            "load": round(self.load, 3),
+            "contended": self.contended,
+            "demotions": self.demotions,
+            "promotions": self.promotions,
+            "users": {
+                user_id: {
+                    "rate": round(u["rate"], 3),
+                    "share": round(u["rate"] / self.load, 3) if self.load else 0.0,
+                    "fair_share": round(u["fair_share"], 3),
+                    "level": u["level"],
+                    "kernels": sum(1 for k in kernels if k.user_id == user_id),
+                }
+                for user_id, u in self.users.items()
+            },
+            "kernels": [
+                {
+                    "session": k.session_id,
+                    "user": k.user_id,
+                    "pid": k.pid,
+                    "rate": round(k.rate, 3),
+                    "cpu_seconds": round(k.cpu or 0.0, 2),
+                    "level": k.level,
+                    "nice": min(19, k.level * NICE_STEP) if self.renice and k.level is not None else None,
+                    "pinned": k.pinned,
+                }
+                for k in kernels
+            ],
+        }
@@ -0,0 +1,96 @@
+import collections
+import os
+import signal
+import time
+
+# Kernel crash detection and recovery policy.
+#
+# Every session checks its kernel process every HEARTBEAT_INTERVAL seconds
+# (a poll of the child process; a pid check for re-adopted kernels, which
+# aren't our children). A kernel killed mid-cell - the OOM killer, a
+# segfault in a C extension - never sends the idle status the running cell
+# waits for, so the watcher fails that cell with the reason, tells the
+# client, and, with AUTO_RESTART, starts a new kernel and restores the
+# session's last namespace checkpoint (luna.checkpoint). At most
+# MAX_RESTARTS restarts per session within RESTART_WINDOW seconds, so a
+# kernel that dies on startup or keeps running out of memory doesn't loop.
+#
+# Checkpoints are taken after a cell finishes without error, at most every
+# CHECKPOINT_INTERVAL seconds, and hold up to CHECKPOINT_MAX_BYTES of
+# pickled variables. A SIGKILL is reported as an OOM kill when the OOM kill
+# counter (the cgroup's memory.events, else /proc/vmstat) went up meanwhile.
+
+HEARTBEAT_INTERVAL = float(os.environ.get("LUNA_HEARTBEAT_INTERVAL", 0.5))
+AUTO_RESTART = os.environ.get("LUNA_KERNEL_AUTO_RESTART", "1") == "1"
+MAX_RESTARTS = 3
+RESTART_WINDOW = 600
+CHECKPOINT_INTERVAL = float(os.environ.get("LUNA_CHECKPOINT_INTERVAL", 60))
+CHECKPOINT_MAX_BYTES = int(float(os.environ.get("LUNA_CHECKPOINT_MAX_MB", 32)) * 1024 * 1024)
+RECENT_CRASHES = 50
+
+OOM_COUNTERS = ("/sys/fs/cgroup/memory.events", "/proc/vmstat")
+
+
+class KernelDied(Exception):
+    pass
+
+
+def read_oom_kills():
+    """The OOM kill counter of this cgroup (or host), or None where there is none."""
+    for path in OOM_COUNTERS:
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, value = line.partition(" ")
+                    if key == "oom_kill":
+                        return int(value)
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def describe_exit(returncode, oom_kills_before=None, oom_kills_after=None):
+    """(kind, reason) for a kernel that exited with returncode (None if unknown)."""
+    oom = oom_kills_before is not None and oom_kills_after is not None and oom_kills_after > oom_kills_before
+    if oom and returncode in (None, -signal.SIGKILL):
+        return "oom", "The kernel ran out of memory and was killed"
+    if returncode is None:
+        return "exit", "The kernel process exited"
+    if returncode < 0:
+        sig = signal.Signals(-returncode)
+        if sig == signal.SIGKILL:
+            return "killed", "The kernel was killed (SIGKILL), possibly for using too much memory"
+        if sig == signal.SIGSEGV:
+            return "crash", "The kernel crashed (segmentation fault in native code)"
+        return "crash", f"The kernel was terminated by {sig.name}"
+    return "exit", f"The kernel exited with code {returncode}"
+
+
+class CrashStats:
+    def __init__(self):
+        self.crashes = collections.Counter()  # kind -> count
+        self.cells_failed = 0
+        self.restarts = 0
+        self.restart_failures = 0
+        self.restarts_refused = 0
+        self.variables_restored = 0
+        self.recent = collections.deque(maxlen=RECENT_CRASHES)
+
+    def record(self, session_id, user_id, kind, reason, cell_id=None):
+        self.crashes[kind] += 1
+        if cell_id is not None:
+            self.cells_failed += 1
+        self.recent.append({"at": time.time(), "session": session_id, "user": user_id, "kind": kind,
+                            "reason": reason, "cell": cell_id})
+
+    def metrics(self):
+        return {
+            "crashes": sum(self.crashes.values()),
+            "by_kind": dict(self.crashes),
+            "cells_failed": self.cells_failed,
+            "restarts": self.restarts,
+            "restart_failures": self.restart_failures,
+            "restarts_refused": self.restarts_refused,
+            "variables_restored": self.variables_restored,
+            "recent": list(reversed(self.recent)),
+        }
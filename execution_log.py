@@ -0,0 +1,195 @@
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Per-user execution history: storage/<userId>/.history/<YYYY-MM-DD>[.<n>].jsonl.gz
+#
+# execute() only puts a dict on a queue; one background thread batches the
+# entries and appends each batch as a gzip member (a file of concatenated
+# members is still one valid gzip stream). Files rotate daily (UTC) and when
+# they exceed MAX_FILE_BYTES; files older than RETENTION_DAYS are deleted.
+#
+# An entry:
+#   start, end, duration_ms, session, kernel, cell, code_sha, code_len,
+#   status (ok | error | <interrupt reason>), ename, outputs, output_bytes,
+#   input_wait_ms
+
+HISTORY_DIR = ".history"
+MAX_FILE_BYTES = int(float(os.environ.get("LUNA_HISTORY_FILE_MB", 8)) * 1024 * 1024)
+RETENTION_DAYS = int(os.environ.get("LUNA_HISTORY_DAYS", 30))
+# Entries are collected this long before a batch is written
+FLUSH_INTERVAL = 1.0
+
+_FILE_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})(?:\.(\d+))?\.jsonl\.gz$")
+_USER_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()[:16]
+
+
+def _day(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+class ExecutionLog:
+    def __init__(self, storage_root: str, flush_interval: float = FLUSH_INTERVAL):
+        self.storage_root = storage_root
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._pruned = {}  # user_id -> day of the last retention sweep
+
+    def _user_dir(self, user_id):
+        if not _USER_RE.match(user_id or "") or ".." in user_id:
+            raise ValueError(f"Invalid user id {user_id!r}")
+        return os.path.join(self.storage_root, user_id, HISTORY_DIR)
+
+    def record(self, user_id: str, entry: dict):
+        """Queue an entry; never blocks and never touches the disk."""
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="execution-log", daemon=True)
+                    self._thread.start()
+        self.queue.put((user_id, entry))
+
+    def flush(self, timeout: float = 5) -> bool:
+        """Block until everything recorded so far is on disk."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    # --- writer thread ---
+
+    def _run(self):
+        while True:
+            batch, waiters = [], []
+            item = self.queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"Failed to write execution log: {e}")
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, batch):
+        groups = {}
+        for user_id, entry in batch:
+            groups.setdefault((user_id, _day(entry["start"])), []).append(entry)
+        for (user_id, day), entries in groups.items():
+            # One user's bad id or full disk must not cost the others their entries
+            try:
+                self._append(user_id, day, entries)
+            except (ValueError, OSError) as e:
+                logger.error(f"Dropped {len(entries)} execution log entries of user {user_id!r}: {e}")
+
+    def _append(self, user_id, day, entries):
+        directory = self._user_dir(user_id)
+        os.makedirs(directory, exist_ok=True)
+        lines = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in entries)
+        with open(self._current_file(directory, day), "ab") as f:
+            f.write(gzip.compress(lines.encode("utf-8")))
+        if self._pruned.get(user_id) != day:
+            self._pruned[user_id] = day
+            self._prune(directory)
+
+    def _current_file(self, directory, day):
+        parts = sorted(self._files(directory, day, day), key=lambda f: f[1])
+        index = parts[-1][1] if parts else 0
+        path = self._path(directory, day, index)
+        if os.path.exists(path) and os.path.getsize(path) >= MAX_FILE_BYTES:
+            path = self._path(directory, day, index + 1)
+        return path
+
+    def _path(self, directory, day, index):
+        return os.path.join(directory, f"{day}.{index}.jsonl.gz" if index else f"{day}.jsonl.gz")
+
+    def _files(self, directory, first_day=None, last_day=None):
+        # (day, part, path) for the files within [first_day, last_day]
+        for path in glob.glob(os.path.join(directory, "*.jsonl.gz")):
+            match = _FILE_RE.match(os.path.basename(path))
+            if not match:
+                continue
+            day = match.group(1)
+            if (first_day and day < first_day) or (last_day and day > last_day):
+                continue
+            yield day, int(match.group(2) or 0), path
+
+    def _prune(self, directory):
+        if RETENTION_DAYS <= 0:
+            return
+        cutoff = _day(time.time() - RETENTION_DAYS * 86400)
+        for day, _, path in list(self._files(directory)):
+            if day < cutoff:
+                os.remove(path)
+
+    # --- queries ---
+
+    def query(self, user_id, since=None, until=None, session_id=None, status=None, limit=100):
+        """Newest-first entries of `user_id` started within [since, until] (epoch seconds)."""
+        directory = self._user_dir(user_id)
+        files = self._files(directory, since and _day(since), until and _day(until))
+        entries = []
+        for _, _, path in sorted(files, reverse=True):
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    lines = f.read().splitlines()
+            except (OSError, EOFError) as e:
+                # A member cut short by a crash: keep what was readable elsewhere
+                logger.warning(f"Skipping unreadable execution log {path}: {e}")
+                continue
+            for line in lines:
+                entry = json.loads(line)
+                if (since and entry["start"] < since) or (until and entry["start"] > until):
+                    continue
+                if session_id and entry.get("session") != session_id:
+                    continue
+                if status and entry.get("status") != status:
+                    continue
+                entries.append(entry)
+        entries.sort(key=lambda e: e["start"], reverse=True)
+        return entries[:limit]
+
+
+def summarize(entries):
+    """Count, error count and duration percentiles of a list of entries."""
+    durations = sorted(e["duration_ms"] for e in entries)
+
+    def percentile(p):
+        return durations[min(len(durations) - 1, int(len(durations) * p))] if durations else None
+
+    return {
+        "count": len(entries),
+        "errors": sum(1 for e in entries if e.get("status") == "error"),
+        "interrupted": sum(1 for e in entries if e.get("status") not in ("ok", "error")),
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "max_ms": durations[-1] if durations else None,
+    }
@@ -0,0 +1,114 @@
+import asyncio
+import glob
+import json
+import os
+import time
+
+import zmq
+import zmq.asyncio
+
+# Kernels are launched detached from the backend (no parent-death watch) and
+# their connection files live here, next to a small ".meta.json" sidecar
+# naming the owning session. A restarted backend scans this directory and
+# reconnects instead of launching everything again.
+RUNTIME_DIR = os.environ.get("LUNA_RUNTIME_DIR") or os.path.join(os.getcwd(), ".luna_runtime")
+
+
+def connection_path(session_id: str):
+    return os.path.join(RUNTIME_DIR, f"kernel-{session_id}.json")
+
+
+def _meta_path(session_id: str):
+    return os.path.join(RUNTIME_DIR, f"kernel-{session_id}.meta.json")
+
+
+def log_path(session_id: str):
+    # Detached kernels must not hold the backend's stdout/stderr open
+    return os.path.join(RUNTIME_DIR, f"kernel-{session_id}.log")
+
+
+def write_meta(session_id: str, meta: dict):
+    os.makedirs(RUNTIME_DIR, exist_ok=True)
+    path = _meta_path(session_id)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(dict(meta, session_id=session_id, written=time.time()), f)
+    os.replace(tmp, path)
+
+
+def remove(session_id: str):
+    for path in (connection_path(session_id), _meta_path(session_id), log_path(session_id)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def scan():
+    """Yield the meta dict (with its connection_file) of every recorded kernel."""
+    for meta_path in glob.glob(os.path.join(RUNTIME_DIR, "kernel-*.meta.json")):
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        meta["connection_file"] = connection_path(meta["session_id"])
+        yield meta
+
+
+async def heartbeat(connection_file: str, timeout: float = 1.0):
+    """True if the kernel behind `connection_file` echoes a heartbeat in time.
+
+    The heartbeat socket is answered by a dedicated kernel thread, so this
+    works even while the kernel is busy running a cell.
+    """
+    try:
+        with open(connection_file, encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    ctx = zmq.asyncio.Context.instance()
+    sock = ctx.socket(zmq.REQ)
+    sock.linger = 0
+    try:
+        sock.connect(f"{info['transport']}://{info['ip']}:{info['hb_port']}")
+        await sock.send(b"ping")
+        if await sock.poll(timeout * 1000):
+            return await sock.recv() == b"ping"
+        return False
+    except (zmq.ZMQError, KeyError):
+        return False
+    finally:
+        sock.close()
+
+
+def pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+async def wait_for_exit(pid, timeout: float):
+    deadline = time.monotonic() + timeout
+    while pid_alive(pid) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    return not pid_alive(pid)
+
+
+def rss_bytes(pid):
+    """Resident memory of a process (Linux /proc), or None if it's gone."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
@@ -0,0 +1,134 @@
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from workspace_io import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Event loop lag monitor.
+#
+# A sampler task sleeps INTERVAL seconds at a time and records how late it
+# wakes up: that is the scheduling delay every other callback on the loop
+# sees, kept in a histogram and over the last WINDOW seconds.
+#
+# Finding what blocked the loop is the job of a watchdog thread. While the
+# sampler is overdue by more than SLOW_CALLBACK it grabs the loop thread's
+# stack (sys._current_frames), so the record names the code that is actually
+# running - a send_json of a huge payload, a file copy - rather than the
+# handle asyncio's debug mode would report, and at the cost of one wakeup
+# per check instead of timing every callback. The last MAX_STALLS stalls
+# are served at /debug/loop, and /health reports "degraded" while the lag
+# over the window is above LAG_THRESHOLD.
+
+INTERVAL = float(os.environ.get("LUNA_LOOP_SAMPLE_INTERVAL", 0.1))
+WINDOW = 30.0
+LAG_THRESHOLD = float(os.environ.get("LUNA_LOOP_LAG_THRESHOLD", 0.25))
+SLOW_CALLBACK = float(os.environ.get("LUNA_SLOW_CALLBACK", 0.1))
+MAX_STALLS = 50
+STACK_DEPTH = 30
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = INTERVAL, lag_threshold: float = LAG_THRESHOLD,
+                 slow_callback: float = SLOW_CALLBACK, window: float = WINDOW):
+        self.interval = interval
+        self.lag_threshold = lag_threshold
+        self.slow_callback = slow_callback
+        self.histogram = LatencyHistogram()
+        self.recent = collections.deque(maxlen=max(1, int(window / interval)))
+        self.stalls = collections.deque(maxlen=MAX_STALLS)
+        self.stall_count = 0
+        self.lag = 0.0
+        self._due = None  # when the sampler should wake up next
+        self._stall = None  # the stall in progress, if any
+        self._loop_thread = None
+        self._task = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start sampling the running loop."""
+        self._loop_thread = threading.get_ident()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        if self.slow_callback > 0:
+            threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sample(self):
+        while True:
+            self._due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, time.monotonic() - self._due))
+
+    def record(self, lag: float):
+        self.lag = lag
+        self.recent.append(lag)
+        self.histogram.record(lag * 1000)
+        stall = self._stall
+        if stall is not None:
+            self._stall = None
+            stall["duration_ms"] = round(lag * 1000, 1)
+            logger.warning(f"Event loop blocked for {lag * 1000:.0f}ms in {stall['where']}")
+
+    def _watch(self):
+        while not self._stopped.wait(self.slow_callback / 2):
+            due = self._due
+            if due is None or self._stall is not None:
+                continue
+            overdue = time.monotonic() - due
+            if overdue > self.slow_callback:
+                self._capture(overdue)
+
+    def _capture(self, overdue: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = traceback.format_stack(frame, limit=STACK_DEPTH)
+        summary = traceback.extract_stack(frame, limit=1)[-1]
+        stall = {
+            "at": time.time() - overdue,
+            "where": f"{summary.filename}:{summary.lineno} in {summary.name}",
+            "duration_ms": None,  # set once the loop runs again
+            "stack": [line.rstrip() for line in stack],
+        }
+        self._stall = stall
+        self.stalls.append(stall)
+        self.stall_count += 1
+
+    @property
+    def degraded(self) -> bool:
+        stall = self._stall
+        if stall is not None and time.time() - stall["at"] > self.lag_threshold:
+            return True
+        return max(self.recent, default=0.0) > self.lag_threshold
+
+    def metrics(self):
+        return {
+            "running": self._task is not None,
+            "interval_ms": self.interval * 1000,
+            "lag_ms": round(self.lag * 1000, 2),
+            "max_lag_ms": round(max(self.recent, default=0.0) * 1000, 2),
+            "lag_threshold_ms": self.lag_threshold * 1000,
+            "degraded": self.degraded,
+            "stalls": self.stall_count,
+            "histogram": self.histogram.summary(),
+        }
+
+    def debug(self):
+        return {**self.metrics(), "slow_callback_ms": self.slow_callback * 1000,
+                "recent_stalls": list(reversed(self.stalls))}
@@ -0,0 +1,4 @@
+# Kernel-side helpers for Luna Book.
+# These modules are imported INSIDE the user kernels (the backend adds the
+# project root to sys.path at startup), so they must not import anything
+# from backend.py and must stay cheap to import.
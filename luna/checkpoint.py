@@ -0,0 +1,95 @@
+import importlib
+import json
+import os
+import pickle
+import sys
+import types
+
+from luna.variables import HIDDEN_NAMES, _user_namespace
+
+# Namespace checkpoints, so a kernel restarted after a crash can get the
+# user's variables back. Each variable is pickled on its own: one that can't
+# be pickled (open files, sockets, generators) or unpickled (instances of
+# classes defined in a cell) is skipped instead of losing the whole
+# checkpoint. Imported modules are recorded by name and imported again.
+# Functions and classes defined in cells are not restorable by pickle and
+# are left out; re-running their cells brings them back. Values are sized
+# before pickling, so one too big for what's left of the budget is skipped
+# without being copied: pickling a large DataFrame would double the memory
+# of the kernel the checkpoint is meant to rescue.
+
+
+def _candidates(namespace):
+    for name, value in list(namespace.items()):
+        if name.startswith("_") or name in HIDDEN_NAMES:
+            continue
+        if isinstance(value, types.ModuleType):
+            yield name, ("module", value.__name__)
+        elif getattr(value, "__module__", None) == "__main__" and callable(value):
+            continue
+        else:
+            yield name, ("value", value)
+
+
+def _estimated_size(value):
+    # Shallow: object columns and containers count their pointers only
+    try:
+        if hasattr(value, "memory_usage"):
+            usage = value.memory_usage(index=True, deep=False)
+            return int(usage.sum() if hasattr(usage, "sum") else usage)
+        if hasattr(value, "nbytes"):
+            return int(value.nbytes)
+    except Exception:
+        pass
+    return sys.getsizeof(value, 0)
+
+
+def save(path, max_bytes):
+    """Pickle the user namespace to path, up to max_bytes of values; returns a JSON summary."""
+    modules, values, skipped = {}, {}, []
+    size = 0
+    for name, (kind, value) in _candidates(_user_namespace()):
+        if kind == "module":
+            modules[name] = value
+            continue
+        if size + _estimated_size(value) > max_bytes:
+            skipped.append(name)
+            continue
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            skipped.append(name)
+            continue
+        if size + len(data) > max_bytes:
+            skipped.append(name)
+            continue
+        values[name] = data
+        size += len(data)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump({"modules": modules, "values": values}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    return json.dumps({"saved": sorted(values), "modules": sorted(modules), "skipped": sorted(skipped),
+                       "bytes": size})
+
+
+def restore(path):
+    """Load a checkpoint written by save() into the user namespace; returns a JSON summary."""
+    with open(path, "rb") as f:
+        checkpoint = pickle.load(f)
+    namespace = _user_namespace()
+    restored, failed = [], []
+    for name, module in checkpoint["modules"].items():
+        try:
+            namespace[name] = importlib.import_module(module)
+            restored.append(name)
+        except Exception:
+            failed.append(name)
+    for name, data in checkpoint["values"].items():
+        try:
+            namespace[name] = pickle.loads(data)
+            restored.append(name)
+        except Exception:
+            failed.append(name)
+    return json.dumps({"restored": sorted(restored), "failed": sorted(failed)})
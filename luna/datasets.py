@@ -0,0 +1,179 @@
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+# Shared, admin-managed dataset catalog.
+#
+# Each dataset is converted ONCE into one .npy file per column. Kernels open
+# those files with np.load(mmap_mode="r"), so every kernel on the host maps
+# the same page-cache pages instead of holding its own parsed copy.
+# String/object columns are dictionary-encoded: the integer codes are mapped,
+# only the (usually small) list of distinct values is loaded per kernel.
+# Timezone-aware datetimes are stored in UTC with the zone in the manifest;
+# nullable integer/float/boolean columns as their values plus an NA mask.
+
+DATASETS_DIR = os.environ.get("LUNA_DATASETS_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "datasets"
+)
+MANIFEST = "manifest.json"
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+def _dataset_dir(name, root=None):
+    if not _NAME_RE.match(name or ""):
+        raise ValueError(f"Invalid dataset name {name!r}")
+    return os.path.join(root or DATASETS_DIR, name)
+
+
+def _read_source(path):
+    import pandas as pd
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        return pd.read_csv(path)
+    if ext in (".xlsx", ".xls"):
+        return pd.read_excel(path)
+    if ext == ".json":
+        return pd.read_json(path)
+    if ext == ".parquet":
+        return pd.read_parquet(path)
+    raise ValueError(f"Unsupported dataset format {ext!r}")
+
+
+def _write_column(directory, index, series):
+    import numpy as np
+    import pandas as pd
+
+    path = os.path.join(directory, f"{index}.npy")
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        # Stored as UTC datetime64; load() converts back to the column's zone
+        values = series.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy()
+        np.save(path, values, allow_pickle=False)
+        return {"kind": "array", "dtype": str(values.dtype), "tz": str(series.dtype.tz)}
+
+    if isinstance(series.array, (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)):
+        # Nullable columns: the values with NA filled in, and a mask of where NA was
+        mask_file = f"{index}.mask.npy"
+        np.save(path, series.array.to_numpy(series.dtype.numpy_dtype, na_value=0), allow_pickle=False)
+        np.save(os.path.join(directory, mask_file), series.isna().to_numpy(), allow_pickle=False)
+        return {"kind": "masked", "dtype": str(series.dtype), "mask": mask_file}
+
+    kind = series.dtype.kind
+    if kind in "biufcmM" and not isinstance(series.dtype, pd.CategoricalDtype):
+        values = np.ascontiguousarray(series.to_numpy())
+        if values.dtype == object:
+            raise ValueError(f"Column {series.name!r} has dtype {series.dtype}, which can't be published; "
+                             "convert it to a NumPy dtype first")
+        np.save(path, values, allow_pickle=False)
+        return {"kind": "array", "dtype": str(values.dtype)}
+
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    np.save(path, codes.astype(np.int32), allow_pickle=False)
+    return {"kind": "category", "categories": [str(u) for u in uniques]}
+
+
+def publish(source, name=None, root=None):
+    """Convert `source` (csv/xlsx/json/parquet) into the shared catalog."""
+    name = name or os.path.splitext(os.path.basename(source))[0]
+    final_dir = _dataset_dir(name, root)
+    frame = _read_source(source)
+
+    os.makedirs(root or DATASETS_DIR, exist_ok=True)
+    staging = f"{final_dir}.tmp-{uuid.uuid4().hex[:8]}"
+    os.makedirs(staging)
+    try:
+        columns = []
+        for i, column in enumerate(frame.columns):
+            spec = _write_column(staging, i, frame[column])
+            spec.update({"name": str(column), "file": f"{i}.npy"})
+            columns.append(spec)
+        manifest = {
+            "name": name,
+            "source": os.path.basename(source),
+            "rows": len(frame),
+            "columns": columns,
+            "bytes": sum(os.path.getsize(os.path.join(staging, c[key])) for c in columns
+                         for key in ("file", "mask") if key in c),
+            "published": time.time(),
+        }
+        with open(os.path.join(staging, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+        # Swap in the new version. Kernels that still map the old files keep
+        # their (now unlinked) pages until they reload.
+        retired = None
+        if os.path.exists(final_dir):
+            retired = f"{final_dir}.old-{uuid.uuid4().hex[:8]}"
+            os.rename(final_dir, retired)
+        os.rename(staging, final_dir)
+        if retired:
+            shutil.rmtree(retired, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+
+def remove(name, root=None):
+    directory = _dataset_dir(name, root)
+    if not os.path.isdir(directory):
+        raise KeyError(name)
+    shutil.rmtree(directory)
+
+
+def _manifest(name, root=None):
+    path = os.path.join(_dataset_dir(name, root), MANIFEST)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise KeyError(f"Unknown dataset {name!r}") from None
+
+
+def catalog(root=None):
+    root = root or DATASETS_DIR
+    if not os.path.isdir(root):
+        return []
+    entries = []
+    for name in sorted(os.listdir(root)):
+        if not _NAME_RE.match(name) or ".tmp-" in name or ".old-" in name:
+            continue
+        try:
+            manifest = _manifest(name, root)
+        except (KeyError, ValueError):
+            continue
+        entries.append({
+            "name": manifest["name"],
+            "rows": manifest["rows"],
+            "columns": [c["name"] for c in manifest["columns"]],
+            "bytes": manifest["bytes"],
+            "published": manifest["published"],
+        })
+    return entries
+
+
+def load(name, root=None):
+    """Return dataset `name` as a DataFrame backed by read-only memory maps."""
+    import numpy as np
+    import pandas as pd
+
+    manifest = _manifest(name, root)
+    directory = _dataset_dir(name, root)
+    data = {}
+    for column in manifest["columns"]:
+        mapped = np.load(os.path.join(directory, column["file"]), mmap_mode="r", allow_pickle=False)
+        if column["kind"] == "category":
+            data[column["name"]] = pd.Categorical.from_codes(mapped, column["categories"])
+        elif column["kind"] == "masked":
+            mask = np.load(os.path.join(directory, column["mask"]), mmap_mode="r", allow_pickle=False)
+            array_type = pd.api.types.pandas_dtype(column["dtype"]).construct_array_type()
+            data[column["name"]] = array_type(mapped, mask)
+        elif column.get("tz"):
+            data[column["name"]] = pd.DatetimeIndex(mapped).tz_localize("UTC").tz_convert(column["tz"])
+        else:
+            data[column["name"]] = mapped
+    return pd.DataFrame(data, copy=False)
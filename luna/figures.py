@@ -0,0 +1,196 @@
+"""Inline figures: format, DPI, render threads and a cache.
+
+`%matplotlib inline` renders every figure to a PNG at the figure's DPI,
+whatever the client shows it on. install() replaces its Figure formatter
+with render(), so plt.show(), the end-of-cell flush and a figure as the
+value of a cell all go through it:
+
+- the session picks PNG, SVG or WebP (configure(format=...)). Lossless
+  WebP is a third to a fifth of the PNG for plots; SVG is exact but grows
+  with the number of points drawn;
+- the DPI follows the client: at most the figure's DPI times the screen's
+  pixel ratio, and no wider than the output area ("width", CSS pixels)
+  needs. Raster figures carry their CSS size as "width" metadata, so a
+  high-DPI render isn't shown twice as large;
+- a figure that hasn't changed since it was rendered (matplotlib's `stale`
+  flag) in the same format and DPI is not rendered again;
+- with threads, plt.show() hands the open figures to render threads and
+  returns, so the cell goes on while they render. They are published in
+  show order at the next show() and when the cell ends, so they come after
+  output the cell printed in the meantime.
+
+Settings are per kernel; the backend calls configure() for its session.
+Nothing is imported from matplotlib until a figure is rendered, so the lite
+worker uses render() too.
+"""
+import base64
+import collections
+import io
+import json
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+FORMATS = {"png": "image/png", "svg": "image/svg+xml", "webp": "image/webp"}
+SAVE_OPTIONS = {
+    "png": {},
+    # No timestamp: an unchanged figure gives the same bytes (and stored output)
+    "svg": {"metadata": {"Date": None}},
+    "webp": {"pil_kwargs": {"lossless": True, "quality": 80}},
+}
+MIN_DPI = 36
+
+settings = {
+    "format": os.environ.get("LUNA_FIGURE_FORMAT", "png"),
+    "width": None,  # output area in CSS pixels, None = unknown
+    "pixel_ratio": 1.0,
+    "threads": int(os.environ.get("LUNA_FIGURE_THREADS", 0)),
+}
+stats = {"rendered": 0, "cached": 0, "seconds": 0.0, "bytes": 0}
+
+# figure -> ((format, dpi, pixel ratio), bundle); valid while the figure isn't stale
+_cache = weakref.WeakKeyDictionary()
+_lock = threading.Lock()  # stats and cache, written from render threads
+_pool = None
+_pool_size = 0
+# (text/plain, future of the bundle) of figures handed over by show(), in order
+_pending = collections.deque()
+
+
+def configure(format=None, width=None, pixel_ratio=None, threads=None):
+    """Change the figure settings; returns all of them as JSON."""
+    if format is not None:
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported figure format {format!r}")
+        settings["format"] = format
+    if width is not None:
+        settings["width"] = float(width) or None
+    if pixel_ratio is not None:
+        settings["pixel_ratio"] = float(pixel_ratio)
+    if threads is not None:
+        settings["threads"] = int(threads)
+    return json.dumps(settings)
+
+
+def dpi_for(fig):
+    ratio = settings["pixel_ratio"]
+    dpi = fig.dpi * ratio
+    if settings["width"]:
+        dpi = min(dpi, settings["width"] * ratio / fig.get_figwidth())
+    return max(MIN_DPI, round(dpi))
+
+
+def _render(fig, format, dpi, ratio):
+    import matplotlib
+    if format == "svg" and matplotlib.rcParams["svg.hashsalt"] is None:
+        matplotlib.rcParams["svg.hashsalt"] = "luna"  # element ids too, not random per render
+    started = time.perf_counter()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=format, dpi=dpi, bbox_inches="tight", **SAVE_OPTIONS[format])
+    raw = buffer.getvalue()
+    mime = FORMATS[format]
+    metadata = {}
+    if format == "svg":
+        data = raw.decode("utf-8")
+    else:
+        data = base64.b64encode(raw).decode("ascii")
+        if ratio != 1:
+            from PIL import Image
+            width, height = Image.open(io.BytesIO(raw)).size  # reads the header only
+            metadata = {mime: {"width": round(width / ratio), "height": round(height / ratio)}}
+    with _lock:
+        stats["rendered"] += 1
+        stats["seconds"] += time.perf_counter() - started
+        stats["bytes"] += len(data)
+    return {mime: data}, metadata
+
+
+def render(fig):
+    """(data, metadata) of a figure in the session's format, reused while it is unchanged."""
+    ratio = settings["pixel_ratio"]
+    key = (settings["format"], dpi_for(fig), ratio)
+    with _lock:
+        cached = _cache.get(fig)
+        if cached and cached[0] == key and not fig.stale:
+            stats["cached"] += 1
+            return cached[1]
+    bundle = _render(fig, key[0], key[1], ratio)
+    # savefig leaves the flag set; any change to the figure sets it again
+    fig.stale = False
+    with _lock:
+        _cache[fig] = (key, bundle)
+    return bundle
+
+
+def _executor():
+    global _pool, _pool_size
+    if _pool is None or _pool_size != settings["threads"]:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = ThreadPoolExecutor(settings["threads"], thread_name_prefix="luna-figures")
+        _pool_size = settings["threads"]
+    return _pool
+
+
+def hand_over():
+    """Close the open figures and render them in threads; publish() displays them."""
+    import matplotlib.pyplot as plt
+    from matplotlib._pylab_helpers import Gcf
+    pool = _executor()
+    for manager in Gcf.get_all_fig_managers():
+        fig = manager.canvas.figure
+        plt.close(fig)  # the figure now belongs to the render threads
+        _pending.append((repr(fig), pool.submit(render, fig)))
+
+
+def publish(wait=False):
+    """Display handed-over figures in order: those rendered by now, or all of them."""
+    from IPython.display import publish_display_data
+    while _pending and (wait or _pending[0][1].done()):
+        text, future = _pending.popleft()
+        try:
+            data, metadata = future.result()
+        except Exception:
+            get_ipython().showtraceback()  # noqa: F821 - provided by IPython
+            continue
+        publish_display_data(dict(data, **{"text/plain": text}), metadata)
+
+
+def _threaded_show(original):
+    def show(*args, **kwargs):
+        from matplotlib_inline.backend_inline import InlineBackend
+        if not settings["threads"] or not InlineBackend.instance().close_figures:
+            return original(*args, **kwargs)
+        publish()
+        hand_over()
+    show.__doc__ = original.__doc__
+    return show
+
+
+def _end_of_cell():
+    # Before the inline backend's flush: figures the cell left open render
+    # concurrently, and everything is published before the cell ends
+    if settings["threads"]:
+        from matplotlib_inline import backend_inline
+        if getattr(backend_inline.show, "_draw_called", False):
+            hand_over()
+    publish(wait=True)
+
+
+def install(**options):
+    """Render figures through render(); run after `%matplotlib inline`."""
+    import matplotlib.pyplot as plt
+    from matplotlib.figure import Figure
+    from matplotlib_inline.backend_inline import flush_figures
+    configure(**options)
+    ip = get_ipython()  # noqa: F821 - provided by IPython
+    for mime in ("image/png", "image/jpeg", "image/svg+xml", "application/pdf"):
+        ip.display_formatter.formatters[mime].pop(Figure, None)
+    ip.display_formatter.mimebundle_formatter.for_type(Figure, render)
+    plt.show = _threaded_show(plt.show)
+    callbacks = ip.events.callbacks["post_execute"]
+    callbacks.insert(callbacks.index(flush_figures) if flush_figures in callbacks else len(callbacks),
+                     _end_of_cell)
+
@@ -0,0 +1,121 @@
+import json
+import os
+import uuid
+from collections import OrderedDict
+
+from luna.variables import _cell
+
+MIME_TYPE = "application/vnd.luna.frame+json"
+
+# Only this many rows are rendered into the execute_result; the rest stay in
+# the kernel and are fetched page by page with `fetch`.
+PAGE_ROWS = int(os.environ.get("LUNA_FRAME_PAGE_ROWS", 50))
+MAX_COLUMNS = 50
+MAX_HANDLES = 20
+
+# handle -> DataFrame, oldest evicted first so displayed frames can't pin
+# unbounded memory in the kernel
+_handles = OrderedDict()
+# handle -> (view key, sorted/filtered frame) so paging a sorted view does
+# not re-sort the whole frame for every page
+_views = {}
+
+
+def register(frame):
+    handle = uuid.uuid4().hex[:12]
+    _handles[handle] = frame
+    while len(_handles) > MAX_HANDLES:
+        old, _ = _handles.popitem(last=False)
+        _views.pop(old, None)
+    return handle
+
+
+def _html(frame, total_rows, total_columns):
+    html = frame.to_html(max_cols=MAX_COLUMNS, notebook=True)
+    return html + f"<p>{total_rows} rows × {total_columns} columns</p>"
+
+
+def mimebundle(frame):
+    handle = register(frame)
+    head = frame.head(PAGE_ROWS)
+    rows, columns = frame.shape
+    meta = {
+        "handle": handle,
+        "shape": [rows, columns],
+        "columns": [str(c) for c in frame.columns[:MAX_COLUMNS]],
+        "dtypes": [str(d) for d in frame.dtypes[:MAX_COLUMNS]],
+        "pageRows": PAGE_ROWS,
+    }
+    return {
+        MIME_TYPE: meta,
+        "text/html": _html(head, rows, columns),
+        "text/plain": head.to_string(max_cols=MAX_COLUMNS) + f"\n\n[{rows} rows x {columns} columns]",
+    }
+
+
+def install():
+    ip = get_ipython()  # noqa: F821 - provided by IPython
+    # pandas >= 3 reports DataFrame.__module__ as "pandas"; older releases
+    # use the defining module. Registering by name avoids importing pandas.
+    for module in ("pandas.core.frame", "pandas"):
+        ip.display_formatter.mimebundle_formatter.for_type_by_name(module, "DataFrame", mimebundle)
+
+
+def _apply_filter(frame, spec):
+    column = frame[spec["column"]]
+    op = spec.get("op", "==")
+    value = spec.get("value")
+    if op == "contains":
+        mask = column.astype(str).str.contains(str(value), case=False, regex=False, na=False)
+    elif op == "==":
+        mask = column == value
+    elif op == "!=":
+        mask = column != value
+    elif op == "<":
+        mask = column < value
+    elif op == "<=":
+        mask = column <= value
+    elif op == ">":
+        mask = column > value
+    elif op == ">=":
+        mask = column >= value
+    else:
+        raise ValueError(f"Unsupported filter op {op!r}")
+    return frame[mask]
+
+
+def _view(handle, sort_by, ascending, filters):
+    key = json.dumps([sort_by, ascending, filters], sort_keys=True, default=str)
+    cached = _views.get(handle)
+    if cached and cached[0] == key:
+        return cached[1]
+    frame = _handles[handle]
+    for spec in filters:
+        frame = _apply_filter(frame, spec)
+    if sort_by is not None:
+        frame = frame.sort_values(sort_by, ascending=ascending, kind="stable")
+    _views[handle] = (key, frame)
+    return frame
+
+
+def fetch(options):
+    """Return a JSON slice of a displayed frame; `options` is a JSON string."""
+    options = json.loads(options)
+    handle = options.get("handle")
+    if handle not in _handles:
+        return json.dumps({"handle": handle, "error": "Frame is no longer available, re-run the cell"})
+    offset = max(0, int(options.get("offset", 0)))
+    limit = max(1, int(options.get("limit", PAGE_ROWS)))
+    try:
+        frame = _view(handle, options.get("sortBy"), bool(options.get("ascending", True)),
+                      options.get("filters") or [])
+    except Exception as e:
+        return json.dumps({"handle": handle, "error": f"{type(e).__name__}: {e}"})
+    page = frame.iloc[offset:offset + limit, :MAX_COLUMNS]
+    return json.dumps({
+        "handle": handle,
+        "total": len(frame),
+        "offset": offset,
+        "index": [_cell(i) for i in page.index],
+        "rows": [[_cell(v) for v in row] for row in page.itertuples(index=False, name=None)],
+    }, default=str)
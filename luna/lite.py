@@ -0,0 +1,256 @@
+"""Lightweight execution worker: runs cells in a plain Python process.
+
+Started by the backend (LiteSession) in place of an ipykernel for sessions
+that only run small scripts. No ZMQ, no IPython, nothing imported up front:
+a worker costs the interpreter's ~10MB instead of a kernel's ~100MB.
+
+Protocol: one JSON object per line. The backend writes to our stdin:
+
+    {"type": "execute", "code": "..."}
+    {"type": "input_reply", "value": "..."}
+    {"type": "figures", "format": "svg", "width": 800, "pixel_ratio": 2}
+
+and we answer on stdout with frames shaped like the iopub messages the
+backend already forwards:
+
+    {"type": "ready", "pid": 1234}
+    {"type": "stream", "name": "stdout", "text": "..."}
+    {"type": "execute_result", "data": {"text/plain": "..."}}
+    {"type": "display_data", "data": {"image/png": "..."}, "metadata": {}}
+    {"type": "error", "ename": "...", "evalue": "...", "traceback": [...]}
+    {"type": "input_request", "prompt": "...", "password": false}
+    {"type": "done"}
+
+The protocol pipes are moved off fds 0/1 at startup, so stray writes from
+C code land in the log (stderr) instead of corrupting the stream. SIGINT
+interrupts the running cell with KeyboardInterrupt, as in a kernel.
+"""
+import ast
+import builtins
+import io
+import json
+import linecache
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+import types
+import warnings
+
+# Output is batched: a frame per FLUSH_INTERVAL or FLUSH_BYTES, not per print()
+FLUSH_INTERVAL = 0.05
+FLUSH_BYTES = 8192
+
+
+class Pipe:
+    def __init__(self):
+        self.reader = os.fdopen(os.dup(0), "rb")
+        self.writer = os.fdopen(os.dup(1), "wb")
+        self.lock = threading.Lock()
+        self.sending = False  # the main thread is writing a frame
+        self.deferred = False  # an interrupt arrived meanwhile
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        os.dup2(2, 1)
+
+    def send(self, frame):
+        data = json.dumps(frame, ensure_ascii=False).encode("utf-8", "surrogateescape") + b"\n"
+        main = threading.current_thread() is threading.main_thread()
+        if main:
+            self.sending = True
+        try:
+            with self.lock:
+                self.writer.write(data)
+                self.writer.flush()
+        finally:
+            if main:
+                self.sending = False
+        if main and self.deferred:
+            self.deferred = False
+            raise KeyboardInterrupt
+
+    def receive(self):
+        line = self.reader.readline()
+        return json.loads(line) if line else None
+
+
+class Stream(io.TextIOBase):
+    def __init__(self, pipe, name):
+        self.pipe = pipe
+        self.name = name
+        self.parts = []
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return False
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        with self.lock:
+            self.parts.append(text)
+            self.size += len(text)
+            if self.size >= FLUSH_BYTES:
+                self._flush()
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.parts:
+            text = "".join(self.parts)
+            self.parts, self.size = [], 0
+            self.pipe.send({"type": "stream", "name": self.name, "text": text})
+
+
+class Worker:
+    cell_prefix = "cell"  # cells' file names in tracebacks
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.stdout = Stream(pipe, "stdout")
+        self.stderr = Stream(pipe, "stderr")
+        self.cells = 0
+        self.interruptible = False
+        self.figure_settings = {}  # luna.figures.configure() arguments
+        # User code runs in a fresh __main__, so classes and functions it
+        # defines pickle like they would in a script
+        self.main = types.ModuleType("__main__")
+        self.main.__builtins__ = builtins
+        sys.modules["__main__"] = self.main
+
+    def flush(self):
+        self.stdout.flush()
+        self.stderr.flush()
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except (OSError, ValueError):
+                return  # the backend went away
+
+    def input(self, prompt=""):
+        self.flush()
+        self.pipe.send({"type": "input_request", "prompt": str(prompt), "password": False})
+        while True:
+            reply = self.pipe.receive()
+            if reply is None:
+                raise EOFError("the backend closed the connection")
+            if reply.get("type") != "figures":
+                return reply.get("value", "")
+            self.configure_figures(reply)
+
+    def configure_figures(self, message):
+        self.figure_settings.update((k, v) for k, v in message.items() if k != "type")
+
+    def execute(self, code):
+        self.cells += 1
+        filename = f"<{self.cell_prefix}-{self.cells}>"
+        # Tracebacks show the cell's source lines
+        linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+        namespace = self.main.__dict__
+        try:
+            tree = ast.parse(code, filename)
+            last = None
+            if tree.body and isinstance(tree.body[-1], ast.Expr):
+                last = ast.Expression(tree.body.pop().value)
+            exec(compile(tree, filename, "exec"), namespace)
+            if last is not None:
+                value = eval(compile(last, filename, "eval"), namespace)
+                if value is not None:
+                    namespace["_"] = value
+                    self.flush()
+                    self.pipe.send({"type": "execute_result", "data": {"text/plain": repr(value)}})
+        except BaseException as e:
+            self.flush()
+            self.report(e)
+        self.flush()
+        self.show_figures()
+
+    def report(self, error):
+        if isinstance(error, SyntaxError):
+            lines = traceback.format_exception_only(type(error), error)
+        else:
+            # Drop our own frame: the traceback starts in the cell
+            lines = traceback.format_exception(type(error), error, error.__traceback__.tb_next)
+        self.pipe.send({
+            "type": "error",
+            "ename": type(error).__name__,
+            "evalue": str(error),
+            "traceback": [line.rstrip("\n") for line in lines],
+        })
+
+    def show_figures(self):
+        # Figures left open by the cell, as in a kernel with inline plots
+        plt = sys.modules.get("matplotlib.pyplot")
+        if plt is None:
+            return
+        try:
+            from luna import figures  # format and DPI as in a kernel
+            figures.configure(**self.figure_settings)
+            for number in plt.get_fignums():
+                data, metadata = figures.render(plt.figure(number))
+                self.pipe.send({"type": "display_data", "data": data, "metadata": metadata})
+            plt.close("all")
+        except Exception as e:
+            self.report(e)
+
+    def on_interrupt(self, signum, frame):
+        # Only cells are interrupted, never the protocol handling around them
+        if not self.interruptible:
+            return
+        if self.pipe.sending:
+            # Raised once the frame is out: a half-written frame would end the session
+            self.pipe.deferred = True
+            return
+        raise KeyboardInterrupt
+
+    def run(self, code):
+        self.interruptible = True
+        try:
+            self.execute(code)
+        except KeyboardInterrupt:
+            pass  # arrived while reporting: the cell is over anyway
+        finally:
+            self.interruptible = False
+            self.pipe.deferred = False
+        self.pipe.send({"type": "done"})
+
+    def serve(self):
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        builtins.input = self.input
+        signal.signal(signal.SIGINT, self.on_interrupt)
+        # Like a kernel: the workspace first, the app directory last
+        sys.path[0] = os.getcwd()
+        if os.environ.get("LUNA_APP_DIR"):
+            sys.path.append(os.environ["LUNA_APP_DIR"])
+        warnings.filterwarnings("ignore", message=".*non-interactive.*")
+        threading.Thread(target=self.flush_periodically, name="flush", daemon=True).start()
+        self.pipe.send({"type": "ready", "pid": os.getpid()})
+        while True:
+            message = self.pipe.receive()
+            if message is None:
+                return
+            if message.get("type") == "execute":
+                self.run(message.get("code", ""))
+            elif message.get("type") == "figures":
+                self.configure_figures(message)
+
+
+if __name__ == "__main__":
+    Worker(Pipe()).serve()
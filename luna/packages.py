@@ -0,0 +1,240 @@
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+# Per-user package overlays on top of the shared, read-only base environment.
+#
+# Packages are never installed into a user's environment directly. Instead:
+#   wheelhouse/   every wheel ever fetched or built, shared by all users (and
+#                 the only source when LUNA_PIP_OFFLINE=1)
+#   store/<wheel>/  each wheel unpacked exactly once
+#   <overlay>/    per user: symlinks into store/, first on the kernel's sys.path
+# pip only resolves (a dry run against base + overlay); so installing a
+# package the 50th time is a handful of symlinks, not a download or a build.
+
+PACKAGES_DIR = os.environ.get("LUNA_PACKAGES_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "packages"
+)
+WHEELHOUSE = os.environ.get("LUNA_WHEELHOUSE") or os.path.join(PACKAGES_DIR, "wheelhouse")
+STORE = os.path.join(PACKAGES_DIR, "store")
+OFFLINE = os.environ.get("LUNA_PIP_OFFLINE") == "1"
+# Set by the backend for each kernel: the user's overlay directory
+OVERLAY = os.environ.get("LUNA_OVERLAY")
+MANIFEST = ".luna-overlay.json"
+
+# These would install around the overlay into the shared environment
+_REFUSED_FLAGS = {"--target", "-t", "--user", "--prefix", "--root", "--editable", "-e"}
+
+
+def _canonical(name):
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _pip(*args, overlay=None):
+    env = dict(os.environ)
+    if overlay:
+        # pip must see what the user already has, or it re-resolves it
+        env["PYTHONPATH"] = os.pathsep.join(p for p in (overlay, env.get("PYTHONPATH")) if p)
+    result = subprocess.run([sys.executable, "-m", "pip", *args, "--disable-pip-version-check"],
+                            capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or result.stdout.strip())
+    return result.stdout
+
+
+def _index_args():
+    os.makedirs(WHEELHOUSE, exist_ok=True)
+    return ["--find-links", WHEELHOUSE] + (["--no-index"] if OFFLINE else [])
+
+
+def resolve(args, overlay=None):
+    """(name, version) of every distribution `pip install <args>` would add."""
+    # Report to a file: kernels force colored output, which pip applies to stdout too
+    fd, report_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        _pip("install", "--dry-run", "--quiet", "--report", report_path, *_index_args(), *args, overlay=overlay)
+        with open(report_path, encoding="utf-8") as f:
+            report = json.load(f)
+    finally:
+        os.remove(report_path)
+    return [(item["metadata"]["name"], item["metadata"]["version"]) for item in report["install"]]
+
+
+def _cached_wheel(name, version):
+    from packaging.tags import sys_tags
+    from packaging.utils import parse_wheel_filename
+    from packaging.version import Version
+
+    supported = set(sys_tags())
+    for filename in os.listdir(WHEELHOUSE):
+        if not filename.endswith(".whl"):
+            continue
+        try:
+            wheel_name, wheel_version, _, tags = parse_wheel_filename(filename)
+        except ValueError:
+            continue
+        if wheel_name == _canonical(name) and wheel_version == Version(version) and tags & supported:
+            return os.path.join(WHEELHOUSE, filename)
+    return None
+
+
+def wheel_for(name, version):
+    """Path of the wheel in the shared wheelhouse, fetching or building it once."""
+    path = _cached_wheel(name, version)
+    if path:
+        return path, True
+    # Build into a private directory and move in: another kernel may be
+    # looking at the wheelhouse at the same time
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=WHEELHOUSE)
+    try:
+        _pip("wheel", "--no-deps", "--wheel-dir", tmp, *_index_args(), f"{name}=={version}")
+        for filename in os.listdir(tmp):
+            os.replace(os.path.join(tmp, filename), os.path.join(WHEELHOUSE, filename))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    path = _cached_wheel(name, version)
+    if not path:
+        raise RuntimeError(f"No compatible wheel for {name}=={version}")
+    return path, False
+
+
+def unpack(wheel_path):
+    """Directory holding the unpacked wheel in the shared store (unpacked once)."""
+    target = os.path.join(STORE, os.path.basename(wheel_path)[:-len(".whl")])
+    if os.path.isdir(target):
+        return target
+    os.makedirs(STORE, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=STORE)
+    with zipfile.ZipFile(wheel_path) as wheel:
+        wheel.extractall(tmp)
+    # <dist>.data/purelib|platlib are meant to land next to the packages
+    for data_dir in [e for e in os.listdir(tmp) if e.endswith(".data")]:
+        for scheme in ("purelib", "platlib"):
+            source = os.path.join(tmp, data_dir, scheme)
+            if os.path.isdir(source):
+                for entry in os.listdir(source):
+                    os.replace(os.path.join(source, entry), os.path.join(tmp, entry))
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)  # another kernel unpacked it first
+    return target
+
+
+def _read_manifest(overlay):
+    try:
+        with open(os.path.join(overlay, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(overlay, manifest):
+    path = os.path.join(overlay, MANIFEST)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _remove(path):
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+def _unlink(overlay, manifest, name):
+    for entry in manifest.pop(_canonical(name), {}).get("entries", []):
+        _remove(os.path.join(overlay, entry))
+
+
+def link(store_dir, overlay, name, version):
+    """Expose an unpacked wheel in `overlay`, replacing any other version."""
+    manifest = _read_manifest(overlay)
+    _unlink(overlay, manifest, name)
+    entries = sorted(e for e in os.listdir(store_dir) if not e.endswith(".data"))
+    for entry in entries:
+        # Namespace packages shared by two distributions are not merged:
+        # the last one linked wins that directory
+        destination = os.path.join(overlay, entry)
+        _remove(destination)
+        os.symlink(os.path.join(store_dir, entry), destination)
+    manifest[_canonical(name)] = {"name": name, "version": version, "store": os.path.basename(store_dir),
+                                  "entries": entries}
+    _write_manifest(overlay, manifest)
+
+
+def install(args, overlay=None):
+    """`pip install <args>` into the overlay. Returns what was linked."""
+    overlay = overlay or OVERLAY
+    if not overlay:
+        raise RuntimeError("No package overlay configured for this kernel (LUNA_OVERLAY)")
+    refused = [a for a in args if a.split("=")[0] in _REFUSED_FLAGS]
+    if refused:
+        raise ValueError(f"{', '.join(refused)} not supported: packages always go to your overlay")
+    os.makedirs(overlay, exist_ok=True)
+
+    linked = []
+    for name, version in resolve(args, overlay):
+        wheel, cached = wheel_for(name, version)
+        link(unpack(wheel), overlay, name, version)
+        linked.append({"name": name, "version": version, "cached": cached})
+
+    import importlib
+    importlib.invalidate_caches()
+    if overlay not in sys.path:
+        sys.path.insert(0, overlay)
+    return linked
+
+
+def uninstall(names, overlay=None):
+    overlay = overlay or OVERLAY
+    manifest = _read_manifest(overlay)
+    removed = [n for n in names if _canonical(n) in manifest]
+    for name in removed:
+        _unlink(overlay, manifest, name)
+    _write_manifest(overlay, manifest)
+    return removed
+
+
+def installed(overlay=None):
+    manifest = _read_manifest(overlay or OVERLAY)
+    return {entry["name"]: entry["version"] for entry in manifest.values()}
+
+
+def pip_magic(line):
+    """%pip install/uninstall/list against the user's overlay."""
+    args = shlex.split(line)
+    command, rest = (args[0], args[1:]) if args else ("", [])
+    if command == "install":
+        quiet = any(a in ("-q", "--quiet") for a in rest)
+        for item in install([a for a in rest if a not in ("-q", "--quiet")]):
+            if not quiet:
+                source = "shared cache" if item["cached"] else "downloaded"
+                print(f"Linked {item['name']}=={item['version']} ({source})")
+        if not quiet:
+            print("Restart the kernel if a previous version was already imported.")
+    elif command == "uninstall":
+        for name in uninstall([a for a in rest if not a.startswith("-")]):
+            print(f"Removed {name}")
+    elif command in ("list", "freeze"):
+        for name, version in sorted(installed().items()):
+            print(f"{name}=={version}")
+    else:
+        print("Supported here: %pip install, %pip uninstall, %pip list")
+
+
+def install_magic():
+    try:
+        ip = get_ipython()  # noqa: F821 - provided by IPython
+    except NameError:
+        return
+    if OVERLAY:
+        ip.register_magic_function(pip_magic, "line", "pip")
@@ -0,0 +1,313 @@
+"""Shared execution worker: many users' namespaces in one Python process.
+
+Started once per backend (SharedWorker) for sessions on the "shared"
+engine. Each session is a Namespace: its own __main__ dict, builtins with
+input() and open() bound to the session, stdout/stderr captured per
+namespace, and a thread that runs its cells. Imported modules (numpy,
+pandas...) are loaded once and shared, which is where the memory goes in
+a kernel, so a namespace costs kilobytes instead of a process.
+
+Each namespace's thread has a working directory of its own, the user's
+workspace (unshare(CLONE_FS), Linux), so relative paths work everywhere
+(pandas, numpy, os, pathlib) as in a kernel. Where a thread can't have
+one, only open() resolves them, and the worker's own directory is
+removed: anything else fails with FileNotFoundError instead of landing
+in a directory every user shares.
+
+CPU is time-sliced between namespaces: cells run in their own threads and
+the interpreter hands the GIL over every LUNA_SHARED_SLICE_MS, so a busy
+loop in one namespace can't starve the others; a cell that has used more
+than its CPU budget (thread CPU time, see "cpuLimit") gets CpuLimitExceeded.
+This isolates mistakes, not adversaries: namespaces share sys.modules and
+the process, and a segfault ends every session in the worker.
+
+Protocol: the lite worker's JSON lines (luna/lite.py), each tagged with the
+namespace id "ns". Besides execute and input_reply the backend sends
+
+    {"type": "open", "ns": "...", "cwd": "...", "cpuLimit": 10}
+    {"type": "interrupt", "ns": "..."}
+    {"type": "close", "ns": "..."}
+
+"done" frames report the cell's CPU seconds as "cpu", and the "ready"
+frame says whether namespaces got their own working directory
+("threadCwd").
+"""
+import builtins
+import ctypes
+import io
+import os
+import queue
+import signal
+import sys
+import tempfile
+import threading
+import time
+import types
+
+from luna.lite import FLUSH_INTERVAL, Pipe, Stream, Worker
+
+SLICE = float(os.environ.get("LUNA_SHARED_SLICE_MS", 2)) / 1000
+CPU_CHECK_INTERVAL = 0.1
+CLONE_FS = 0x200
+
+_sleep = time.sleep
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+class CpuLimitExceeded(BaseException):
+    # BaseException: a cell's `except Exception` must not swallow it
+    pass
+
+
+def raise_in(thread_id, exception):
+    """Raise exception in another thread at its next bytecode (None clears a pending one)."""
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id),
+                                               ctypes.py_object(exception) if exception else None)
+
+
+def chdir_thread(path):
+    """Give the calling thread a working directory of its own, set to path.
+
+    Returns False, changing nothing, where threads share the process's one
+    (not Linux, or a seccomp profile that denies unshare).
+    """
+    unshare = getattr(_libc, "unshare", None)
+    if unshare is None or unshare(CLONE_FS) != 0:
+        return False
+    try:
+        os.chdir(path)
+    except OSError:
+        return False
+    return True
+
+
+class TaggedPipe:
+    def __init__(self, pipe, ns):
+        self.pipe = pipe
+        self.ns = ns
+        self.sending = False
+        self.deferred = False
+
+    def send(self, frame):
+        frame["ns"] = self.ns
+        self.pipe.send(frame)
+
+
+class Namespace(Worker):
+    def __init__(self, pipe, ns, cwd, cpu_limit):
+        self.pipe = TaggedPipe(pipe, ns)
+        self.ns = ns
+        self.cwd = cwd
+        self.cpu_limit = cpu_limit
+        self.own_cwd = False  # set by serve(), in the namespace's thread
+        self.stdout = Stream(self.pipe, "stdout")
+        self.stderr = Stream(self.pipe, "stderr")
+        self.cells = 0
+        self.cell_prefix = f"cell-{ns[:8]}"  # linecache is shared by all namespaces
+        self.interruptible = False
+        self.lock = threading.Lock()  # orders interrupts against the end of a cell
+        self.cancel = threading.Event()  # wakes an interrupted sleep()
+        self.replies = queue.Queue()  # input_reply values, None = interrupted
+        self.work = queue.Queue()  # code to run, None = close
+        self.cpu_started = None  # thread CPU time when the running cell started
+        self.main = types.ModuleType("__main__")
+        self.main.__builtins__ = dict(builtins.__dict__, input=self.input, open=self.open)
+        self.thread = threading.Thread(target=self.serve, name=f"ns-{ns}", daemon=True)
+
+    def open(self, file, *args, **kwargs):
+        # Relative paths are the user's workspace, as in their own kernel
+        if not self.own_cwd and isinstance(file, (str, bytes, os.PathLike)) and not os.path.isabs(file):
+            file = os.path.join(self.cwd, os.fsdecode(file))
+        return io.open(file, *args, **kwargs)
+
+    def input(self, prompt=""):
+        self.flush()
+        self.pipe.send({"type": "input_request", "prompt": str(prompt), "password": False})
+        value = self.replies.get()
+        if value is None:
+            raise KeyboardInterrupt
+        return value
+
+    def report(self, error):
+        if isinstance(error, CpuLimitExceeded) and not error.args:
+            # Raised across threads as a bare class: no message of its own
+            error.args = (f"the cell used more than {self.cpu_limit:g}s of CPU time",)
+        super().report(error)
+
+    def show_figures(self):
+        pass  # pyplot's figures are process-wide: not shared between users
+
+    def interrupt(self, exception=KeyboardInterrupt):
+        # exception: a class, which is what PyThreadState_SetAsyncExc takes
+        with self.lock:
+            if not self.interruptible:
+                return
+            raise_in(self.thread.ident, exception)
+            self.cancel.set()
+            self.replies.put(None)
+
+    def cpu_used(self):
+        return time.thread_time() - self.cpu_started
+
+    def run(self, code):
+        with self.lock:
+            self.cancel.clear()
+            self.replies = queue.Queue()
+            self.cpu_started = time.thread_time()
+            self.interruptible = True
+        try:
+            self.execute(code)
+        except (KeyboardInterrupt, CpuLimitExceeded):
+            pass  # arrived while reporting: the cell is over anyway
+        while True:
+            try:
+                with self.lock:
+                    self.interruptible = False
+                    raise_in(self.thread.ident, None)
+                break
+            except (KeyboardInterrupt, CpuLimitExceeded):
+                continue  # was already on its way; nothing is pending anymore
+        cpu = self.cpu_used()
+        self.cpu_started = None
+        self.pipe.send({"type": "done", "cpu": round(cpu, 4)})
+
+    def serve(self):
+        # Threads the cells start get this directory too
+        self.own_cwd = chdir_thread(self.cwd)
+        while True:
+            code = self.work.get()
+            if code is None:
+                return
+            self.run(code)
+
+
+class Router(io.TextIOBase):
+    """sys.stdout/stderr: writes go to the namespace of the writing thread."""
+
+    def __init__(self, worker, name, fallback):
+        self.worker = worker
+        self.name = name
+        self.fallback = fallback
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def writable(self):
+        return True
+
+    def _target(self):
+        ns = self.worker.by_thread.get(threading.get_ident())
+        return getattr(ns, self.name) if ns else self.fallback
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+
+class SharedWorker:
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.namespaces = {}  # ns id -> Namespace
+        self.by_thread = {}  # thread ident -> Namespace
+
+    def sleep(self, seconds):
+        # time.sleep() for everyone: an interrupted namespace wakes up at once
+        ns = self.by_thread.get(threading.get_ident())
+        if ns is None:
+            return _sleep(seconds)
+        try:
+            woken = ns.cancel.wait(seconds)
+        except KeyboardInterrupt:
+            woken = True  # the interrupt itself, raised inside wait()
+        if woken:
+            raise KeyboardInterrupt from None
+
+    def watch_cpu(self):
+        while True:
+            _sleep(CPU_CHECK_INTERVAL)
+            for ns in list(self.namespaces.values()):
+                started = ns.cpu_started
+                if started is None or not ns.cpu_limit or not ns.thread.ident:
+                    continue
+                try:
+                    used = time.clock_gettime(time.pthread_getcpuclockid(ns.thread.ident)) - started
+                except (OSError, ValueError):
+                    continue  # the thread just ended
+                if used > ns.cpu_limit:
+                    ns.interrupt(CpuLimitExceeded)
+
+    def open(self, message):
+        ns = Namespace(self.pipe, message["ns"], message["cwd"], message.get("cpuLimit"))
+        self.namespaces[ns.ns] = ns
+        ns.thread.start()
+        self.by_thread[ns.thread.ident] = ns
+
+    def close(self, ns_id):
+        ns = self.namespaces.pop(ns_id, None)
+        if ns is None:
+            return
+        ns.interrupt()
+        ns.work.put(None)
+        self.by_thread.pop(ns.thread.ident, None)
+
+    def dispatch(self, message):
+        kind = message.get("type")
+        if kind == "open":
+            self.open(message)
+            return
+        ns = self.namespaces.get(message.get("ns"))
+        if ns is None:
+            return
+        if kind == "execute":
+            ns.work.put(message.get("code", ""))
+        elif kind == "input_reply":
+            ns.replies.put(message.get("value", ""))
+        elif kind == "interrupt":
+            ns.interrupt()
+        elif kind == "close":
+            self.close(ns.ns)
+
+    def probe_thread_cwd(self):
+        probed = []
+        probe = threading.Thread(target=lambda: probed.append(chdir_thread(os.getcwd())))
+        probe.start()
+        probe.join()
+        if not probed[0]:
+            nowhere = tempfile.mkdtemp(prefix="luna-shared-")
+            os.chdir(nowhere)
+            os.rmdir(nowhere)
+        return probed[0]
+
+    def serve(self):
+        thread_cwd = self.probe_thread_cwd()
+        sys.stdout = Router(self, "stdout", sys.__stderr__)
+        sys.stderr = Router(self, "stderr", sys.__stderr__)
+        time.sleep = self.sleep
+        sys.setswitchinterval(SLICE)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # interrupts are per namespace
+        if os.environ.get("LUNA_APP_DIR"):
+            sys.path.append(os.environ["LUNA_APP_DIR"])
+        threading.Thread(target=self.watch_cpu, name="cpu", daemon=True).start()
+        threading.Thread(target=self.flush_periodically, name="flush", daemon=True).start()
+        self.pipe.send({"type": "ready", "pid": os.getpid(), "threadCwd": thread_cwd})
+        while True:
+            message = self.pipe.receive()
+            if message is None:
+                return
+            self.dispatch(message)
+
+    def flush_periodically(self):
+        while True:
+            _sleep(FLUSH_INTERVAL)
+            for ns in list(self.namespaces.values()):
+                try:
+                    ns.flush()
+                except (OSError, ValueError):
+                    return  # the backend went away
+
+
+if __name__ == "__main__":
+    SharedWorker(Pipe()).serve()
@@ -0,0 +1,151 @@
+import json
+import reprlib
+import sys
+import types
+
+# Names IPython injects into the user namespace that are never interesting
+HIDDEN_NAMES = {"In", "Out", "exit", "quit", "get_ipython"}
+
+PREVIEW_ROWS = 5
+STATS_SAMPLE = 10_000
+CELL_CHARS = 80
+
+_repr = reprlib.Repr()
+_repr.maxstring = CELL_CHARS
+_repr.maxother = CELL_CHARS
+_repr.maxlist = _repr.maxtuple = _repr.maxdict = _repr.maxset = 10
+
+
+def _user_namespace():
+    try:
+        return get_ipython().user_ns  # noqa: F821 - provided by IPython
+    except NameError:
+        return vars(sys.modules["__main__"])
+
+
+def _is_visible(name, value):
+    if name.startswith("_") or name in HIDDEN_NAMES:
+        return False
+    return not isinstance(value, (types.ModuleType, types.FunctionType, type))
+
+
+def _cell(value):
+    # Bounded repr: never builds the full repr of big containers or strings
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (bool, int, float)):
+        return value if value == value else None  # NaN is not valid JSON
+    return _repr.repr(value)
+
+
+def _frame_kind(value):
+    pd = sys.modules.get("pandas")
+    if pd is not None:
+        if isinstance(value, pd.DataFrame):
+            return "dataframe"
+        if isinstance(value, pd.Series):
+            return "series"
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(value, np.ndarray):
+        return "ndarray"
+    return None
+
+
+def _sampled_stats(frame):
+    # Strided sample keeps stats O(STATS_SAMPLE) even for 10M-row frames
+    step = max(1, len(frame) // STATS_SAMPLE)
+    sample = frame.iloc[::step].select_dtypes("number")
+    stats = {}
+    for column in sample.columns:
+        col = sample[column]
+        stats[str(column)] = {
+            "min": _cell(col.min()),
+            "max": _cell(col.max()),
+            "mean": _cell(float(col.mean())) if len(col) else None,
+        }
+    return {"sampled": step > 1, "sampleSize": len(sample), "columns": stats}
+
+
+def _rows(value, kind, offset, limit):
+    if kind == "dataframe":
+        page = value.iloc[offset:offset + limit]
+        return [[_cell(v) for v in row] for row in page.itertuples(index=False, name=None)]
+    if kind == "series":
+        return [[_cell(v)] for v in value.iloc[offset:offset + limit]]
+    if value.ndim == 0:
+        return [[_cell(value.item())]]
+    page = value[offset:offset + limit]
+    if page.ndim == 1:
+        return [[_cell(v)] for v in page.tolist()]
+    return [[_cell(v) for v in row.reshape(-1)[:CELL_CHARS]] for row in page]
+
+
+def describe(name, value, preview_rows=PREVIEW_ROWS):
+    kind = _frame_kind(value)
+    info = {"name": name, "type": type(value).__name__}
+
+    if kind == "dataframe":
+        info.update({
+            "shape": list(value.shape),
+            "columns": [str(c) for c in value.columns[:CELL_CHARS]],
+            "dtypes": [str(d) for d in value.dtypes[:CELL_CHARS]],
+            # deep=False: object columns are not walked, keeps this O(columns)
+            "memory": int(value.memory_usage(index=True, deep=False).sum()),
+            "preview": _rows(value, kind, 0, preview_rows),
+            "stats": _sampled_stats(value),
+        })
+    elif kind == "series":
+        info.update({
+            "shape": [len(value)],
+            "dtypes": [str(value.dtype)],
+            "memory": int(value.memory_usage(index=True, deep=False)),
+            "preview": _rows(value, kind, 0, preview_rows),
+        })
+    elif kind == "ndarray":
+        info.update({
+            "shape": list(value.shape),
+            "dtypes": [str(value.dtype)],
+            "memory": int(value.nbytes),
+            "preview": _rows(value, kind, 0, preview_rows),
+        })
+    else:
+        if hasattr(value, "__len__"):
+            try:
+                info["shape"] = [len(value)]
+            except Exception:
+                pass
+        info["memory"] = sys.getsizeof(value)
+        info["preview"] = _cell(value)
+    return info
+
+
+def summarize(offset=0, limit=50, preview_rows=PREVIEW_ROWS):
+    """Return a JSON page of user variables with bounded previews."""
+    ns = _user_namespace()
+    names = sorted(n for n, v in list(ns.items()) if _is_visible(n, v))
+    variables = []
+    for name in names[offset:offset + limit]:
+        try:
+            variables.append(describe(name, ns[name], preview_rows))
+        except Exception as e:
+            variables.append({"name": name, "type": type(ns[name]).__name__, "error": str(e)})
+    return json.dumps({"total": len(names), "offset": offset, "variables": variables}, default=str)
+
+
+def page(name, offset=0, limit=100):
+    """Return a JSON slice of rows from a DataFrame, Series or array variable."""
+    ns = _user_namespace()
+    if name not in ns:
+        return json.dumps({"name": name, "error": f"name '{name}' is not defined"})
+    value = ns[name]
+    kind = _frame_kind(value)
+    if kind is None:
+        return json.dumps({"name": name, "error": f"{type(value).__name__} does not support paging"})
+    total = len(value) if getattr(value, "ndim", 1) else 1
+    return json.dumps({
+        "name": name,
+        "total": total,
+        "offset": offset,
+        "rows": _rows(value, kind, offset, limit),
+    }, default=str)
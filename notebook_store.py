@@ -0,0 +1,244 @@
+import glob
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from output_store import OutputStore
+
+# Server-side notebooks, stored per user under storage/<userId>/.notebooks:
+#
+#   .notebooks/<notebookId>/notebook.json      current document (cells + output refs)
+#   .notebooks/<notebookId>/versions/<n>.json  hard links to previous documents
+#
+# Outputs go to the user's content-addressed OutputStore; outputs referenced
+# by any kept version are protected from its LRU eviction.
+#
+# Clients send per-cell patches instead of whole documents. The document
+# itself only holds code and output hashes, so an edit rewrites a few KB no
+# matter how many plots the notebook has; an output is written once, the
+# first time its content is seen, and shared by every version referencing it.
+
+NOTEBOOKS_DIR = ".notebooks"
+KEEP_VERSIONS = int(os.environ.get("LUNA_NOTEBOOK_VERSIONS", 20))
+
+_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+
+
+class VersionConflict(Exception):
+    """A patch was based on a version that is no longer current."""
+
+    def __init__(self, current: int):
+        super().__init__(f"Notebook is at version {current}")
+        self.current = current
+
+
+def _check_id(kind, value):
+    if not _ID_RE.match(value or "") or ".." in value:
+        raise ValueError(f"Invalid {kind} {value!r}")
+    return value
+
+
+def _write_atomic(path, data: bytes, fsync=True):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class NotebookStore:
+    def __init__(self, storage_root: str, outputs: OutputStore = None, fsync: bool = True):
+        self.storage_root = storage_root
+        self.outputs = outputs or OutputStore(storage_root)
+        self.outputs.protect(self.referenced)
+        self.fsync = fsync
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    # --- paths ---
+
+    def _user_root(self, user_id):
+        return os.path.join(self.storage_root, _check_id("user id", user_id), NOTEBOOKS_DIR)
+
+    def _notebook_dir(self, user_id, notebook_id):
+        return os.path.join(self._user_root(user_id), _check_id("notebook id", notebook_id))
+
+    def _lock(self, user_id, notebook_id):
+        with self._locks_guard:
+            return self._locks.setdefault((user_id, notebook_id), threading.Lock())
+
+    # --- outputs ---
+
+    def put_output(self, user_id, output) -> str:
+        """Store one output (any JSON value) and return its content hash."""
+        if isinstance(output, dict) and set(output) == {"$ref"}:
+            digest = output["$ref"]
+            if not self.outputs.exists(user_id, digest):
+                raise ValueError(f"Unknown output reference {digest!r}")
+            return digest
+        return self.outputs.put_json(user_id, output)
+
+    def get_output(self, user_id, digest):
+        return self.outputs.get_json(user_id, digest)
+
+    def referenced(self, user_id):
+        """Digests of every output used by a kept version of any notebook."""
+        digests = set()
+        pattern = os.path.join(self._user_root(user_id), "*", "versions", "*.json")
+        for path in glob.glob(pattern) + glob.glob(os.path.join(self._user_root(user_id), "*", "notebook.json")):
+            try:
+                with open(path, "rb") as f:
+                    document = json.loads(f.read())
+            except (OSError, ValueError):
+                continue
+            for cell in document.get("cells", []):
+                digests.update(cell.get("outputs", []))
+        return digests
+
+    # --- documents ---
+
+    def _cell(self, user_id, cell):
+        if not isinstance(cell, dict):
+            raise ValueError("A cell must be an object")
+        stored = {k: v for k, v in cell.items() if k not in ("output", "outputs")}
+        stored["id"] = str(cell.get("id") or uuid.uuid4().hex)
+        stored.setdefault("code", "")
+        outputs = cell.get("outputs")
+        if outputs is None:
+            # Legacy client format: a single rendered "output" string per cell
+            outputs = [cell["output"]] if cell.get("output") else []
+        stored["outputs"] = [self.put_output(user_id, o) for o in outputs]
+        return stored
+
+    def _read(self, directory, version=None):
+        path = os.path.join(directory, "notebook.json")
+        if version is not None:
+            path = os.path.join(directory, "versions", f"{int(version)}.json")
+        try:
+            with open(path, "rb") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            raise KeyError(version if version is not None else os.path.basename(directory))
+
+    def _commit(self, directory, document):
+        # notebook.json is replaced atomically and the same inode is linked
+        # into versions/, so a version costs no extra bytes
+        versions = os.path.join(directory, "versions")
+        os.makedirs(versions, exist_ok=True)
+        data = json.dumps(document, separators=(",", ":")).encode("utf-8")
+        tmp = os.path.join(directory, f"notebook.{uuid.uuid4().hex}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.link(tmp, os.path.join(versions, f"{document['version']}.json"))
+        os.replace(tmp, os.path.join(directory, "notebook.json"))
+
+        if KEEP_VERSIONS:
+            for v in sorted(self._versions(directory))[:-KEEP_VERSIONS]:
+                os.remove(os.path.join(versions, f"{v}.json"))
+
+    def _versions(self, directory):
+        return [int(os.path.basename(p)[:-5]) for p in glob.glob(os.path.join(directory, "versions", "*.json"))]
+
+    def _resolve(self, user_id, document, refs):
+        if refs:
+            return document
+        cells = [dict(c, outputs=[self.get_output(user_id, d) for d in c["outputs"]]) for c in document["cells"]]
+        return dict(document, cells=cells)
+
+    def list(self, user_id):
+        notebooks = []
+        for path in glob.glob(os.path.join(self._user_root(user_id), "*", "notebook.json")):
+            with open(path, "rb") as f:
+                doc = json.loads(f.read())
+            notebooks.append({"id": doc["id"], "name": doc.get("name"), "version": doc["version"],
+                              "updated": doc["updated"], "cells": len(doc["cells"])})
+        return sorted(notebooks, key=lambda n: n["updated"], reverse=True)
+
+    def load(self, user_id, notebook_id, version=None, refs=False):
+        """The document with outputs inlined (or as hashes with refs=True)."""
+        document = self._read(self._notebook_dir(user_id, notebook_id), version)
+        return self._resolve(user_id, document, refs)
+
+    def versions(self, user_id, notebook_id):
+        directory = self._notebook_dir(user_id, notebook_id)
+        self._read(directory)
+        return sorted(self._versions(directory), reverse=True)
+
+    def save(self, user_id, notebook_id, notebook: dict, base_version=None):
+        """Replace the whole document (create, import, or full-save fallback)."""
+        directory = self._notebook_dir(user_id, notebook_id)
+        with self._lock(user_id, notebook_id):
+            try:
+                current = self._read(directory)
+            except KeyError:
+                current = {"version": 0, "created": time.time()}
+            if base_version is not None and base_version != current["version"]:
+                raise VersionConflict(current["version"])
+            document = {
+                "id": notebook_id,
+                "name": notebook.get("name", current.get("name")),
+                "metadata": notebook.get("metadata", current.get("metadata", {})),
+                "version": current["version"] + 1,
+                "created": current["created"],
+                "updated": time.time(),
+                "cells": [self._cell(user_id, c) for c in notebook.get("cells", [])],
+            }
+            self._commit(directory, document)
+            return document
+
+    def patch(self, user_id, notebook_id, ops: list, base_version=None):
+        """Apply per-cell operations and commit them as one new version.
+
+        Operations:
+            {"op": "upsert", "cell": {...}, "index": 3}   insert or replace by cell id
+            {"op": "delete", "id": "..."}
+            {"op": "move", "id": "...", "index": 0}
+            {"op": "meta", "name": "...", "metadata": {...}}
+        Only outputs carried by upserts are hashed and (if new) written.
+        """
+        directory = self._notebook_dir(user_id, notebook_id)
+        with self._lock(user_id, notebook_id):
+            document = self._read(directory)
+            if base_version is not None and base_version != document["version"]:
+                raise VersionConflict(document["version"])
+            cells = document["cells"]
+            for op in ops:
+                kind = op.get("op")
+                if kind == "upsert":
+                    if not isinstance(op.get("cell"), dict) or not op["cell"].get("id"):
+                        raise ValueError("upsert needs a cell with an id")
+                    cell = self._cell(user_id, op["cell"])
+                    position = next((i for i, c in enumerate(cells) if c["id"] == cell["id"]), None)
+                    if position is not None and "index" not in op:
+                        cells[position] = cell
+                        continue
+                    if position is not None:
+                        cells.pop(position)
+                    cells.insert(op.get("index", len(cells)), cell)
+                elif kind in ("delete", "move"):
+                    position = next((i for i, c in enumerate(cells) if c["id"] == op.get("id")), None)
+                    if position is None:
+                        raise ValueError(f"No cell {op.get('id')!r}")
+                    if kind == "move" and not isinstance(op.get("index"), int):
+                        raise ValueError("move needs an integer index")
+                    cell = cells.pop(position)
+                    if kind == "move":
+                        cells.insert(op["index"], cell)
+                elif kind == "meta":
+                    for key in ("name", "metadata"):
+                        if key in op:
+                            document[key] = op[key]
+                else:
+                    raise ValueError(f"Unknown patch op {kind!r}")
+            document["version"] += 1
+            document["updated"] = time.time()
+            self._commit(directory, document)
+            return document
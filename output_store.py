@@ -0,0 +1,192 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib is used when zstandard isn't installed
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed output blobs, per user under storage/<userId>/.outputs.
+#
+# A blob is named by the sha256 of its uncompressed bytes, so storing an output
+# a second time (re-running a cell that draws the same plot) writes nothing,
+# and the URL it is served under never changes: browsers cache it for good.
+# Blobs are compressed (zstd, or zlib without the zstandard package) unless
+# that doesn't pay, e.g. PNGs. Each user has a quota; when it is exceeded the
+# least recently used blobs are evicted, except those a registered
+# "protector" (the notebook store) still references.
+
+OUTPUTS_DIR = ".outputs"
+QUOTA_BYTES = int(float(os.environ.get("LUNA_OUTPUT_QUOTA_MB", 200)) * 1024 * 1024)
+# Eviction frees down to this fraction of the quota, so a full store doesn't
+# evict on every single write
+LOW_WATER = 0.9
+
+# First byte of every blob file names its codec
+RAW, ZLIB, ZSTD = b"-", b"z", b"Z"
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+_USER_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+
+
+class QuotaExceeded(Exception):
+    """Nothing evictable is left and the user's outputs still exceed the quota."""
+
+
+def digest_of(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def canonical_json(value) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def _compress(data: bytes):
+    if zstandard is not None:
+        packed, codec = zstandard.ZstdCompressor(level=3).compress(data), ZSTD
+    else:
+        packed, codec = zlib.compress(data, 6), ZLIB
+    # Already-compressed payloads (PNG, WebP) would only cost CPU on every read
+    if len(packed) > len(data) * 0.95:
+        return RAW + data
+    return codec + packed
+
+
+def _decompress(blob: bytes):
+    codec, payload = blob[:1], blob[1:]
+    if codec == RAW:
+        return payload
+    if codec == ZLIB:
+        return zlib.decompress(payload)
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Output was stored with zstd; install the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"Unknown output codec {codec!r}")
+
+
+class OutputStore:
+    def __init__(self, storage_root: str, quota: int = QUOTA_BYTES):
+        self.storage_root = storage_root
+        self.quota = quota
+        self.protectors = []
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    def _user_dir(self, user_id):
+        if not _USER_RE.match(user_id or "") or ".." in user_id:
+            raise ValueError(f"Invalid user id {user_id!r}")
+        return os.path.join(self.storage_root, user_id, OUTPUTS_DIR)
+
+    def _path(self, user_id, digest):
+        if not _DIGEST_RE.match(digest or ""):
+            raise ValueError(f"Invalid output reference {digest!r}")
+        return os.path.join(self._user_dir(user_id), digest[:2], digest)
+
+    def protect(self, referenced):
+        """Register `referenced(user_id) -> set of digests` that must never be evicted."""
+        self.protectors.append(referenced)
+
+    def exists(self, user_id, digest) -> bool:
+        return os.path.exists(self._path(user_id, digest))
+
+    def usage(self, user_id) -> int:
+        with self._lock:
+            return self._scan_usage(user_id)
+
+    def _scan_usage(self, user_id):
+        if user_id not in self._usage:
+            self._usage[user_id] = sum(os.path.getsize(p) for p in self._blobs(user_id))
+        return self._usage[user_id]
+
+    def _blobs(self, user_id):
+        return glob.glob(os.path.join(self._user_dir(user_id), "??", "*"))
+
+    def put(self, user_id, data: bytes) -> str:
+        """Store `data` once and return its digest; known content is only touched."""
+        digest = digest_of(data)
+        path = self._path(user_id, digest)
+        with self._lock:
+            usage = self._scan_usage(user_id)
+            try:
+                os.utime(path)  # LRU: modification time is the last use
+                return digest
+            except FileNotFoundError:
+                pass
+            blob = _compress(data)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)
+            self._usage[user_id] = usage + len(blob)
+            if self._usage[user_id] > self.quota:
+                self._evict(user_id, keep=digest)
+        return digest
+
+    def get(self, user_id, digest) -> bytes:
+        path = self._path(user_id, digest)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            raise KeyError(digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted meanwhile; we already have the bytes
+        return _decompress(blob)
+
+    def put_json(self, user_id, value) -> str:
+        return self.put(user_id, canonical_json(value))
+
+    def get_json(self, user_id, digest):
+        return json.loads(self.get(user_id, digest))
+
+    def _evict(self, user_id, keep):
+        protected = {keep}
+        for referenced in self.protectors:
+            protected |= set(referenced(user_id))
+
+        candidates = []
+        for path in self._blobs(user_id):
+            if os.path.basename(path) in protected or path.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            candidates.append((stat.st_mtime, stat.st_size, path))
+        candidates.sort()
+
+        target = self.quota * LOW_WATER
+        evicted = 0
+        for _, size, path in candidates:
+            if self._usage[user_id] <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._usage[user_id] -= size
+            evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} output(s) of user {user_id}, "
+                        f"{self._usage[user_id] / 1024 / 1024:.1f} MB in use")
+
+        if self._usage[user_id] > self.quota:
+            # Only protected outputs left: refuse the new one rather than
+            # silently dropping something a saved notebook points to
+            path = self._path(user_id, keep)
+            self._usage[user_id] -= os.path.getsize(path)
+            os.remove(path)
+            raise QuotaExceeded(f"Output storage quota of {self.quota // (1024 * 1024)} MB exceeded")
@@ -0,0 +1,209 @@
+import json
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+try:
+    import msgpack
+except ImportError:  # optional: without it every client gets JSON
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder is the fallback
+    orjson = None
+
+# Wire encodings of the /ws protocol.
+#
+# JSON text frames are the default. A client offering the "luna.msgpack.v1"
+# subprotocol gets binary msgpack frames instead, with the protocol's
+# verbose parts made compact:
+#   - known keys become integer map keys (their index in KEYS) and known
+#     message types small integers (their index in TYPES); both are one byte
+#     in msgpack and cannot clash with a string key
+#   - cell ids become integer handles: the first message about a cell carries
+#     both the handle and the full id (under CELL_ID_KEY), later ones only
+#     the handle. Clients may send either the handle or the id.
+# Unknown keys and types pass through unchanged, so new messages need no
+# protocol change. Only append to the tables: indices are the protocol.
+# Compression is permessage-deflate, negotiated by uvicorn for either encoding.
+
+MSGPACK_SUBPROTOCOL = "luna.msgpack.v1"
+
+KEYS = (
+    "type", "cellId", "text", "name", "html", "image", "imageUrl", "htmlUrl", "frame",
+    "traceback", "ename", "evalue", "content", "requestId", "prompt", "password", "value",
+    "status", "reason", "elapsed", "code", "timeout", "error", "sessionId", "channel",
+)
+TYPES = (
+    "stream", "execute_result", "display_data", "error", "complete", "execute",
+    "input_request", "input_reply", "input_cancelled", "interrupt", "interrupt_reply",
+    "inspect", "inspect_reply", "complete_reply", "ping", "pong", "inspect_variables",
+    "variables", "variable_page", "fetch_rows", "rows", "restart", "restart_success", "session",
+    "queued", "rejected", "attach", "attached", "detach", "detached",
+)
+CELL_ID_KEY = 127
+_KEY_CODES = {key: code for code, key in enumerate(KEYS)}
+_TYPE_CODES = {name: code for code, name in enumerate(TYPES)}
+
+
+# Outbound JSON. orjson is several times faster than the stdlib encoder on
+# the large HTML tables, frames and tracebacks; values it refuses (ints beyond
+# 64 bits, ...) still go through the stdlib. Without orjson, stream chunks
+# reuse their encoded envelope ({"cellId":..,"type":"stream","name":..) and
+# only the text is encoded per message; helper results that are already JSON
+# are spliced in as text (RawJSON) rather than parsed and encoded again.
+
+_encode_string = json.encoder.encode_basestring
+# Stream envelopes cached per connection (cell id, stream name)
+ENVELOPE_CACHE_SIZE = 64
+
+
+def dumps(obj) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class RawJSON(str):
+    """The encoded text of a JSON object, sent as-is."""
+
+
+def splice(encoded: str, raw: RawJSON) -> str:
+    """Add the members of the JSON object `raw` to the encoded object `encoded`.
+
+    Like {**message, **raw}: for a repeated key the later (raw) one wins in
+    JSON.parse.
+    """
+    raw = raw.strip()
+    if not (raw.startswith("{") and raw.endswith("}")):
+        raise ValueError("Only a JSON object can be spliced into a message")
+    members = raw[1:-1].strip()
+    if not members:
+        return encoded
+    if encoded == "{}":
+        return raw
+    return f"{encoded[:-1]},{members}}}"
+
+
+def negotiate(offered):
+    """The subprotocol to accept among those the client offered (None = JSON)."""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in (offered or []):
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def _lookup(table, code, what):
+    if not 0 <= code < len(table):
+        raise ValueError(f"Unknown {what} code {code}")
+    return table[code]
+
+
+class Codec:
+    """Compact msgpack encoding with per-connection cell handles.
+
+    The server side assigns handles (assign_handles=True); a client learns
+    them from the messages it decodes.
+    """
+
+    def __init__(self, assign_handles: bool = True):
+        self.assign_handles = assign_handles
+        self.handles = {}  # cell id -> handle
+        self.cells = {}  # handle -> cell id
+
+    def encode(self, message: dict) -> bytes:
+        compact = {}
+        for key, value in message.items():
+            if key == "type":
+                value = _TYPE_CODES.get(value, value)
+            elif key == "cellId" and isinstance(value, str):
+                handle = self.handles.get(value)
+                if handle is None and self.assign_handles:
+                    handle = self.handles[value] = len(self.handles) + 1
+                    self.cells[handle] = value
+                    compact[CELL_ID_KEY] = value
+                if handle is not None:
+                    value = handle
+            compact[_KEY_CODES.get(key, key)] = value
+        return msgpack.packb(compact, use_bin_type=True)
+
+    def decode(self, data: bytes) -> dict:
+        compact = msgpack.unpackb(data, raw=False, strict_map_key=False)
+        if not isinstance(compact, dict):
+            raise ValueError("A message must be a map")
+        full_id = compact.pop(CELL_ID_KEY, None)
+        message = {}
+        for key, value in compact.items():
+            if isinstance(key, int):
+                key = _lookup(KEYS, key, "key")
+            if key == "type" and isinstance(value, int):
+                value = _lookup(TYPES, value, "message type")
+            elif key == "cellId" and isinstance(value, int):
+                if full_id is not None:
+                    self.cells[value], self.handles[full_id] = full_id, value
+                if value not in self.cells:
+                    raise ValueError(f"Unknown cell handle {value}")
+                value = self.cells[value]
+            message[key] = value
+        return message
+
+
+class Connection:
+    """A WebSocket that sends and receives protocol messages in the negotiated encoding.
+
+    Sessions only call send_json/receive_json, so they work unchanged with
+    either encoding; everything else is delegated to the WebSocket.
+    """
+
+    def __init__(self, websocket: WebSocket, subprotocol: str = None):
+        self.websocket = websocket
+        self.subprotocol = subprotocol
+        self.codec = Codec() if subprotocol == MSGPACK_SUBPROTOCOL else None
+        self._envelopes = {}  # (cell id, stream name) -> encoded envelope
+
+    def __getattr__(self, name):
+        return getattr(self.websocket, name)
+
+    async def send_json(self, message: dict, raw: RawJSON = None):
+        """Send `message`, extended with the members of the JSON object `raw`."""
+        if self.codec:
+            if raw is not None:
+                message = {**message, **loads(str(raw))}
+            await self.websocket.send_bytes(self.codec.encode(message))
+            return
+        text = self.encode_text(message)
+        if raw is not None:
+            text = splice(text, raw)
+        await self.websocket.send_text(text)
+
+    def encode_text(self, message: dict) -> str:
+        if orjson is None and message.get("type") == "stream" and len(message) == 4:
+            cell_id, name, text = message.get("cellId"), message.get("name"), message.get("text")
+            if isinstance(cell_id, str) and isinstance(name, str) and isinstance(text, str):
+                envelope = self._envelopes.get((cell_id, name))
+                if envelope is None:
+                    if len(self._envelopes) >= ENVELOPE_CACHE_SIZE:
+                        self._envelopes.clear()
+                    envelope = self._envelopes[cell_id, name] = (
+                        f'{{"cellId":{_encode_string(cell_id)},"type":"stream",'
+                        f'"name":{_encode_string(name)},"text":'
+                    )
+                return f"{envelope}{_encode_string(text)}}}"
+        return dumps(message)
+
+    async def receive_json(self) -> dict:
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        if message.get("bytes") is not None:
+            if not self.codec:
+                raise ValueError("Binary frame on a JSON connection")
+            return self.codec.decode(message["bytes"])
+        # Text frames are always JSON, whatever was negotiated
+        return loads(message["text"])
@@ -9,6 +9,15 @@ class LunaBook {
         this.executingCells = new Set();
         this.kernelBusy = false;
         this.cellCompletionCallbacks = {};
+        // Lets a reconnect (or a reload of this tab) re-attach to the same kernel
+        this.sessionId = sessionStorage.getItem('luna_session_id');
+        this.awaitingReplay = false; // resumed: live outputs are in the coming replay
+        this.queuePosition = null; // place in the server's queue while waiting for a kernel
+        this.reconnectDelay = 5000; // doubles per failed attempt, reset once a kernel is ready
+        this.retryAfter = null; // server-suggested wait after a refused connection
+        this.pendingLookups = {}; // requestId -> resolve, for complete/inspect replies
+        this.lookupCounter = 0;
+        this.completionProviderRegistered = false;
         console.log("Luna Book v2.0 Loaded");
         this.init();
     }
@@ -103,6 +112,9 @@ class LunaBook {
         if (this.mode === 'offline') {
             statusEl.textContent = 'Offline (Pyodide)';
             statusEl.style.color = 'orange';
+        } else if (this.ws && this.ws.readyState === WebSocket.OPEN && this.queuePosition !== null) {
+            statusEl.textContent = `Waiting for a kernel (#${this.queuePosition} in queue)`;
+            statusEl.style.color = 'yellow';
         } else if (this.ws && this.ws.readyState === WebSocket.OPEN) {
             statusEl.textContent = 'Connected (Server)';
             statusEl.style.color = '#00ff00';
@@ -152,11 +164,12 @@ class LunaBook {
         const host = window.location.host;
 
         // 1. Proxy URL (Standard for Prod/Dev with Proxy)
-        const proxyUrl = `${protocol}//${host}/ws?userId=${this.userId}`;
+        const sessionParam = this.sessionId ? `&sessionId=${this.sessionId}` : '';
+        const proxyUrl = `${protocol}//${host}/ws?userId=${this.userId}${sessionParam}`;
 
         // 2. Direct URL (Fallback for Localhost if proxy fails)
         // Use 127.0.0.1 to avoid IPv6 localhost issues
-        const directUrl = `ws://127.0.0.1:8020/ws?userId=${this.userId}`;
+        const directUrl = `ws://127.0.0.1:8020/ws?userId=${this.userId}${sessionParam}`;
 
         console.log(`Attempting connection to Backend...`);
 
@@ -164,10 +177,14 @@ class LunaBook {
             console.log(`Connecting to: ${url}`);
             try {
                 const socket = new WebSocket(url);
+                let opened = false;
 
                 socket.onopen = () => {
+                    opened = true;
                     console.log(`Connected to Backend via ${url}`);
                     this.ws = socket;
+                    // Stored outputs (imageUrl/htmlUrl) are served by the same backend
+                    this.backendOrigin = new URL(url.replace(/^ws/, 'http')).origin;
                     this.setMode('online');
                 };
 
@@ -175,15 +192,21 @@ class LunaBook {
                     console.warn(`Disconnected from ${url}`);
                     // Retry fallback if on local machine
                     const isLocal = ['localhost', '127.0.0.1'].includes(window.location.hostname);
+                    this.queuePosition = null;
 
-                    if (!isRetry && url !== directUrl && isLocal) {
+                    if (!opened && !isRetry && url !== directUrl && isLocal) {
                         console.log("Proxy connection failed, trying direct connection...");
                         connect(directUrl, true);
                     } else {
                         console.log("Connection failed, switching to Offline mode");
                         this.setMode('offline');
                         if (navigator.onLine) {
-                            setTimeout(() => this.connectBackend(), 5000); // Retry loop
+                            // Back off with jitter, so a restarted or overloaded
+                            // server isn't hit by every open tab at once
+                            const delay = this.retryAfter || this.reconnectDelay * (0.5 + Math.random());
+                            this.retryAfter = null;
+                            this.reconnectDelay = Math.min(this.reconnectDelay * 2, 60000);
+                            setTimeout(() => this.connectBackend(), delay); // Retry loop
                         }
                     }
                 };
@@ -194,6 +217,61 @@ class LunaBook {
 
                 socket.onmessage = (event) => {
                     const msg = JSON.parse(event.data);
+                    if (msg.type === 'queued') {
+                        // Every kernel slot is taken; cells run offline meanwhile
+                        this.queuePosition = msg.position;
+                        this.updateStatusIndicator();
+                        return;
+                    }
+                    if (msg.type === 'rejected') {
+                        console.warn("Backend refused the connection:", msg.reason);
+                        if (msg.retryAfter) this.retryAfter = msg.retryAfter * 1000;
+                        return;
+                    }
+                    if (msg.type === 'session') {
+                        this.queuePosition = null;
+                        this.reconnectDelay = 5000;
+                        this.updateStatusIndicator();
+                        this.sessionId = msg.sessionId;
+                        sessionStorage.setItem('luna_session_id', msg.sessionId);
+                        if (msg.resumed) {
+                            console.log("Re-attached to running kernel", msg.sessionId);
+                            // Outputs sent while we were away (and until the reply) come in the replay
+                            this.awaitingReplay = true;
+                            socket.send(JSON.stringify({ type: 'replay' }));
+                        }
+                        this.sendFigureSettings();
+                        return;
+                    }
+                    if (msg.type === 'figures') {
+                        if (msg.error) console.warn("Figure settings not applied:", msg.error);
+                        return;
+                    }
+                    if (msg.type === 'replay') {
+                        this.applyReplay(msg);
+                        return;
+                    }
+                    if (this.awaitingReplay && !msg.channel &&
+                        ['stream', 'execute_result', 'display_data', 'update_display_data', 'error'].includes(msg.type)) {
+                        return;
+                    }
+                    if (msg.type === 'kernel_died' || msg.type === 'kernel_restarted' || msg.type === 'kernel_restart_failed') {
+                        // The failed cell itself gets an error and a complete message
+                        if (msg.type === 'kernel_died') {
+                            console.warn("Kernel died:", msg.reason, msg.restarting ? "(restarting)" : "");
+                        } else if (msg.type === 'kernel_restarted') {
+                            const restored = msg.restored.length ? `, restored: ${msg.restored.join(', ')}` : '';
+                            alert(`The kernel crashed and was restarted${restored}`);
+                        } else {
+                            alert(`The kernel crashed and could not be restarted: ${msg.reason}`);
+                        }
+                        return;
+                    }
+                    if (msg.requestId && this.pendingLookups[msg.requestId]) {
+                        this.pendingLookups[msg.requestId](msg);
+                        delete this.pendingLookups[msg.requestId];
+                        return;
+                    }
                     this.handleExecutionMessage(msg);
                 };
             } catch (e) {
@@ -205,6 +283,39 @@ class LunaBook {
         connect(proxyUrl);
     }
 
+    sendFigureSettings() {
+        // Figures are rendered for this screen: the output width and pixel ratio set their DPI
+        if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return;
+        const container = document.getElementById('cells-container');
+        const message = {
+            type: 'figures',
+            width: container ? container.clientWidth : 0,
+            pixelRatio: window.devicePixelRatio || 1,
+        };
+        const format = localStorage.getItem('luna_figure_format'); // png, svg or webp
+        if (format) message.format = format;
+        this.ws.send(JSON.stringify(message));
+    }
+
+    applyReplay(msg) {
+        // Outputs buffered by the backend while we were away: redraw those cells from them
+        this.awaitingReplay = false;
+        msg.cells.forEach(entry => {
+            if (!this.cells.find(c => c.id === entry.cellId)) return;
+            this.clearCellOutput(entry.cellId);
+            entry.outputs.forEach(output => this.handleExecutionMessage(output));
+            if (!entry.complete && entry.cellId === msg.executing) {
+                document.getElementById(entry.cellId)?.classList.add('executing');
+                this.executingCells.add(entry.cellId);
+                this.kernelBusy = true;
+                this.updateCellRunningState(entry.cellId, true);
+            }
+        });
+        if (msg.inputRequest) {
+            this.showInputPrompt(msg.inputRequest.cellId, msg.inputRequest.prompt);
+        }
+    }
+
     handleExecutionMessage(msg) {
         const cellId = msg.cellId;
         const outputElement = document.getElementById(`output-${cellId}`);
@@ -241,25 +352,51 @@ class LunaBook {
                 cell.output += msg.text;
             }
 
-        } else if (msg.type === 'execute_result' || msg.type === 'display_data') {
+        } else if (msg.type === 'execute_result' || msg.type === 'display_data' || msg.type === 'update_display_data') {
             console.log("Displaying result/data");
+            let target = outputElement;
+            if (msg.displayId) {
+                // display(..., display_id=...): updates redraw it in place
+                target = outputElement.querySelector(`[data-display-id="${CSS.escape(msg.displayId)}"]`);
+                if (!target) {
+                    target = document.createElement('div');
+                    target.dataset.displayId = msg.displayId;
+                    outputElement.append(target);
+                } else if (msg.type === 'update_display_data') {
+                    target.innerHTML = '';
+                }
+            }
             if (msg.text) {
                 let pre = document.createElement('pre');
                 pre.textContent = msg.text;
-                outputElement.append(pre);
+                target.append(pre);
                 cell.output += msg.text + "\n";
             }
             if (msg.html) {
                 const div = document.createElement('div');
                 div.innerHTML = msg.html;
-                outputElement.append(div);
+                target.append(div);
                 cell.output += msg.html;
             }
-            if (msg.image) {
+            if (msg.htmlUrl) {
+                // Large HTML is content-addressed: a re-run with the same output hits the HTTP cache
+                const div = document.createElement('div');
+                target.append(div);
+                fetch(this.backendOrigin + msg.htmlUrl)
+                    .then(r => r.text())
+                    .then(html => {
+                        div.innerHTML = html;
+                        cell.output += html;
+                    });
+            }
+            if (msg.image || msg.imageUrl) {
                 const img = document.createElement('img');
-                img.src = `data:image/png;base64,${msg.image}`;
+                img.src = msg.imageUrl ? this.backendOrigin + msg.imageUrl
+                                       : `data:${msg.imageType || 'image/png'};base64,${msg.image}`;
                 img.style.maxWidth = '100%';
-                outputElement.append(img);
+                // Rendered for a high-DPI screen: shown at its size in CSS pixels
+                if (msg.imageWidth) img.style.width = `${msg.imageWidth}px`;
+                target.append(img);
             }
 
         } else if (msg.type === 'error') {
@@ -278,6 +415,10 @@ class LunaBook {
         } else if (msg.type === 'input_request') {
             this.showInputPrompt(cellId, msg.prompt);
 
+        } else if (msg.type === 'input_cancelled') {
+            // Prompt abandoned by an interrupt or the server's input timeout
+            outputElement.querySelectorAll('.input-prompt-container').forEach(el => el.remove());
+
         } else if (msg.type === 'complete') {
             const cellElement = document.getElementById(cellId);
             if (cellElement) {
@@ -394,6 +535,7 @@ class LunaBook {
             if (this.mode === 'online' && this.ws) {
                 this.ws.send(JSON.stringify({
                     type: 'input_reply',
+                    cellId: cellId,
                     value: value
                 }));
             } else {
@@ -437,6 +579,10 @@ class LunaBook {
         document.getElementById('export-btn').addEventListener('click', () => this.showExportModal());
         document.getElementById('share-btn').addEventListener('click', () => this.showShareModal());
         document.getElementById('add-cell-btn').addEventListener('click', () => this.addCell());
+        window.addEventListener('resize', () => {
+            clearTimeout(this.figureResizeTimer);
+            this.figureResizeTimer = setTimeout(() => this.sendFigureSettings(), 500);
+        });
 
         document.getElementById('open-btn').addEventListener('click', () => this.openNotebook());
 
@@ -799,6 +945,7 @@ class LunaBook {
             });
 
             cell.editor = editor;
+            this.registerCompletionProvider();
 
             editor.addCommand(monaco.KeyMod.CtrlCmd | monaco.KeyCode.Enter, () => {
                 this.runCell(cell.id);
@@ -812,6 +959,47 @@ class LunaBook {
         });
     }
 
+    requestLookup(type, payload) {
+        const requestId = `${type}-${++this.lookupCounter}`;
+        return new Promise((resolve) => {
+            this.pendingLookups[requestId] = resolve;
+            this.ws.send(JSON.stringify({ type, requestId, ...payload }));
+        });
+    }
+
+    registerCompletionProvider() {
+        // Kernel-backed completions; the backend debounces, cancels stale
+        // requests and answers module attributes (np., pd.DataFrame.) from cache
+        if (this.completionProviderRegistered) return;
+        this.completionProviderRegistered = true;
+
+        monaco.languages.registerCompletionItemProvider('python', {
+            triggerCharacters: ['.'],
+            provideCompletionItems: async (model, position) => {
+                if (this.mode !== 'online' || !this.ws || this.ws.readyState !== WebSocket.OPEN) {
+                    return { suggestions: [] };
+                }
+                const reply = await this.requestLookup('complete', {
+                    code: model.getValue(),
+                    cursorPos: model.getOffsetAt(position)
+                });
+                if (!reply.matches) return { suggestions: [] };
+
+                const start = model.getPositionAt(reply.cursorStart);
+                const end = model.getPositionAt(reply.cursorEnd);
+                const range = new monaco.Range(start.lineNumber, start.column, end.lineNumber, end.column);
+                return {
+                    suggestions: reply.matches.map(match => ({
+                        label: match,
+                        kind: monaco.languages.CompletionItemKind.Variable,
+                        insertText: match,
+                        range
+                    }))
+                };
+            }
+        });
+    }
+
     updateEditorHeight(cellId, editor) {
         const lineCount = editor.getModel().getLineCount();
         const lineHeight = 21; // Approx for 16px font
@@ -846,7 +1034,7 @@ class LunaBook {
 
         const code = cell.editor ? cell.editor.getValue() : cell.code;
 
-        if (this.mode === 'online' && this.ws && this.ws.readyState === WebSocket.OPEN) {
+        if (this.mode === 'online' && this.ws && this.ws.readyState === WebSocket.OPEN && this.queuePosition === null) {
             console.log("Executing via Backend");
             this.ws.send(JSON.stringify({
                 type: 'execute',
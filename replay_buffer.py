@@ -0,0 +1,136 @@
+import collections
+import json
+import os
+
+# Recent outputs of a session's cells, replayed to a client that reconnects.
+#
+# Every output message a session sends for a cell (the same dicts that go out
+# on the socket) is also kept here, per cell, until the cell is run again.
+# Each cell is a ring bounded by CELL_BYTES and CELL_MESSAGES: the oldest
+# messages go first, and a stream that alone is over the budget keeps its
+# tail. Consecutive stream chunks of a cell are merged into one message, and a
+# display that is updated (display_id) is replaced in place, so a progress bar
+# costs one message, not thousands. At most CELLS cells are kept per session,
+# least recently run first out: memory is bounded by CELLS * CELL_BYTES.
+
+CELL_BYTES = int(float(os.environ.get("LUNA_REPLAY_CELL_KB", 256)) * 1024)
+CELL_MESSAGES = int(os.environ.get("LUNA_REPLAY_CELL_MESSAGES", 200))
+CELLS = int(os.environ.get("LUNA_REPLAY_CELLS", 20))
+
+
+def message_size(message: dict) -> int:
+    size = 0
+    for value in message.values():
+        if isinstance(value, str):
+            size += len(value)
+        elif isinstance(value, (dict, list)):
+            size += len(json.dumps(value))  # frames, tracebacks
+    return size
+
+
+class CellOutputs:
+    def __init__(self, cell_id):
+        self.cell_id = cell_id
+        self.messages = collections.deque()
+        self.sizes = collections.deque()  # parallel to messages
+        self.bytes = 0
+        self.displays = {}  # display_id -> its message in `messages`
+        self.dropped = 0  # messages (or leading stream text) dropped to stay in bounds
+        self.complete = False
+
+    def add(self, message: dict):
+        message = dict(message)
+        display_id = message.get("displayId")
+        if display_id is not None and display_id in self.displays:
+            # An update replaces the display where it first appeared
+            index = self._index(self.displays[display_id])
+            message["type"] = self.messages[index]["type"]
+            self._replace(index, message)
+            self.displays[display_id] = message
+        elif message["type"] == "stream" and self.messages and \
+                self.messages[-1]["type"] == "stream" and self.messages[-1]["name"] == message["name"]:
+            last = self.messages[-1]
+            self._replace(len(self.messages) - 1, dict(last, text=last["text"] + message["text"]))
+        else:
+            if message["type"] == "update_display_data":
+                message["type"] = "display_data"  # its original is gone
+            size = message_size(message)
+            self.messages.append(message)
+            self.sizes.append(size)
+            self.bytes += size
+            if display_id is not None:
+                self.displays[display_id] = message
+        self._trim()
+
+    def _index(self, message):
+        for i, candidate in enumerate(self.messages):
+            if candidate is message:
+                return i
+        raise KeyError(message.get("displayId"))
+
+    def _replace(self, index, message):
+        size = message_size(message)
+        self.bytes += size - self.sizes[index]
+        self.messages[index] = message
+        self.sizes[index] = size
+
+    def _trim(self):
+        while self.messages and (len(self.messages) > CELL_MESSAGES or self.bytes > CELL_BYTES):
+            first = self.messages[0]
+            excess = self.bytes - CELL_BYTES
+            if len(self.messages) <= CELL_MESSAGES and first["type"] == "stream" and excess < len(first["text"]):
+                # Only this stream's head is over the budget
+                self._replace(0, dict(first, text=first["text"][excess:]))
+                self.dropped += 1
+                break
+            self.messages.popleft()
+            self.bytes -= self.sizes.popleft()
+            self.dropped += 1
+            if first.get("displayId") is not None and self.displays.get(first["displayId"]) is first:
+                del self.displays[first["displayId"]]
+
+    def snapshot(self):
+        return {
+            "cellId": self.cell_id,
+            "outputs": list(self.messages),
+            "complete": self.complete,
+            "truncated": self.dropped,
+        }
+
+
+class ReplayBuffer:
+    def __init__(self, max_cells: int = CELLS):
+        self.max_cells = max_cells
+        self.cells = collections.OrderedDict()  # cell_id -> CellOutputs, least recently run first
+
+    def start(self, cell_id):
+        # A new run of the cell replaces its previous outputs
+        self.cells.pop(cell_id, None)
+        self.cells[cell_id] = CellOutputs(cell_id)
+        while len(self.cells) > self.max_cells:
+            self.cells.popitem(last=False)
+
+    def record(self, cell_id, message: dict):
+        cell = self.cells.get(cell_id)
+        if cell is not None:
+            cell.add(message)
+
+    def finish(self, cell_id):
+        cell = self.cells.get(cell_id)
+        if cell is not None:
+            cell.complete = True
+
+    def replay(self, cell_id=None):
+        """Snapshots of the buffered cells (just `cell_id` if given), oldest run first."""
+        if cell_id is not None:
+            cell = self.cells.get(cell_id)
+            return [cell.snapshot()] if cell else []
+        return [cell.snapshot() for cell in self.cells.values()]
+
+    def metrics(self):
+        return {
+            "cells": len(self.cells),
+            "messages": sum(len(c.messages) for c in self.cells.values()),
+            "bytes": sum(c.bytes for c in self.cells.values()),
+            "dropped": sum(c.dropped for c in self.cells.values()),
+        }
@@ -0,0 +1,131 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# Session metadata outlives a backend process only if the store does.
+# The in-memory store is the default (a restart forgets everything); the
+# SQLite store lets a restarted backend find kernels that are still running
+# and re-adopt them through their connection files.
+#
+# A record is a plain dict:
+#   session_id, user_id, connection_file, host, pid, last_activity
+
+HOSTNAME = socket.gethostname()
+
+# last_activity is only written back this often per session, so touching on
+# every message stays off the disk
+TOUCH_INTERVAL = 30
+
+
+class SessionStore:
+    persistent = False
+
+    def __init__(self):
+        self.records = {}
+        self._touched = {}
+
+    def save(self, record: dict):
+        record.setdefault("host", HOSTNAME)
+        record.setdefault("last_activity", time.time())
+        self.records[record["session_id"]] = dict(record)
+
+    def get(self, session_id: str):
+        record = self.records.get(session_id)
+        return dict(record) if record else None
+
+    def remove(self, session_id: str):
+        self.records.pop(session_id, None)
+        self._touched.pop(session_id, None)
+
+    def all(self, host: str = None):
+        return [dict(r) for r in self.records.values() if host is None or r["host"] == host]
+
+    def touch(self, session_id: str, now: float = None):
+        now = now or time.time()
+        if self.touch_due(session_id, now):
+            self.write_activity(session_id, now)
+
+    def touch_due(self, session_id: str, now: float) -> bool:
+        """Claim the write-back of last_activity if it's due; the caller then calls write_activity()."""
+        if now - self._touched.get(session_id, 0) < TOUCH_INTERVAL:
+            return False
+        self._touched[session_id] = now
+        return True
+
+    def write_activity(self, session_id: str, now: float):
+        if session_id in self.records:
+            self.records[session_id]["last_activity"] = now
+
+    def find_for_user(self, user_id: str, host: str = HOSTNAME):
+        """Records of `user_id` on `host`, most recently active first."""
+        records = [r for r in self.all(host) if r["user_id"] == user_id]
+        return sorted(records, key=lambda r: r["last_activity"], reverse=True)
+
+
+class SQLiteSessionStore(SessionStore):
+    persistent = True
+
+    def __init__(self, path: str):
+        super().__init__()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                connection_file TEXT,
+                host TEXT NOT NULL,
+                pid INTEGER,
+                last_activity REAL NOT NULL
+            )"""
+        )
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _row(self, row):
+        keys = ("session_id", "user_id", "connection_file", "host", "pid", "last_activity")
+        return dict(zip(keys, row))
+
+    def save(self, record: dict):
+        record.setdefault("host", HOSTNAME)
+        record.setdefault("last_activity", time.time())
+        self._query(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+            (record["session_id"], record["user_id"], record.get("connection_file"),
+             record["host"], record.get("pid"), record["last_activity"]),
+        )
+
+    def get(self, session_id: str):
+        rows = self._query("SELECT * FROM sessions WHERE session_id = ?", (session_id,))
+        return self._row(rows[0]) if rows else None
+
+    def remove(self, session_id: str):
+        self._query("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self._touched.pop(session_id, None)
+
+    def all(self, host: str = None):
+        if host is None:
+            rows = self._query("SELECT * FROM sessions")
+        else:
+            rows = self._query("SELECT * FROM sessions WHERE host = ?", (host,))
+        return [self._row(r) for r in rows]
+
+    def write_activity(self, session_id: str, now: float):
+        self._query("UPDATE sessions SET last_activity = ? WHERE session_id = ?", (now, session_id))
+
+
+def create_session_store(url: str = None):
+    """Build a store from a URL: "memory" (default) or "sqlite:///path/to/sessions.db"."""
+    url = url or "memory"
+    if url == "memory":
+        return SessionStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported session store {url!r}")
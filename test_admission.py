@@ -0,0 +1,125 @@
+import asyncio
+import os
+import shutil
+import unittest
+from fastapi.testclient import TestClient
+
+import backend
+from admission import AdmissionController, Rejected, TokenBucket
+from backend import app
+
+USERS = ("admission_a", "admission_b")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=3, clock=clock)
+        self.assertEqual([bucket.try_take() for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.try_take(), 0.5)
+        clock.now = 0.5
+        self.assertEqual(bucket.try_take(), 0)
+        clock.now = 100
+        self.assertEqual([bucket.try_take() for _ in range(4)][-1], 0.5)  # refills up to the burst only
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_queue_positions_and_capacity(self):
+        async def scenario():
+            control = AdmissionController(max_kernels=1, queue_size=2)
+            first = control.enter("u1", "1.1.1.1")
+            second = control.enter("u2", "1.1.1.2")
+            third = control.enter("u3", "1.1.1.3")
+            self.assertTrue(first.granted)
+            self.assertFalse(second.granted or third.granted)
+            with self.assertRaises(Rejected) as refused:
+                control.enter("u4", "1.1.1.4")
+            self.assertEqual(refused.exception.retry_after, 30)
+
+            positions = []
+
+            async def report(position, length):
+                positions.append((position, length))
+
+            waiting = asyncio.ensure_future(control.wait(third, report))
+            await asyncio.sleep(0)
+            control.leave(second)  # gives up while queued
+            await asyncio.sleep(0)
+            control.leave(first)
+            await asyncio.wait_for(waiting, 1)
+            self.assertEqual(positions, [(2, 2), (1, 1)])
+            self.assertTrue(third.granted)
+            self.assertEqual(control.metrics()["kernels"], 1)
+            self.assertEqual(control.metrics()["rejected"], {"Server is at capacity": 1})
+
+        asyncio.run(scenario())
+
+    def test_per_user_and_per_ip_limits(self):
+        control = AdmissionController(max_per_user=2, max_per_ip=3, user_start_burst=10)
+        tickets = [control.enter("u1", "ip"), control.enter("u1", "ip")]
+        with self.assertRaisesRegex(Rejected, "user"):
+            control.enter("u1", "ip")
+        tickets.append(control.enter("u2", "ip"))
+        with self.assertRaisesRegex(Rejected, "address"):
+            control.enter("u3", "ip")
+        control.leave(tickets[0])
+        control.enter("u1", "other")
+
+    def test_kernel_start_rate_per_user(self):
+        control = AdmissionController(user_start_rate=0.1, user_start_burst=2)
+        for _ in range(2):
+            control.leave(control.enter("u1", "ip"))
+        with self.assertRaises(Rejected) as refused:
+            control.enter("u1", "ip")
+        self.assertGreater(refused.exception.retry_after, 9)
+        # Re-attaching to a running kernel starts nothing
+        control.enter("u1", "ip", starts_kernel=False)
+        control.enter("u2", "ip")
+
+
+class TestAdmissionEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        self.saved = backend.admission
+        backend.admission = AdmissionController(max_kernels=1, max_per_user=1, user_start_burst=10 ** 6)
+
+    def tearDown(self):
+        backend.admission = self.saved
+        for user in USERS:
+            shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", user), ignore_errors=True)
+
+    def test_second_user_waits_for_a_slot(self):
+        first = self.client.websocket_connect(f"/ws?userId={USERS[0]}")
+        running = first.__enter__()
+        try:
+            self.assertEqual(running.receive_json()["type"], "session")
+            with self.client.websocket_connect(f"/ws?userId={USERS[1]}") as waiting:
+                self.assertEqual(waiting.receive_json(), {"type": "queued", "position": 1, "queueLength": 1})
+                first.__exit__(None, None, None)
+                first = None
+                self.assertEqual(waiting.receive_json()["type"], "session")
+        finally:
+            if first:
+                first.__exit__(None, None, None)
+
+    def test_connection_cap_is_reported(self):
+        with self.client.websocket_connect(f"/ws?userId={USERS[0]}") as websocket:
+            websocket.receive_json()
+            with self.client.websocket_connect(f"/ws?userId={USERS[0]}") as refused:
+                message = refused.receive_json()
+                self.assertEqual(message["type"], "rejected")
+                self.assertIn("user", message["reason"])
+        self.assertEqual(self.client.get("/metrics/admission").json()["rejected"],
+                         {"Too many connections for this user": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
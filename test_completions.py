@@ -0,0 +1,115 @@
+import os
+import shutil
+import unittest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+import backend
+from backend import app, parse_module_aliases
+from crash_monitor import KernelDied
+
+
+def receive_until(websocket, predicate):
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if predicate(data):
+            return seen
+
+
+class TestCompletions(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        backend.completion_cache.entries.clear()
+
+    def tearDown(self):
+        for user in ("overlay_a", "overlay_b"):
+            shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", user), ignore_errors=True)
+
+    def test_parse_module_aliases(self):
+        imported, rebound = parse_module_aliases(
+            "%matplotlib inline\nimport numpy as np\nfrom pandas import DataFrame as DF\nimport os.path\npd = 3\n"
+        )
+        self.assertEqual(imported, {"np": "numpy", "DF": "pandas.DataFrame", "os": "os"})
+        self.assertEqual(rebound, {"pd"})
+
+    def test_complete_and_inspect(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json({"type": "complete", "requestId": "c1", "code": "x = np.ar", "cursorPos": 9})
+            data = receive_until(websocket, lambda d: d['type'] == 'complete_reply')[-1]
+            self.assertFalse(data['cached'])
+            self.assertIn('array', data['matches'])
+            self.assertEqual(data['cursorStart'], 7)
+
+            # Module-level completions are answered from the cache, even while a cell runs
+            websocket.send_json({"type": "execute", "code": "import time; time.sleep(2)", "cellId": "cell-1"})
+            websocket.send_json({"type": "complete", "requestId": "c2", "code": "np.ze"})
+            seen = receive_until(websocket, lambda d: d['type'] == 'complete' and d.get('cellId') == 'cell-1')
+            replies = [d for d in seen if d['type'] == 'complete_reply']
+            self.assertLess(seen.index(replies[0]), len(seen) - 1)
+            self.assertTrue(replies[0]['cached'])
+            self.assertIn('zeros', replies[0]['matches'])
+
+            # A newer request supersedes an older one still debouncing
+            websocket.send_json({"type": "complete", "requestId": "c3", "code": "pri"})
+            websocket.send_json({"type": "complete", "requestId": "c4", "code": "prin"})
+            first = websocket.receive_json()
+            self.assertEqual(first, {"type": "complete_reply", "requestId": "c3", "cancelled": True})
+            data = websocket.receive_json()
+            self.assertEqual(data['requestId'], 'c4')
+            self.assertIn('print', data['matches'])
+
+            websocket.send_json({"type": "inspect", "requestId": "i1", "code": "len", "cursorPos": 3})
+            data = websocket.receive_json()
+            self.assertEqual(data['type'], 'inspect_reply')
+            self.assertTrue(data['found'])
+            self.assertIn('text/plain', data['data'])
+
+        # The cache is shared by new sessions
+        with self.client.websocket_connect("/ws") as websocket:
+            self.assertEqual(websocket.receive_json()['type'], 'session')
+            websocket.send_json({"type": "complete", "requestId": "c5", "code": "np.arange"})
+            data = websocket.receive_json()
+            self.assertTrue(data['cached'])
+            self.assertEqual(data['matches'], ['arange'])
+
+    def test_invalid_fields_and_failures_get_an_error_reply(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            session = backend.sessions[websocket.receive_json()['sessionId']]
+            websocket.send_json({"type": "complete", "requestId": "c1", "code": "pri", "cursorPos": "end"})
+            data = websocket.receive_json()
+            self.assertEqual(data, {"type": "complete_reply", "requestId": "c1", "matches": [],
+                                    "error": "Invalid cursorPos 'end'"})
+            websocket.send_json({"type": "inspect", "requestId": "i1", "code": "len", "detailLevel": "full"})
+            data = websocket.receive_json()
+            self.assertEqual(data, {"type": "inspect_reply", "requestId": "i1", "found": False,
+                                    "error": "Invalid detailLevel 'full'"})
+
+            # A kernel that dies while the lookup waits still answers the request
+            async def died(*args):
+                raise KernelDied("Killed by signal 9")
+            with patch.object(session, "_wait_for_shell_reply", died):
+                websocket.send_json({"type": "inspect", "requestId": "i2", "code": "len", "cursorPos": 3})
+                data = websocket.receive_json()
+            self.assertEqual(data, {"type": "inspect_reply", "requestId": "i2", "found": False,
+                                    "error": "Killed by signal 9"})
+
+    def test_overlay_versions_are_cached_apart(self):
+        for user, name in (("overlay_a", "alpha"), ("overlay_b", "beta")):
+            package = os.path.join(backend.WORKING_DIR, "storage", user, ".packages", "lunapkg")
+            os.makedirs(package)
+            with open(os.path.join(package, "__init__.py"), "w") as f:
+                f.write(f"{name} = 1\n")
+        for user, name in (("overlay_a", "alpha"), ("overlay_b", "beta"), ("overlay_a", "alpha")):
+            with self.client.websocket_connect(f"/ws?userId={user}") as websocket:
+                websocket.receive_json()
+                websocket.send_json({"type": "execute", "code": "import lunapkg", "cellId": "c1"})
+                receive_until(websocket, lambda d: d['type'] == 'complete' and d.get('cellId') == 'c1')
+                websocket.send_json({"type": "complete", "requestId": "c2", "code": "lunapkg."})
+                data = receive_until(websocket, lambda d: d['type'] == 'complete_reply')[-1]
+                self.assertEqual(data['matches'], [name])
+        self.assertTrue(data['cached'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import shutil
+import subprocess
+import sys
+import time
+import unittest
+from fastapi.testclient import TestClient
+
+import backend
+import cpu_scheduler
+from backend import app
+from cpu_scheduler import CpuScheduler
+
+USER = "scheduler_user"
+
+
+def scheduler(cpus=4):
+    sched = CpuScheduler(window=60)
+    sched.cpus, sched.batch_cpus, sched.renice = list(range(cpus)), None, False
+    return sched
+
+
+class Host:
+    """Feeds a scheduler samples as if each pid used `rates[pid]` cores."""
+
+    def __init__(self, sched):
+        self.sched = sched
+        self.now = 0.0
+        self.cpu = {}
+        sched.update({}, self.now)
+        sched.decide()
+
+    def run(self, rates, seconds, step=5.0):
+        for _ in range(int(seconds / step)):
+            self.now += step
+            for pid, rate in rates.items():
+                self.cpu[pid] = self.cpu.get(pid, 0.0) + rate * step
+            self.sched.update({pid: (cpu, [pid]) for pid, cpu in self.cpu.items()}, self.now)
+        self.sched.decide()
+
+
+class TestFairShare(unittest.TestCase):
+    def test_heavy_user_is_demoted_under_contention(self):
+        sched = scheduler(cpus=4)
+        sched.register("a1", "alice", 101)
+        sched.register("a2", "alice", 102)
+        sched.register("b1", "bob", 201)
+        sched.register("c1", "carol", 301)
+        Host(sched).run({101: 2.0, 102: 1.5, 201: 0.0, 301: 0.2}, seconds=600)
+
+        self.assertTrue(sched.contended)
+        levels = {k.session_id: k.level for k in sched.kernels.values()}
+        # alice uses ~3.5 of 4 cores against a fair share of 4/3: two doublings over
+        self.assertEqual(levels, {"a1": 2, "a2": 2, "b1": 0, "c1": 0})
+        metrics = sched.metrics()
+        self.assertAlmostEqual(metrics["users"]["alice"]["share"], 3.5 / 3.7, places=2)
+        self.assertEqual(metrics["users"]["alice"]["kernels"], 2)
+
+    def test_short_bursts_and_a_lone_user_are_left_alone(self):
+        sched = scheduler(cpus=2)
+        sched.register("a1", "alice", 101)
+        sched.register("b1", "bob", 201)
+        host = Host(sched)
+        # Half a minute of work doesn't make a heavy kernel
+        host.run({101: 2.0, 201: 0.0}, seconds=30)
+        self.assertFalse(sched.contended)
+        self.assertEqual(sched.kernels["a1"].level, 0)
+
+        # Alone on the host, alice may use all of it
+        sched.unregister("b1")
+        host.run({101: 2.0}, seconds=900)
+        self.assertTrue(sched.contended)
+        self.assertEqual(sched.kernels["a1"].level, 0)
+
+    def test_levels_drop_back_when_usage_does(self):
+        sched = scheduler(cpus=2)
+        sched.register("a1", "alice", 101)
+        sched.register("b1", "bob", 201)
+        host = Host(sched)
+        host.run({101: 2.0, 201: 0.0}, seconds=600)
+        self.assertEqual(sched.kernels["a1"].level, 1)
+        host.run({101: 0.0, 201: 0.0}, seconds=600)
+        self.assertEqual(sched.kernels["a1"].level, 0)
+        self.assertEqual((sched.demotions, sched.promotions), (1, 1))
+
+
+class TestProcessControl(unittest.TestCase):
+    def setUp(self):
+        # A process group of its own, like a kernel
+        self.proc = subprocess.Popen([sys.executable, "-c", "import time\nt = time.time()\nwhile time.time() - t < 0.3: pass\ntime.sleep(30)"],
+                                     start_new_session=True)
+
+    def tearDown(self):
+        self.proc.kill()
+        self.proc.wait()
+
+    def test_group_cpu_is_read(self):
+        time.sleep(0.5)
+        cpu, pids = cpu_scheduler.read_group_cpu({self.proc.pid})[self.proc.pid]
+        self.assertEqual(pids, [self.proc.pid])
+        self.assertGreater(cpu, 0.1)
+
+    @unittest.skipUnless(cpu_scheduler.can_renice_up(), "needs permission to renice back up")
+    def test_renice(self):
+        sched = CpuScheduler()
+        sched.batch_cpus = None
+        sched.register("s", USER, self.proc.pid)
+        kernel = sched.kernels["s"]
+        kernel.level = 2
+        sched.apply(kernel)
+        self.assertEqual(os.getpriority(os.PRIO_PROCESS, self.proc.pid), 10)
+        kernel.level = 0
+        sched.apply(kernel)
+        self.assertEqual(os.getpriority(os.PRIO_PROCESS, self.proc.pid), 0)
+
+
+class TestCpuMetricsEndpoint(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+
+    def test_kernels_are_reported(self):
+        client = TestClient(app)
+        with client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            websocket.receive_json()
+            backend.cpu_scheduler.tick()
+            metrics = client.get("/metrics/cpu").json()
+            kernels = [k for k in metrics["kernels"] if k["user"] == USER]
+            self.assertEqual(len(kernels), 1)
+            self.assertEqual(kernels[0]["level"], 0)
+            self.assertGreater(kernels[0]["cpu_seconds"], 0)
+            self.assertIn(USER, metrics["users"])
+
+
+if __name__ == "__main__":
+    unittest.main()
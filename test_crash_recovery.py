@@ -0,0 +1,133 @@
+import json
+import os
+import pickle
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+from unittest import mock
+from fastapi.testclient import TestClient
+
+import backend
+import crash_monitor
+from backend import app
+from crash_monitor import describe_exit
+from luna import checkpoint
+
+USER = "crash_user"
+SEGFAULT = "import os, signal\nos.kill(os.getpid(), signal.SIGSEGV)"
+
+
+def run_cell(websocket, code, cell_id):
+    websocket.send_json({"type": "execute", "code": code, "cellId": cell_id})
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if data['type'] == 'complete' and data['cellId'] == cell_id:
+            return seen
+
+
+def receive_until(websocket, msg_type):
+    while True:
+        data = websocket.receive_json()
+        if data["type"] == msg_type:
+            return data
+
+
+def wait_for(path, timeout=20):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise AssertionError(f"{path} was not written")
+        time.sleep(0.1)
+
+
+class TestDescribeExit(unittest.TestCase):
+    def test_reasons(self):
+        self.assertEqual(describe_exit(-signal.SIGKILL, 3, 4)[0], "oom")
+        self.assertEqual(describe_exit(-signal.SIGKILL, 3, 3)[0], "killed")
+        self.assertEqual(describe_exit(-signal.SIGKILL)[0], "killed")
+        self.assertIn("segmentation fault", describe_exit(-signal.SIGSEGV)[1])
+        self.assertEqual(describe_exit(-signal.SIGTERM)[1], "The kernel was terminated by SIGTERM")
+        self.assertEqual(describe_exit(1)[1], "The kernel exited with code 1")
+        self.assertEqual(describe_exit(None, 0, 1)[0], "oom")
+
+    def test_restarts_are_limited(self):
+        session = backend.KernelSession("limited")
+        allowed = [session._may_restart() for _ in range(crash_monitor.MAX_RESTARTS + 1)]
+        self.assertEqual(allowed, [True] * crash_monitor.MAX_RESTARTS + [False])
+
+
+class TestCheckpointBudget(unittest.TestCase):
+    def test_oversized_values_are_skipped_before_pickling(self):
+        import numpy as np
+        import pandas as pd
+        namespace = {"small": [1, 2, 3], "frame": pd.DataFrame({"a": np.zeros(50_000)}),
+                     "array": np.zeros(50_000)}
+        pickled, real_dumps = [], pickle.dumps
+
+        def dumps(value, *args, **kwargs):
+            pickled.append(value)
+            return real_dumps(value, *args, **kwargs)
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(checkpoint, "_user_namespace", return_value=namespace), \
+                mock.patch.object(checkpoint.pickle, "dumps", side_effect=dumps):
+            summary = json.loads(checkpoint.save(os.path.join(tmp, "c.pkl"), 100_000))
+        self.assertEqual(summary["saved"], ["small"])
+        self.assertEqual(summary["skipped"], ["array", "frame"])
+        self.assertEqual(pickled, [[1, 2, 3]])
+
+
+class TestCrashRecovery(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+
+    def test_crash_fails_the_cell_and_restores_the_checkpoint(self):
+        before = backend.crash_stats.metrics()
+        with self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            session_id = websocket.receive_json()["sessionId"]
+            run_cell(websocket, "x = 41\nimport json as j", "c1")
+            # The first successful cell is checkpointed right away
+            wait_for(os.path.join(backend.WORKING_DIR, "storage", USER, ".checkpoints", f"{session_id}.pkl"))
+
+            started = time.monotonic()
+            seen = run_cell(websocket, SEGFAULT, "c2")
+            self.assertLess(time.monotonic() - started, 3)
+            error = [d for d in seen if d["type"] == "error"][0]
+            self.assertEqual(error["ename"], "KernelDied")
+            self.assertIn("segmentation fault", error["evalue"])
+
+            died = receive_until(websocket, "kernel_died")
+            self.assertEqual((died["kind"], died["cellId"], died["restarting"]), ("crash", "c2", True))
+            restarted = receive_until(websocket, "kernel_restarted")
+            self.assertIn("x", restarted["restored"])
+            self.assertIn("j", restarted["restored"])
+
+            seen = run_cell(websocket, "print(x + 1, j.dumps(1))", "c3")
+            self.assertEqual("".join(d.get("text", "") for d in seen if d["type"] == "stream"), "42 1\n")
+
+        metrics = self.client.get("/metrics/kernels").json()
+        self.assertEqual(metrics["crashes"], before["crashes"] + 1)
+        self.assertEqual(metrics["restarts"], before["restarts"] + 1)
+        self.assertEqual(metrics["recent"][0]["cell"], "c2")
+
+    def test_without_auto_restart_the_kernel_stays_down(self):
+        with mock.patch.object(crash_monitor, "AUTO_RESTART", False), \
+             self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            websocket.receive_json()
+            run_cell(websocket, "import os, signal\nos.kill(os.getpid(), signal.SIGKILL)", "c1")
+            died = receive_until(websocket, "kernel_died")
+            self.assertFalse(died["restarting"])
+            self.assertIn(died["kind"], ("killed", "oom"))
+            websocket.send_json({"type": "execute", "code": "1", "cellId": "c2"})
+            self.assertEqual(websocket.receive_json()["content"], "Kernel not running")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import glob
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from fastapi.testclient import TestClient
+
+import backend
+import execution_log
+from backend import app
+from execution_log import ExecutionLog
+
+USER = "history_user"
+DAY = 86400
+
+
+def entry(start, status="ok", session="s1", duration=10.0):
+    return {"start": start, "end": start + duration / 1000, "duration_ms": duration, "session": session,
+            "status": status, "code_sha": "0" * 16}
+
+
+def run_cell(websocket, code, cell_id):
+    websocket.send_json({"type": "execute", "code": code, "cellId": cell_id})
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if data['type'] == 'complete' and data['cellId'] == cell_id:
+            return seen
+
+
+class TestExecutionLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.log = ExecutionLog(self.tmp, flush_interval=0.05)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def files(self):
+        return sorted(os.path.basename(p) for p in glob.glob(os.path.join(self.tmp, USER, ".history", "*")))
+
+    def test_batches_are_appended_and_queryable(self):
+        now = time.time()
+        for i in range(5):
+            self.log.record(USER, entry(now - 10 + i, status="error" if i == 2 else "ok"))
+        self.assertTrue(self.log.flush())
+        self.log.record(USER, entry(now, session="s2"))
+        self.assertTrue(self.log.flush())
+
+        self.assertEqual(len(self.files()), 1)
+        with gzip.open(glob.glob(os.path.join(self.tmp, USER, ".history", "*"))[0], "rt") as f:
+            self.assertEqual(len(f.read().splitlines()), 6)  # two gzip members, one stream
+
+        entries = self.log.query(USER)
+        self.assertEqual([e["start"] for e in entries], sorted((e["start"] for e in entries), reverse=True))
+        self.assertEqual(len(self.log.query(USER, status="error")), 1)
+        self.assertEqual(len(self.log.query(USER, session_id="s2")), 1)
+        self.assertEqual(len(self.log.query(USER, since=now - 8)), 4)
+        self.assertEqual(len(self.log.query(USER, limit=2)), 2)
+
+    def test_invalid_user_does_not_drop_the_batch(self):
+        now = time.time()
+        self.log.record("a@b.com", entry(now))
+        self.log.record(USER, entry(now))
+        self.log.record("../escape", entry(now))
+        self.log.record(USER, entry(now + 1))
+        self.assertTrue(self.log.flush())
+        self.assertEqual(len(self.log.query(USER)), 2)
+        self.assertEqual(os.listdir(self.tmp), [USER])
+
+    def test_rotation_and_retention(self):
+        old_max, execution_log.MAX_FILE_BYTES = execution_log.MAX_FILE_BYTES, 1
+        try:
+            now = time.time()
+            self.log.record(USER, entry(now - 40 * DAY))
+            self.log.flush()
+            self.log.record(USER, entry(now - DAY))
+            self.log.flush()
+            for i in range(2):
+                self.log.record(USER, entry(now + i))
+                self.log.flush()
+        finally:
+            execution_log.MAX_FILE_BYTES = old_max
+
+        today, yesterday = execution_log._day(now), execution_log._day(now - DAY)
+        # Day files rotate by size; the 40-day-old file is past retention
+        self.assertEqual(self.files(), [f"{yesterday}.jsonl.gz", f"{today}.1.jsonl.gz", f"{today}.jsonl.gz"])
+        self.assertEqual(len(self.log.query(USER, since=now - 2 * DAY)), 3)
+        self.assertEqual(len(self.log.query(USER, until=now - 1)), 1)
+
+    def test_summary(self):
+        entries = [entry(0, duration=d) for d in (10, 20, 30, 1000)] + [entry(0, status="timeout", duration=5)]
+        summary = execution_log.summarize(entries)
+        self.assertEqual((summary["count"], summary["errors"], summary["interrupted"]), (5, 0, 1))
+        self.assertEqual((summary["p50_ms"], summary["max_ms"]), (20, 1000))
+
+
+class TestExecutionHistoryEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+
+    def test_executions_are_logged(self):
+        with self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            hello = websocket.receive_json()
+            run_cell(websocket, "print('hello')", "cell-1")
+            run_cell(websocket, "1 / 0", "cell-2")
+        self.assertTrue(backend.execution_log.flush())
+
+        body = self.client.get(f"/history/{USER}", params={"session": hello["sessionId"]}).json()
+        self.assertEqual(body["summary"]["count"], 2)
+        failed, ok = body["entries"]
+        self.assertEqual((failed["cell"], failed["status"], failed["ename"]), ("cell-2", "error", "ZeroDivisionError"))
+        self.assertEqual((ok["cell"], ok["status"], ok["outputs"], ok["output_bytes"]), ("cell-1", "ok", 1, 6))
+        self.assertEqual(ok["code_sha"], execution_log.code_hash("print('hello')"))
+        self.assertIsNotNone(ok["kernel"])
+        self.assertGreaterEqual(ok["end"], ok["start"])
+
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+        errors = self.client.get(f"/history/{USER}", params={"since": today, "status": "error"}).json()
+        self.assertEqual([e["cell"] for e in errors["entries"]], ["cell-2"])
+        self.assertEqual(self.client.get(f"/history/{USER}", params={"since": "yesterday"}).status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
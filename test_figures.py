@@ -0,0 +1,131 @@
+import base64
+import os
+import shutil
+import unittest
+from fastapi.testclient import TestClient
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+
+import backend  # noqa: E402
+from backend import app  # noqa: E402
+from luna import figures  # noqa: E402
+
+USER = "figures_user"
+PLOT = "import matplotlib.pyplot as plt\nplt.plot([1, 2, 3])\nplt.show()\nprint('after')"
+
+
+def receive_until(websocket, predicate):
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if predicate(data):
+            return seen
+
+
+class TestFigureRendering(unittest.TestCase):
+    def setUp(self):
+        self.saved = dict(figures.settings)
+        self.fig, self.ax = plt.subplots()
+        self.ax.plot([1, 2, 3])
+
+    def tearDown(self):
+        figures.settings.update(self.saved)
+        plt.close("all")
+
+    def test_dpi_follows_pixel_ratio_and_output_width(self):
+        figures.configure(format="png", width=0, pixel_ratio=1)
+        self.assertEqual(figures.dpi_for(self.fig), self.fig.dpi)
+        figures.configure(pixel_ratio=2)
+        self.assertEqual(figures.dpi_for(self.fig), 2 * self.fig.dpi)
+        # A 6.4in figure in a 320px output area on a 2x screen needs 100 dpi
+        figures.configure(width=320)
+        self.assertEqual(figures.dpi_for(self.fig), 100)
+        figures.configure(width=10)
+        self.assertEqual(figures.dpi_for(self.fig), figures.MIN_DPI)
+
+    def test_formats(self):
+        figures.configure(width=0, pixel_ratio=1)
+        for format, magic in (("png", b"\x89PNG"), ("webp", b"RIFF")):
+            figures.configure(format=format)
+            data, metadata = figures.render(self.fig)
+            self.assertEqual(base64.b64decode(data[figures.FORMATS[format]])[:4], magic)
+            self.assertEqual(metadata, {})
+        figures.configure(format="svg")
+        svg = figures.render(self.fig)[0]["image/svg+xml"]
+        self.assertIn("<svg", svg)
+        # Same figure, same bytes: stored outputs and browser caches are reused
+        other, ax = plt.subplots()
+        ax.plot([1, 2, 3])
+        self.assertEqual(figures.render(other)[0]["image/svg+xml"], svg)
+        with self.assertRaises(ValueError):
+            figures.configure(format="gif")
+
+    def test_high_dpi_render_reports_its_css_size(self):
+        figures.configure(format="png", width=0, pixel_ratio=2)
+        data, metadata = figures.render(self.fig)
+        size = metadata["image/png"]
+        self.assertLess(size["width"], 640)  # tight bbox of a 640px-wide figure
+        self.assertGreater(size["width"], 400)
+
+    def test_unchanged_figure_is_not_rendered_again(self):
+        figures.configure(format="png", width=0, pixel_ratio=1)
+        first = figures.render(self.fig)
+        rendered = figures.stats["rendered"]
+        self.assertIs(figures.render(self.fig), first)
+        self.assertEqual(figures.stats["rendered"], rendered)
+
+        self.ax.set_title("changed")
+        self.assertIsNot(figures.render(self.fig), first)
+        figures.configure(format="webp")
+        figures.render(self.fig)
+        self.assertEqual(figures.stats["rendered"], rendered + 2)
+
+
+class TestFigureSettings(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+
+    def configure(self, websocket, **settings):
+        websocket.send_json({"type": "figures", **settings})
+        return receive_until(websocket, lambda d: d["type"] == "figures")[-1]
+
+    def test_kernel_renders_in_the_session_format(self):
+        with TestClient(app) as client, client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            websocket.receive_json()
+            self.assertIn("error", self.configure(websocket, format="gif"))
+            reply = self.configure(websocket, format="svg", width=800, pixelRatio=2, threads=1)
+            self.assertEqual(reply, {"type": "figures", "format": "svg", "width": 800, "pixelRatio": 2,
+                                     "threads": 1})
+            websocket.send_json({"type": "execute", "code": PLOT, "cellId": "c1"})
+            seen = receive_until(websocket, lambda d: d["type"] == "complete")
+            outputs = [d for d in seen if d["type"] in ("stream", "display_data")]
+            # Rendered in a thread: the cell went on, and the figure came at the end
+            self.assertEqual([d["type"] for d in outputs], ["stream", "display_data"])
+            self.assertTrue(outputs[1]["imageUrl"].endswith(".svg"))
+            response = client.get(outputs[1]["imageUrl"])
+            self.assertEqual(response.headers["content-type"], "image/svg+xml")
+
+            # A restarted kernel keeps the session's settings
+            websocket.send_json({"type": "restart"})
+            receive_until(websocket, lambda d: d["type"] == "restart_success")
+            websocket.send_json({"type": "execute", "code": PLOT, "cellId": "c2"})
+            seen = receive_until(websocket, lambda d: d["type"] == "complete")
+            self.assertTrue([d for d in seen if d.get("imageUrl")][0]["imageUrl"].endswith(".svg"))
+
+    def test_lite_worker_renders_in_the_session_format(self):
+        with TestClient(app) as client, \
+                client.websocket_connect(f"/ws?userId={USER}&engine=lite") as websocket:
+            websocket.receive_json()
+            self.configure(websocket, format="webp", width=300, pixelRatio=2)
+            websocket.send_json({"type": "execute", "code": PLOT, "cellId": "c1"})
+            seen = receive_until(websocket, lambda d: d["type"] == "complete")
+            image = [d for d in seen if d["type"] == "display_data"][0]
+            self.assertTrue(image["imageUrl"].endswith(".webp"))
+            self.assertLessEqual(image["imageWidth"], 300)
+
+
+if __name__ == "__main__":
+    unittest.main()
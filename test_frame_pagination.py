@@ -0,0 +1,60 @@
+import unittest
+from fastapi.testclient import TestClient
+from backend import app
+
+
+class TestFramePagination(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def test_dataframe_result_is_paginated(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json({
+                "type": "execute",
+                "code": "pd.set_option('display.max_rows', None)\n"
+                        "df = pd.DataFrame({'n': np.arange(300000), 'name': ['row%d' % i for i in range(300000)]})\n"
+                        "df",
+                "cellId": "cell-1"
+            })
+            result = None
+            while True:
+                data = websocket.receive_json()
+                if data['type'] == 'execute_result':
+                    result = data
+                if data['type'] == 'complete' and data['cellId'] == 'cell-1':
+                    break
+
+            self.assertIsNotNone(result, "Did not receive execute_result")
+            frame = result['frame']
+            self.assertEqual(frame['shape'], [300000, 2])
+            # Only the first page is rendered, whatever the display options say
+            self.assertLess(len(result['html']), 20000)
+            self.assertLess(len(result['text']), 20000)
+
+            websocket.send_json({"type": "fetch_rows", "handle": frame['handle'], "offset": 250000, "limit": 2})
+            data = websocket.receive_json()
+            self.assertEqual(data['type'], 'rows')
+            self.assertEqual(data['total'], 300000)
+            self.assertEqual(data['index'], [250000, 250001])
+
+            websocket.send_json({
+                "type": "fetch_rows", "handle": frame['handle'], "limit": 3,
+                "sortBy": "n", "ascending": False,
+                "filters": [{"column": "n", "op": "<", "value": 1000}],
+            })
+            data = websocket.receive_json()
+            self.assertEqual(data['total'], 1000)
+            self.assertEqual([row[0] for row in data['rows']], [999, 998, 997])
+
+            websocket.send_json({"type": "fetch_rows", "handle": "unknown"})
+            data = websocket.receive_json()
+            self.assertIn('error', data)
+
+            websocket.send_json({"type": "fetch_rows", "requestId": "r9", "handle": frame['handle'],
+                                 "offset": "start", "limit": 2})
+            data = websocket.receive_json()
+            self.assertEqual((data['type'], data['requestId'], data['error']), ("rows", "r9", "Invalid offset 'start'"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from fastapi.testclient import TestClient
+import backend
+from backend import app
+
+
+def receive_until(websocket, predicate):
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if predicate(data):
+            return seen
+
+
+class TestInputHandling(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        self._old_timeout = backend.INPUT_TIMEOUT
+
+    def tearDown(self):
+        backend.INPUT_TIMEOUT = self._old_timeout
+
+    def test_messages_flow_while_prompt_is_open(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json({"type": "execute", "code": "name = input('Name? ')\nprint('Hello', name)", "cellId": "cell-1"})
+            request = receive_until(websocket, lambda d: d['type'] == 'input_request')[-1]
+            self.assertEqual(request['prompt'], 'Name? ')
+
+            websocket.send_json({"type": "ping", "t": 123})
+            pong = websocket.receive_json()
+            self.assertEqual(pong, {"type": "pong", "t": 123, "executing": "cell-1", "awaitingInput": True})
+
+            websocket.send_json({"type": "execute", "code": "1", "cellId": "cell-2"})
+            seen = receive_until(websocket, lambda d: d['type'] == 'complete' and d['cellId'] == 'cell-2')
+            self.assertIn("waiting for input", seen[0]['traceback'][0])
+
+            # A reply for the wrong cell is ignored, the right one goes through
+            websocket.send_json({"type": "input_reply", "value": "Mallory", "cellId": "cell-9"})
+            websocket.send_json({"type": "input_reply", "value": "Luna", "cellId": "cell-1"})
+            seen = receive_until(websocket, lambda d: d['type'] == 'complete' and d['cellId'] == 'cell-1')
+            text = "".join(d.get('text', '') for d in seen if d['type'] == 'stream')
+            self.assertEqual(text, "Hello Luna\n")
+
+    def test_restart_while_waiting_for_input(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json({"type": "execute", "code": "input()", "cellId": "cell-1"})
+            receive_until(websocket, lambda d: d['type'] == 'input_request')
+            websocket.send_json({"type": "restart"})
+            receive_until(websocket, lambda d: d['type'] == 'restart_success')
+
+            websocket.send_json({"type": "execute", "code": "print('alive')", "cellId": "cell-2"})
+            seen = receive_until(websocket, lambda d: d['type'] == 'complete' and d['cellId'] == 'cell-2')
+            self.assertIn('alive\n', [d.get('text') for d in seen])
+
+    def test_input_timeout_interrupts_cell(self):
+        backend.INPUT_TIMEOUT = 1
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json({"type": "execute", "code": "input('Waiting: ')", "cellId": "cell-1"})
+            seen = receive_until(websocket, lambda d: d['type'] == 'complete' and d['cellId'] == 'cell-1')
+            types = [d['type'] for d in seen]
+            self.assertIn('input_cancelled', types)
+            self.assertEqual([d['ename'] for d in seen if d['type'] == 'error'], ['KeyboardInterrupt'])
+
+
+if __name__ == "__main__":
+    unittest.main()
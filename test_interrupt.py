@@ -0,0 +1,70 @@
+import unittest
+from fastapi.testclient import TestClient
+from backend import app
+
+
+def collect(websocket, count_replies=1, cell_id=None):
+    # Read until the cell completes and the expected interrupt replies arrived
+    seen = []
+    replies = 0
+    done = False
+    while not (done and replies >= count_replies):
+        data = websocket.receive_json()
+        seen.append(data)
+        if data['type'] == 'interrupt_reply':
+            replies += 1
+        if data['type'] == 'complete' and data['cellId'] == cell_id:
+            done = True
+    return seen
+
+
+class TestInterrupt(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def test_interrupt_keeps_state(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json({"type": "execute", "code": "a = 41\nimport time\nprint('sleeping', flush=True)\ntime.sleep(60)",
+                                 "cellId": "cell-1"})
+            while websocket.receive_json().get('type') != 'stream':
+                pass
+            websocket.send_json({"type": "interrupt"})
+
+            seen = collect(websocket, cell_id="cell-1")
+            errors = [d for d in seen if d['type'] == 'error']
+            self.assertEqual(errors[0]['ename'], 'KeyboardInterrupt')
+            reply = [d for d in seen if d['type'] == 'interrupt_reply'][0]
+            self.assertEqual(reply['status'], 'ok')
+            self.assertEqual(reply['cellId'], 'cell-1')
+            self.assertLess(reply['elapsed'], 5000)
+
+            # Slot released and namespace intact: no restart happened
+            websocket.send_json({"type": "execute", "code": "a + 1", "cellId": "cell-2"})
+            seen = collect(websocket, count_replies=0, cell_id="cell-2")
+            self.assertIn('42', [d.get('text') for d in seen if d['type'] == 'execute_result'])
+
+            websocket.send_json({"type": "interrupt"})
+            self.assertEqual(websocket.receive_json()['status'], 'idle')
+
+    def test_cell_timeout(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_json({"type": "execute", "code": "import time\ntime.sleep(60)",
+                                 "cellId": "cell-1", "timeout": 1})
+            seen = collect(websocket, cell_id="cell-1")
+            reply = [d for d in seen if d['type'] == 'interrupt_reply'][0]
+            self.assertEqual(reply['reason'], 'timeout')
+            self.assertTrue(any('time limit' in d.get('text', '') for d in seen if d['type'] == 'stream'))
+
+    def test_bad_timeout_is_ignored(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            for cell_id, timeout in (("cell-1", "soon"), ("cell-2", [5]), ("cell-3", "30")):
+                websocket.send_json({"type": "execute", "code": "print('ran')", "cellId": cell_id,
+                                     "timeout": timeout})
+                seen = collect(websocket, count_replies=0, cell_id=cell_id)
+                # The cell ran, and the kernel is free for the next one
+                self.assertNotIn('error', [d['type'] for d in seen])
+                self.assertIn('ran\n', [d.get('text') for d in seen if d['type'] == 'stream'])
+
+
+if __name__ == "__main__":
+    unittest.main()
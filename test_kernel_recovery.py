@@ -0,0 +1,76 @@
+import asyncio
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+from fastapi.testclient import TestClient
+
+import backend
+import kernel_runtime
+from backend import app
+from session_store import SessionStore, HOSTNAME
+
+
+def kill_recorded_kernels():
+    # TestClient may cancel the endpoint before its shutdown finishes, and
+    # kernels are detached: don't leave them behind
+    for meta in kernel_runtime.scan():
+        if kernel_runtime.pid_alive(meta.get("pid")):
+            os.killpg(meta["pid"], signal.SIGKILL)
+
+
+def run_cell(websocket, code, cell_id):
+    websocket.send_json({"type": "execute", "code": code, "cellId": cell_id})
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if data['type'] == 'complete' and data['cellId'] == cell_id:
+            return seen
+
+
+class TestKernelRecovery(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.client = TestClient(app)
+        self._old_store = backend.session_store
+        self._old_runtime = kernel_runtime.RUNTIME_DIR
+        backend.session_store = SessionStore()
+        kernel_runtime.RUNTIME_DIR = os.path.join(self.tmp, "runtime")
+
+    def tearDown(self):
+        kill_recorded_kernels()
+        backend.session_store = self._old_store
+        kernel_runtime.RUNTIME_DIR = self._old_runtime
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", "recover_user"), ignore_errors=True)
+
+    def test_recover_from_runtime_dir_after_restart(self):
+        with self.client.websocket_connect("/ws?userId=recover_user") as websocket:
+            hello = websocket.receive_json()
+            run_cell(websocket, "x = 7", "cell-1")
+            websocket.close(code=1012)
+
+        # A new process starts with an empty (in-memory) store: only the
+        # runtime directory remembers the kernel
+        backend.session_store = SessionStore()
+        self.assertEqual(asyncio.run(backend.recover_kernels()), 1)
+        self.assertEqual(backend.session_store.get(hello['sessionId'])['user_id'], "recover_user")
+
+        with self.client.websocket_connect("/ws?userId=recover_user") as websocket:
+            again = websocket.receive_json()
+            self.assertEqual(again, {"type": "session", "sessionId": hello['sessionId'], "resumed": True,
+                                     "engine": "ipykernel"})
+            seen = run_cell(websocket, "x * 3", "cell-2")
+            self.assertIn('21', [d.get('text') for d in seen if d['type'] == 'execute_result'])
+
+    def test_dead_kernel_is_discarded(self):
+        kernel_runtime.write_meta("gone", {"user_id": "recover_user", "host": HOSTNAME, "pid": None})
+        self.assertEqual(asyncio.run(backend.recover_kernels()), 0)
+        self.assertEqual(list(kernel_runtime.scan()), [])
+        self.assertIsNone(backend.session_store.get("gone"))
+
+
+if __name__ == "__main__":
+    unittest.main()
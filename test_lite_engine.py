@@ -0,0 +1,145 @@
+import os
+import shutil
+import time
+import unittest
+from fastapi.testclient import TestClient
+
+import backend
+from backend import app
+
+USER = "lite_user"
+
+
+def run_cell(websocket, code, cell_id):
+    websocket.send_json({"type": "execute", "code": code, "cellId": cell_id})
+    return receive_until(websocket, lambda d: d['type'] == 'complete' and d['cellId'] == cell_id)
+
+
+def receive_until(websocket, predicate):
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if predicate(data):
+            return seen
+
+
+def stdout(seen):
+    return "".join(d["text"] for d in seen if d["type"] == "stream" and d["name"] == "stdout")
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+
+
+class TestLiteEngine(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+
+    def connect(self, engine="lite"):
+        return self.client.websocket_connect(f"/ws?userId={USER}&engine={engine}")
+
+    def test_cells_share_state_and_stream_output(self):
+        with self.connect() as websocket:
+            hello = websocket.receive_json()
+            self.assertEqual((hello["type"], hello["engine"]), ("session", "lite"))
+            self.assertIsInstance(backend.sessions[hello["sessionId"]], backend.LiteSession)
+
+            seen = run_cell(websocket, "x = 20\nprint('x is', x)\nx * 2 + 2", "c1")
+            self.assertEqual(stdout(seen), "x is 20\n")
+            self.assertEqual([d["text"] for d in seen if d["type"] == "execute_result"], ["42"])
+
+            seen = run_cell(websocket, "import os\nprint(os.getcwd() == os.path.abspath('.'), x)", "c2")
+            self.assertEqual(stdout(seen), "True 20\n")
+
+    def test_errors_carry_the_cell_traceback(self):
+        with self.connect() as websocket:
+            websocket.receive_json()
+            seen = run_cell(websocket, "def f():\n    return 1 / 0\nf()", "c1")
+            error = [d for d in seen if d["type"] == "error"][0]
+            self.assertEqual(error["ename"], "ZeroDivisionError")
+            self.assertIn("return 1 / 0", "\n".join(error["traceback"]))
+
+            error = [d for d in run_cell(websocket, "def", "c2") if d["type"] == "error"][0]
+            self.assertEqual(error["ename"], "SyntaxError")
+            # The worker is still usable
+            self.assertEqual(stdout(run_cell(websocket, "print('ok')", "c3")), "ok\n")
+
+    def test_input(self):
+        with self.connect() as websocket:
+            websocket.receive_json()
+            websocket.send_json({"type": "execute", "code": "name = input('Name? ')\nprint('Hello', name)",
+                                 "cellId": "c1"})
+            prompt = receive_until(websocket, lambda d: d["type"] == "input_request")[-1]
+            self.assertEqual(prompt["prompt"], "Name? ")
+            websocket.send_json({"type": "input_reply", "value": "Ada", "cellId": "c1"})
+            seen = receive_until(websocket, lambda d: d["type"] == "complete")
+            self.assertEqual(stdout(seen), "Hello Ada\n")
+
+    def test_interrupt_keeps_state(self):
+        with self.connect() as websocket:
+            websocket.receive_json()
+            websocket.send_json({"type": "execute", "cellId": "c1",
+                                 "code": "a = 41\nimport time\nprint('sleeping', flush=True)\ntime.sleep(60)"})
+            receive_until(websocket, lambda d: d["type"] == "stream")
+            websocket.send_json({"type": "interrupt"})
+            seen = receive_until(websocket, lambda d: d["type"] == "interrupt_reply")
+            self.assertEqual(seen[-1]["status"], "ok")
+            self.assertIn("KeyboardInterrupt", [d.get("ename") for d in seen])
+            self.assertEqual(stdout(run_cell(websocket, "print(a + 1)", "c2")), "42\n")
+
+    def test_crash_restarts_the_worker(self):
+        with self.connect() as websocket:
+            websocket.receive_json()
+            seen = run_cell(websocket, "import os, signal\nos.kill(os.getpid(), signal.SIGSEGV)", "c1")
+            self.assertEqual([d["ename"] for d in seen if d["type"] == "error"], ["KernelDied"])
+            died = receive_until(websocket, lambda d: d["type"] == "kernel_died")[-1]
+            self.assertEqual(died["kind"], "crash")
+            restarted = receive_until(websocket, lambda d: d["type"] == "kernel_restarted")[-1]
+            self.assertEqual(restarted["restored"], [])
+            self.assertEqual(stdout(run_cell(websocket, "print('back')", "c2")), "back\n")
+
+    def test_kernel_features_are_reported_unavailable(self):
+        with self.connect() as websocket:
+            websocket.receive_json()
+            websocket.send_json({"type": "complete", "code": "pri", "requestId": 1})
+            reply = receive_until(websocket, lambda d: d["type"] == "complete_reply")[-1]
+            self.assertEqual(reply["matches"], [])
+            self.assertIn("lite engine", reply["error"])
+            websocket.send_json({"type": "inspect_variables", "requestId": 2})
+            self.assertIn("lite engine", receive_until(websocket, lambda d: d["type"] == "variables")[-1]["error"])
+
+    def test_unknown_engine_is_rejected(self):
+        with self.connect("bogus") as websocket:
+            self.assertEqual(websocket.receive_json()["type"], "rejected")
+
+    def test_multiplexed_channel_picks_its_engine(self):
+        with self.connect("ipykernel") as websocket:
+            self.assertEqual(websocket.receive_json()["engine"], "ipykernel")
+            websocket.send_json({"type": "attach", "channel": "quick", "engine": "lite"})
+            attached = receive_until(websocket, lambda d: d["type"] == "attached")[-1]
+            self.assertEqual(attached["engine"], "lite")
+            websocket.send_json({"type": "execute", "channel": "quick", "code": "print(6 * 7)", "cellId": "c1"})
+            seen = receive_until(websocket, lambda d: d["type"] == "complete")
+            self.assertEqual(stdout(seen), "42\n")
+
+    def test_lite_worker_is_smaller_and_faster_to_start(self):
+        measured = {}
+        for engine in ("ipykernel", "lite"):
+            started = time.monotonic()
+            with self.connect(engine) as websocket:
+                session_id = websocket.receive_json()["sessionId"]
+                elapsed = time.monotonic() - started
+                measured[engine] = (elapsed, rss_kb(backend.sessions[session_id].kernel_pid))
+        self.assertLess(measured["lite"][0], measured["ipykernel"][0])
+        self.assertLess(measured["lite"][1] * 3, measured["ipykernel"][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import asyncio
+import time
+import unittest
+from fastapi.testclient import TestClient
+
+import backend
+from backend import app
+from loop_monitor import LoopMonitor
+
+
+def copy_synchronously(seconds):
+    # Stands in for blocking work on the loop, like a big file copy
+    time.sleep(seconds)
+
+
+async def monitored(monitor, work):
+    monitor.start()
+    try:
+        await asyncio.sleep(0.1)
+        await work()
+        await asyncio.sleep(0.1)
+    finally:
+        await monitor.stop()
+
+
+class TestLoopMonitor(unittest.TestCase):
+    def test_idle_loop_is_healthy(self):
+        monitor = LoopMonitor(interval=0.01, lag_threshold=0.1, slow_callback=0.05)
+
+        async def idle():
+            await asyncio.sleep(0.2)
+
+        asyncio.run(monitored(monitor, idle))
+        self.assertFalse(monitor.degraded)
+        self.assertEqual(monitor.stall_count, 0)
+        self.assertGreater(monitor.histogram.count, 10)
+
+    def test_blocking_call_is_caught_with_its_stack(self):
+        monitor = LoopMonitor(interval=0.01, lag_threshold=0.1, slow_callback=0.05)
+
+        async def block():
+            copy_synchronously(0.3)
+
+        asyncio.run(monitored(monitor, block))
+        self.assertEqual(monitor.stall_count, 1)
+        stall = monitor.debug()["recent_stalls"][0]
+        self.assertIn("copy_synchronously", "\n".join(stall["stack"]))
+        self.assertIn("in copy_synchronously", stall["where"])
+        self.assertGreaterEqual(stall["duration_ms"], 250)
+        self.assertTrue(monitor.degraded)
+        self.assertGreaterEqual(monitor.metrics()["max_lag_ms"], 250)
+
+    def test_lag_ages_out_of_the_window(self):
+        monitor = LoopMonitor(interval=0.01, lag_threshold=0.1, window=0.1)
+        monitor.record(0.5)
+        self.assertTrue(monitor.degraded)
+        for _ in range(10):
+            monitor.record(0.001)
+        self.assertFalse(monitor.degraded)
+
+
+class TestHealth(unittest.TestCase):
+    def setUp(self):
+        self.saved = backend.loop_monitor
+        backend.loop_monitor = LoopMonitor(lag_threshold=0.1)
+
+    def tearDown(self):
+        backend.loop_monitor = self.saved
+
+    def test_health_reports_degraded_loop(self):
+        client = TestClient(app)
+        self.assertEqual(client.get("/health").json()["status"], "healthy")
+        backend.loop_monitor.record(0.4)
+        health = client.get("/health").json()
+        self.assertEqual(health["status"], "degraded")
+        self.assertEqual(health["loop_lag_ms"], 400)
+        self.assertEqual(client.get("/debug/loop").json()["recent_stalls"], [])
+        self.assertEqual(client.get("/metrics/loop").json()["histogram"]["count"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
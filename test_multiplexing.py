@@ -0,0 +1,180 @@
+import os
+import shutil
+import time
+import unittest
+from unittest import mock
+from fastapi.testclient import TestClient
+
+import backend
+from admission import AdmissionController
+from backend import app
+
+USER = "multiplex_user"
+
+
+def run_cell(websocket, code, cell_id, channel=None):
+    message = {"type": "execute", "code": code, "cellId": cell_id}
+    if channel is not None:
+        message["channel"] = channel
+    websocket.send_json(message)
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if data['type'] == 'complete' and data['cellId'] == cell_id:
+            return seen
+
+
+def stdout(seen):
+    return "".join(d.get("text", "") for d in seen if d["type"] == "stream")
+
+
+def attach(websocket, channel, **options):
+    websocket.send_json({"type": "attach", "channel": channel, **options})
+    while True:
+        data = websocket.receive_json()
+        if data.get("channel") == channel and data["type"] in ("attached", "detached", "rejected"):
+            return data
+
+
+def receive_until(websocket, predicate):
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if predicate(data):
+            return seen
+
+
+class TestMultiplexing(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        self.saved = backend.admission
+        backend.admission = AdmissionController(user_start_burst=10 ** 6)
+
+    def tearDown(self):
+        backend.admission = self.saved
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+
+    def test_channels_have_their_own_kernels(self):
+        with self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            own = websocket.receive_json()["sessionId"]
+            first, second = attach(websocket, "first.ipynb"), attach(websocket, "second.ipynb")
+            self.assertEqual((first["type"], second["type"]), ("attached", "attached"))
+            self.assertEqual(len({own, first["sessionId"], second["sessionId"]}), 3)
+
+            run_cell(websocket, "x = 'own'", "c1")
+            run_cell(websocket, "x = 'first'", "c1", channel="first.ipynb")
+            seen = run_cell(websocket, "x = 'second'\nprint(x)", "c1", channel="second.ipynb")
+            self.assertTrue(all(d["channel"] == "second.ipynb" for d in seen))
+            self.assertEqual(stdout(seen), "second\n")
+            self.assertEqual(stdout(run_cell(websocket, "print(x)", "c2", channel="first.ipynb")), "first\n")
+            seen = run_cell(websocket, "print(x)", "c2")
+            self.assertEqual(stdout(seen), "own\n")
+            self.assertTrue(all("channel" not in d for d in seen))
+            self.assertEqual(backend.admission.metrics()["kernels"], 3)
+
+            websocket.send_json({"type": "detach", "channel": "first.ipynb"})
+            self.assertEqual(websocket.receive_json(), {"type": "detached", "channel": "first.ipynb"})
+            self.assertNotIn(first["sessionId"], backend.sessions)
+            self.assertEqual(backend.admission.metrics()["kernels"], 2)
+
+            websocket.send_json({"type": "execute", "code": "1", "cellId": "c3", "channel": "first.ipynb"})
+            self.assertEqual(websocket.receive_json()["error"], "Channel not attached")
+
+    def test_shared_kernel(self):
+        with self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            websocket.receive_json()
+            owner = attach(websocket, "a")
+            shared = attach(websocket, "b", shareWith="a")
+            self.assertEqual(shared["sessionId"], owner["sessionId"])
+            self.assertTrue(shared["shared"])
+            self.assertEqual(attach(websocket, "c", shareWith="nope")["type"], "detached")
+
+            run_cell(websocket, "y = 41", "c1", channel="a")
+            self.assertEqual(stdout(run_cell(websocket, "print(y + 1)", "c2", channel="b")), "42\n")
+            # The kernel outlives the channel that started it while another uses it
+            websocket.send_json({"type": "detach", "channel": "a"})
+            websocket.receive_json()
+            self.assertIn(owner["sessionId"], backend.sessions)
+            self.assertEqual(stdout(run_cell(websocket, "print(y)", "c3", channel="b")), "41\n")
+            websocket.send_json({"type": "detach", "channel": "b"})
+            websocket.receive_json()
+            self.assertNotIn(owner["sessionId"], backend.sessions)
+
+    def test_channels_are_admitted_like_connections(self):
+        backend.admission = AdmissionController(max_kernels=2, user_start_burst=10 ** 6)
+        with self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            websocket.receive_json()
+            self.assertEqual(attach(websocket, "a")["type"], "attached")
+            websocket.send_json({"type": "attach", "channel": "b"})
+            self.assertEqual(websocket.receive_json(),
+                             {"type": "queued", "position": 1, "queueLength": 1, "channel": "b"})
+            websocket.send_json({"type": "detach", "channel": "a"})
+            replies = [websocket.receive_json(), websocket.receive_json()]
+            self.assertIn({"type": "detached", "channel": "a"}, replies)
+            self.assertIn("attached", [r["type"] for r in replies])
+
+
+class TestChannelReconnect(unittest.TestCase):
+    def setUp(self):
+        # One event loop for both connections: the parked kernels live in it.
+        # Its shutdown stops them for good, and only them: sessions other tests
+        # left behind belong to event loops that are gone
+        self.patches = [mock.patch.object(backend, "KEEP_KERNELS_ON_RESTART", False),
+                        mock.patch.dict(backend.sessions, clear=True)]
+        for patch in self.patches:
+            patch.start()
+        self.client = TestClient(app)
+        self.client.__enter__()
+        self.saved = backend.admission
+        backend.admission = AdmissionController(user_start_burst=10 ** 6)
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        for patch in reversed(self.patches):
+            patch.stop()
+        backend.admission = self.saved
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+
+    def test_dropped_connection_parks_channel_kernels(self):
+        code = "import time\nx = 7\nprint('start', flush=True)\ntime.sleep(0.5)\nprint('done')"
+        with self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            own = websocket.receive_json()["sessionId"]
+            channel = attach(websocket, "nb")["sessionId"]
+            websocket.send_json({"type": "execute", "code": code, "cellId": "c1", "channel": "nb"})
+            receive_until(websocket, lambda d: d["type"] == "stream")
+            websocket.close(code=1001)
+        self.assertIn(channel, backend.parked)
+
+        with self.client.websocket_connect(f"/ws?userId={USER}&sessionId={own}") as websocket:
+            self.assertTrue(websocket.receive_json()["resumed"])
+            again = attach(websocket, "nb", sessionId=channel)
+            self.assertEqual((again["sessionId"], again["resumed"]), (channel, True))
+            receive_until(websocket, lambda d: d["type"] == "complete" and d["channel"] == "nb")
+            websocket.send_json({"type": "replay", "cellId": "c1", "channel": "nb"})
+            cell = receive_until(websocket, lambda d: d["type"] == "replay")[-1]["cells"][0]
+            self.assertEqual("".join(o["text"] for o in cell["outputs"]), "start\ndone\n")
+            self.assertEqual(stdout(run_cell(websocket, "print(x)", "c2", channel="nb")), "7\n")
+        self.assertNotIn(channel, backend.parked)
+
+    def test_detach_while_starting_drops_the_session(self):
+        with self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            websocket.receive_json()
+            before = set(backend.sessions)
+            websocket.send_json({"type": "attach", "channel": "slow"})
+            deadline = time.monotonic() + 10
+            while set(backend.sessions) == before and time.monotonic() < deadline:
+                time.sleep(0.01)
+            websocket.send_json({"type": "detach", "channel": "slow"})
+            self.assertEqual(receive_until(websocket, lambda d: d["type"] == "detached")[-1],
+                             {"type": "detached", "channel": "slow"})
+            deadline = time.monotonic() + 10
+            while set(backend.sessions) != before and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(set(backend.sessions), before)
+            self.assertEqual(backend.admission.metrics()["kernels"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
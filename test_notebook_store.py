@@ -0,0 +1,94 @@
+import glob
+import os
+import shutil
+import unittest
+from fastapi.testclient import TestClient
+
+import backend
+from backend import app
+
+USER = "notebook_user"
+PLOT = {"type": "image", "data": "iVBORw0KGgo" + "A" * 50_000}
+
+
+class TestNotebookStore(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+
+    def output_files(self):
+        return glob.glob(os.path.join(backend.WORKING_DIR, "storage", USER, ".outputs", "??", "*"))
+
+    def test_save_patch_and_load(self):
+        # Whole document in the legacy client format (code + rendered output)
+        saved = self.client.put(f"/notebooks/{USER}/nb1", json={
+            "name": "Analysis",
+            "cells": [{"id": "a", "code": "print(1)", "output": "1\n"},
+                      {"id": "b", "code": "x = 2", "output": ""}],
+        }).json()
+        self.assertEqual(saved["version"], 1)
+
+        patched = self.client.patch(f"/notebooks/{USER}/nb1", json={"baseVersion": 1, "ops": [
+            {"op": "upsert", "cell": {"id": "c", "code": "plot()", "outputs": [PLOT]}},
+            {"op": "upsert", "cell": {"id": "b", "code": "x = 3"}},
+            {"op": "move", "id": "c", "index": 0},
+        ]})
+        self.assertEqual(patched.status_code, 200)
+        body = patched.json()
+        self.assertEqual(body["version"], 2)
+        plot_ref = body["outputs"]["c"][0]
+
+        doc = self.client.get(f"/notebooks/{USER}/nb1").json()
+        self.assertEqual([c["id"] for c in doc["cells"]], ["c", "a", "b"])
+        self.assertEqual(doc["cells"][0]["outputs"], [PLOT])
+        self.assertEqual(doc["cells"][1]["outputs"], ["1\n"])
+        self.assertEqual(doc["cells"][2]["code"], "x = 3")
+
+        refs = self.client.get(f"/notebooks/{USER}/nb1?refs=true").json()
+        self.assertEqual(refs["cells"][0]["outputs"], [plot_ref])
+        self.assertEqual(self.client.get(f"/notebooks/{USER}/outputs/{plot_ref}").json(), PLOT)
+
+        listing = self.client.get(f"/notebooks/{USER}").json()["notebooks"]
+        self.assertEqual([(n["id"], n["name"], n["cells"]) for n in listing], [("nb1", "Analysis", 3)])
+
+    def test_identical_outputs_are_stored_once(self):
+        self.client.put(f"/notebooks/{USER}/nb2", json={"cells": []})
+        for version, cell_id in enumerate(["p1", "p2", "p1"], start=1):
+            r = self.client.patch(f"/notebooks/{USER}/nb2", json={"baseVersion": version, "ops": [
+                {"op": "upsert", "cell": {"id": cell_id, "code": "plot()", "outputs": [PLOT]}}]})
+            self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(self.output_files()), 1)
+
+        ref = r.json()["outputs"]["p1"][0]
+        r = self.client.patch(f"/notebooks/{USER}/nb2", json={"ops": [
+            {"op": "upsert", "cell": {"id": "p3", "code": "plot()", "outputs": [{"$ref": ref}]}}]})
+        self.assertEqual(r.json()["outputs"]["p3"], [ref])
+
+    def test_versions_and_conflicts(self):
+        self.client.put(f"/notebooks/{USER}/nb3", json={"cells": [{"id": "a", "code": "v1"}]})
+        self.client.patch(f"/notebooks/{USER}/nb3", json={"baseVersion": 1, "ops": [
+            {"op": "upsert", "cell": {"id": "a", "code": "v2"}}]})
+
+        stale = self.client.patch(f"/notebooks/{USER}/nb3", json={"baseVersion": 1, "ops": [
+            {"op": "delete", "id": "a"}]})
+        self.assertEqual(stale.status_code, 409)
+        self.assertEqual(stale.json()["detail"]["version"], 2)
+
+        self.assertEqual(self.client.get(f"/notebooks/{USER}/nb3/versions").json()["versions"], [2, 1])
+        old = self.client.get(f"/notebooks/{USER}/nb3?version=1").json()
+        self.assertEqual(old["cells"][0]["code"], "v1")
+
+    def test_errors(self):
+        self.assertEqual(self.client.get(f"/notebooks/{USER}/missing").status_code, 404)
+        self.assertEqual(self.client.put(f"/notebooks/{USER}/..evil", json={"cells": []}).status_code, 400)
+        self.client.put(f"/notebooks/{USER}/nb4", json={"cells": []})
+        bad = self.client.patch(f"/notebooks/{USER}/nb4", json={"ops": [{"op": "explode"}]})
+        self.assertEqual(bad.status_code, 400)
+        # A rejected patch does not create a version
+        self.assertEqual(self.client.get(f"/notebooks/{USER}/nb4").json()["version"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
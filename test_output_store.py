@@ -0,0 +1,115 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+from fastapi.testclient import TestClient
+
+import backend
+import output_store
+from backend import app
+from output_store import OutputStore, QuotaExceeded
+
+USER = "output_user"
+PLOT_CODE = """
+import matplotlib.pyplot as plt
+plt.plot([1, 2, 3], [3, 1, 2])
+plt.show()
+"""
+
+
+def run_cell(websocket, code, cell_id):
+    websocket.send_json({"type": "execute", "code": code, "cellId": cell_id})
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if data['type'] == 'complete' and data['cellId'] == cell_id:
+            return seen
+
+
+class TestOutputStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def blobs(self):
+        return glob.glob(os.path.join(self.tmp, USER, ".outputs", "??", "*"))
+
+    def test_dedup_and_compression(self):
+        store = OutputStore(self.tmp)
+        text = b"<table>" + b"<tr><td>1</td></tr>" * 5000 + b"</table>"
+        first = store.put(USER, text)
+        usage = store.usage(USER)
+        self.assertEqual(store.put(USER, text), first)
+        self.assertEqual(store.usage(USER), usage)
+        self.assertEqual(len(self.blobs()), 1)
+        self.assertLess(usage, len(text) / 10)
+        self.assertEqual(store.get(USER, first), text)
+
+        # Incompressible payloads (PNG, WebP) are stored as they are
+        noise = os.urandom(20_000)
+        digest = store.put(USER, noise)
+        with open(store._path(USER, digest), "rb") as f:
+            self.assertEqual(f.read(1), output_store.RAW)
+        self.assertEqual(store.get(USER, digest), noise)
+
+    def test_lru_eviction_respects_protected_outputs(self):
+        store = OutputStore(self.tmp, quota=52_000)
+        pinned = store.put(USER, os.urandom(15_000))
+        store.protect(lambda user_id: {pinned})
+        old = store.put(USER, os.urandom(15_000))
+        recent = store.put(USER, os.urandom(15_000))
+        for age, digest in ((300, pinned), (200, old), (100, recent)):
+            mtime = os.path.getmtime(store._path(USER, digest)) - age
+            os.utime(store._path(USER, digest), (mtime, mtime))
+        store.get(USER, old)  # reading counts as a use
+
+        newest = store.put(USER, os.urandom(15_000))
+        self.assertTrue(store.exists(USER, pinned))
+        self.assertTrue(store.exists(USER, old))
+        self.assertFalse(store.exists(USER, recent))
+        self.assertTrue(store.exists(USER, newest))
+        self.assertLessEqual(store.usage(USER), 52_000)
+
+    def test_quota_exceeded_when_everything_is_protected(self):
+        store = OutputStore(self.tmp, quota=20_000)
+        store.protect(lambda user_id: {os.path.basename(p) for p in self.blobs()})
+        store.put(USER, os.urandom(15_000))
+        with self.assertRaises(QuotaExceeded):
+            store.put(USER, os.urandom(15_000))
+        self.assertEqual(len(self.blobs()), 1)
+
+
+class TestOutputServing(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+
+    def test_plots_are_served_by_hash(self):
+        with self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            websocket.receive_json()
+            first = [d for d in run_cell(websocket, PLOT_CODE, "cell-1") if d.get('imageUrl')]
+            again = [d for d in run_cell(websocket, PLOT_CODE, "cell-2") if d.get('imageUrl')]
+
+        self.assertEqual(len(first), 1)
+        self.assertNotIn('image', first[0])
+        # Same figure, same URL: the browser already has it
+        self.assertEqual(first[0]['imageUrl'], again[0]['imageUrl'])
+
+        response = self.client.get(first[0]['imageUrl'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-type'], 'image/png')
+        self.assertIn('immutable', response.headers['cache-control'])
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+
+        self.assertEqual(self.client.get(f"/outputs/{USER}/{'0' * 64}.png").status_code, 404)
+        self.assertEqual(self.client.get(f"/outputs/{USER}/{'0' * 64}.exe").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+from fastapi.testclient import TestClient
+
+import backend
+from backend import app
+from luna import packages
+
+USER = "overlay_user"
+
+
+def build_wheel(directory, name, version, requires=()):
+    # Minimal pure-Python wheel, so the tests never touch the network
+    dist = f"{name}-{version}"
+    files = {
+        f"{name}/__init__.py": f"__version__ = {version!r}\n",
+        f"{dist}.dist-info/METADATA": f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+                                      + "".join(f"Requires-Dist: {r}\n" for r in requires),
+        f"{dist}.dist-info/WHEEL": "Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+    }
+    files[f"{dist}.dist-info/RECORD"] = "".join(f"{path},,\n" for path in files) + f"{dist}.dist-info/RECORD,,\n"
+    with zipfile.ZipFile(os.path.join(directory, f"{dist}-py3-none-any.whl"), "w") as wheel:
+        for path, content in files.items():
+            wheel.writestr(path, content)
+
+
+def run_cell(websocket, code, cell_id):
+    websocket.send_json({"type": "execute", "code": code, "cellId": cell_id})
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if data['type'] == 'complete' and data['cellId'] == cell_id:
+            return seen
+
+
+class OverlayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self._saved = (packages.PACKAGES_DIR, packages.WHEELHOUSE, packages.STORE, packages.OFFLINE)
+        packages.PACKAGES_DIR = os.path.join(self.tmp, "packages")
+        packages.WHEELHOUSE = os.path.join(packages.PACKAGES_DIR, "wheelhouse")
+        packages.STORE = os.path.join(packages.PACKAGES_DIR, "store")
+        packages.OFFLINE = True
+        os.makedirs(packages.WHEELHOUSE)
+        build_wheel(packages.WHEELHOUSE, "demo_dep", "1.0")
+        build_wheel(packages.WHEELHOUSE, "demo_pkg", "1.0", requires=["demo_dep>=1.0"])
+        build_wheel(packages.WHEELHOUSE, "demo_pkg", "2.0", requires=["demo_dep>=1.0"])
+
+    def tearDown(self):
+        packages.PACKAGES_DIR, packages.WHEELHOUSE, packages.STORE, packages.OFFLINE = self._saved
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+class TestPackageOverlays(OverlayTestCase):
+    def overlay(self, user):
+        return os.path.join(self.tmp, user, ".packages")
+
+    def test_second_user_only_links(self):
+        first = packages.install(["demo_pkg==1.0"], overlay=self.overlay("a"))
+        self.assertEqual(sorted((i["name"], i["version"]) for i in first),
+                         [("demo_dep", "1.0"), ("demo_pkg", "1.0")])
+        unpacked = sorted(os.listdir(packages.STORE))
+
+        packages.install(["demo_pkg==1.0"], overlay=self.overlay("b"))
+        self.assertEqual(sorted(os.listdir(packages.STORE)), unpacked)
+        link = os.path.join(self.overlay("b"), "demo_pkg")
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(os.readlink(link), os.readlink(os.path.join(self.overlay("a"), "demo_pkg")))
+
+        result = subprocess.run([sys.executable, "-c", "import demo_pkg, demo_dep; print(demo_pkg.__version__)"],
+                                capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=self.overlay("b")))
+        self.assertEqual(result.stdout.strip(), "1.0")
+
+    def test_upgrade_and_uninstall(self):
+        overlay = self.overlay("a")
+        packages.install(["demo_pkg==1.0"], overlay=overlay)
+        upgraded = packages.install(["demo_pkg==2.0"], overlay=overlay)
+        # demo_dep is already in the overlay: only demo_pkg is linked again
+        self.assertEqual([(i["name"], i["version"]) for i in upgraded], [("demo_pkg", "2.0")])
+        self.assertEqual(packages.installed(overlay), {"demo_dep": "1.0", "demo_pkg": "2.0"})
+        self.assertFalse(os.path.exists(os.path.join(overlay, "demo_pkg-1.0.dist-info")))
+
+        self.assertEqual(packages.uninstall(["demo_pkg", "not_there"], overlay=overlay), ["demo_pkg"])
+        self.assertFalse(os.path.lexists(os.path.join(overlay, "demo_pkg")))
+        self.assertEqual(packages.installed(overlay), {"demo_dep": "1.0"})
+
+    def test_installing_around_the_overlay_is_refused(self):
+        with self.assertRaises(ValueError):
+            packages.install(["--target", "/tmp/x", "demo_pkg"], overlay=self.overlay("a"))
+
+
+class TestKernelPipMagic(OverlayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = TestClient(app)
+        self._env = {k: os.environ.get(k) for k in ("LUNA_PACKAGES_DIR", "LUNA_PIP_OFFLINE")}
+        # Kernels inherit the backend's environment
+        os.environ["LUNA_PACKAGES_DIR"] = packages.PACKAGES_DIR
+        os.environ["LUNA_PIP_OFFLINE"] = "1"
+
+    def tearDown(self):
+        for key, value in self._env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+        super().tearDown()
+
+    def test_pip_magic_installs_into_overlay(self):
+        with self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            websocket.receive_json()
+            seen = run_cell(websocket, "%pip install demo_pkg", "cell-1")
+            self.assertIn("Linked demo_pkg==2.0", "".join(d.get('text', '') for d in seen))
+            seen = run_cell(websocket, "import demo_pkg\nprint(demo_pkg.__file__, demo_pkg.__version__)", "cell-2")
+            out = "".join(d.get('text', '') for d in seen if d['type'] == 'stream')
+            self.assertIn(os.path.join(USER, ".packages", "demo_pkg"), out)
+            self.assertIn("2.0", out)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import shutil
+import time
+import unittest
+from unittest import mock
+from fastapi.testclient import TestClient
+
+import backend
+import replay_buffer
+from backend import app
+from replay_buffer import ReplayBuffer
+
+USER = "replay_user"
+
+
+def stream(text, name="stdout"):
+    return {"cellId": "c1", "type": "stream", "name": name, "text": text}
+
+
+def receive_until(websocket, predicate):
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if predicate(data):
+            return seen
+
+
+class TestReplayBuffer(unittest.TestCase):
+    def test_stream_chunks_are_merged(self):
+        buffer = ReplayBuffer()
+        buffer.start("c1")
+        for i in range(1000):
+            buffer.record("c1", stream(f"{i}\n"))
+        buffer.record("c1", stream("oops\n", "stderr"))
+        buffer.record("c1", stream("more\n"))
+        outputs = buffer.replay("c1")[0]["outputs"]
+        self.assertEqual([(o["name"], len(o["text"])) for o in outputs],
+                         [("stdout", sum(len(f"{i}\n") for i in range(1000))), ("stderr", 5), ("stdout", 5)])
+
+    def test_long_stream_keeps_its_tail(self):
+        buffer = ReplayBuffer()
+        buffer.start("c1")
+        with mock.patch.object(replay_buffer, "CELL_BYTES", 100):
+            for i in range(100):
+                buffer.record("c1", stream(f"line {i:03}\n"))
+        cell = buffer.replay("c1")[0]
+        self.assertEqual(len(cell["outputs"]), 1)
+        text = cell["outputs"][0]["text"]
+        self.assertLessEqual(len(text), 100)
+        self.assertTrue(text.endswith("line 099\n"))
+        self.assertGreater(cell["truncated"], 0)
+
+    def test_message_count_is_bounded(self):
+        buffer = ReplayBuffer()
+        buffer.start("c1")
+        with mock.patch.object(replay_buffer, "CELL_MESSAGES", 10):
+            for i in range(50):
+                buffer.record("c1", {"cellId": "c1", "type": "display_data", "text": str(i)})
+        cell = buffer.replay("c1")[0]
+        self.assertEqual([o["text"] for o in cell["outputs"]], [str(i) for i in range(40, 50)])
+        self.assertEqual(cell["truncated"], 40)
+
+    def test_updated_display_is_replaced_in_place(self):
+        buffer = ReplayBuffer()
+        buffer.start("c1")
+        buffer.record("c1", {"cellId": "c1", "type": "display_data", "text": "0%", "displayId": "bar"})
+        buffer.record("c1", stream("working\n"))
+        for percent in range(10, 101, 10):
+            buffer.record("c1", {"cellId": "c1", "type": "update_display_data", "text": f"{percent}%",
+                                 "displayId": "bar"})
+        outputs = buffer.replay("c1")[0]["outputs"]
+        self.assertEqual([(o["type"], o.get("text")) for o in outputs],
+                         [("display_data", "100%"), ("stream", "working\n")])
+
+    def test_rerun_replaces_a_cell_and_old_cells_are_evicted(self):
+        buffer = ReplayBuffer(max_cells=2)
+        for cell_id in ("a", "b", "a", "c"):
+            buffer.start(cell_id)
+            buffer.record(cell_id, {"cellId": cell_id, "type": "stream", "name": "stdout", "text": cell_id})
+            buffer.finish(cell_id)
+        self.assertEqual([(c["cellId"], c["complete"], len(c["outputs"])) for c in buffer.replay()],
+                         [("a", True, 1), ("c", True, 1)])
+        # Outputs of cells that aren't running (or known) are ignored
+        buffer.record("zzz", stream("x"))
+        self.assertEqual(buffer.replay("zzz"), [])
+
+
+class TestReplayOnReconnect(unittest.TestCase):
+    def setUp(self):
+        # One event loop for both connections: the parked kernel lives in it
+        self.client = TestClient(app)
+        self.client.__enter__()
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+
+    def test_dropped_connection_resumes_the_running_cell(self):
+        code = "import time\nfor i in range(3):\n    print('tick', i, flush=True)\n    time.sleep(0.3)\nprint('done')"
+        with self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+            session_id = websocket.receive_json()["sessionId"]
+            websocket.send_json({"type": "execute", "code": code, "cellId": "c1"})
+            receive_until(websocket, lambda d: d["type"] == "stream")
+            websocket.close(code=1001)  # a page reload
+
+        with self.client.websocket_connect(f"/ws?userId={USER}&sessionId={session_id}") as websocket:
+            hello = websocket.receive_json()
+            self.assertEqual((hello["sessionId"], hello["resumed"]), (session_id, True))
+            self.assertEqual(self.client.get("/metrics/replay").json()["parked"], 0)
+            websocket.send_json({"type": "replay"})
+            # Live outputs sent before the snapshot are also in it
+            seen = receive_until(websocket, lambda d: d["type"] == "replay")
+            replay = seen[-1]
+            self.assertEqual(replay["executing"], "c1")
+            replayed = "".join(o["text"] for o in replay["cells"][0]["outputs"])
+            live = receive_until(websocket, lambda d: d["type"] == "complete")
+            text = replayed + "".join(d.get("text", "") for d in live if d["type"] == "stream")
+            self.assertEqual(text, "tick 0\ntick 1\ntick 2\ndone\n")
+
+            websocket.send_json({"type": "replay", "cellId": "c1"})
+            cell = receive_until(websocket, lambda d: d["type"] == "replay")[-1]["cells"][0]
+            self.assertTrue(cell["complete"])
+            self.assertEqual(cell["outputs"], [{"cellId": "c1", "type": "stream", "name": "stdout", "text": text}])
+
+    def test_parked_session_expires(self):
+        with mock.patch.object(backend, "RECONNECT_GRACE", 0.2):
+            with self.client.websocket_connect(f"/ws?userId={USER}") as websocket:
+                session_id = websocket.receive_json()["sessionId"]
+                websocket.close(code=1006)
+            deadline = time.monotonic() + 10
+            while session_id in backend.sessions and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertNotIn(session_id, backend.sessions)
+            self.assertNotIn(session_id, backend.parked)
+
+    def test_closed_connection_is_not_parked(self):
+        with self.client.websocket_connect(f"/ws?userId={USER}&engine=lite") as websocket:
+            session_id = websocket.receive_json()["sessionId"]
+        self.assertNotIn(session_id, backend.parked)
+        with self.client.websocket_connect(f"/ws?userId={USER}&engine=lite&sessionId={session_id}") as websocket:
+            self.assertFalse(websocket.receive_json()["resumed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
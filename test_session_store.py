@@ -0,0 +1,129 @@
+import asyncio
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+from fastapi.testclient import TestClient
+
+import backend
+import kernel_runtime
+import session_store
+import workspace_io
+from backend import app
+from session_store import SessionStore, SQLiteSessionStore, create_session_store
+
+
+def run_cell(websocket, code, cell_id):
+    websocket.send_json({"type": "execute", "code": code, "cellId": cell_id})
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if data['type'] == 'complete' and data['cellId'] == cell_id:
+            return seen
+
+
+class TestSessionStores(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def check_store(self, store):
+        store.save({"session_id": "a", "user_id": "u1", "connection_file": "/tmp/k-a.json", "pid": 10, "last_activity": 100})
+        store.save({"session_id": "b", "user_id": "u1", "connection_file": "/tmp/k-b.json", "pid": 11, "last_activity": 200})
+        store.save({"session_id": "c", "user_id": "u2", "connection_file": "/tmp/k-c.json", "pid": 12, "host": "elsewhere"})
+
+        self.assertEqual(store.get("a")["connection_file"], "/tmp/k-a.json")
+        self.assertEqual([r["session_id"] for r in store.find_for_user("u1")], ["b", "a"])
+        self.assertEqual(store.find_for_user("u2"), [])  # other host
+
+        store.touch("a", now=300)
+        store.touch("a", now=310)  # throttled
+        self.assertEqual(store.get("a")["last_activity"], 300)
+        self.assertTrue(store.touch_due("b", 400))
+        self.assertFalse(store.touch_due("b", 410))
+
+        store.remove("a")
+        self.assertIsNone(store.get("a"))
+
+    def test_memory_store(self):
+        self.check_store(SessionStore())
+
+    def test_sqlite_store_survives_reopen(self):
+        path = os.path.join(self.tmp, "sessions.db")
+        self.check_store(create_session_store(f"sqlite:///{path}"))
+        reopened = SQLiteSessionStore(path)
+        self.assertEqual(sorted(r["session_id"] for r in reopened.all()), ["b", "c"])
+
+
+class TestKernelReadoption(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.client = TestClient(app)
+        self._old_store = backend.session_store
+        backend.session_store = SQLiteSessionStore(os.path.join(self.tmp, "sessions.db"))
+        self._old_runtime = kernel_runtime.RUNTIME_DIR
+        kernel_runtime.RUNTIME_DIR = os.path.join(self.tmp, "runtime")
+
+    def tearDown(self):
+        # Kernels are detached from this process: kill whatever is left
+        for meta in kernel_runtime.scan():
+            if kernel_runtime.pid_alive(meta.get("pid")):
+                os.killpg(meta["pid"], signal.SIGKILL)
+        kernel_runtime.RUNTIME_DIR = self._old_runtime
+        backend.session_store = self._old_store
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", "readopt_user"), ignore_errors=True)
+
+    def test_readopt_after_server_restart(self):
+        with self.client.websocket_connect("/ws?userId=readopt_user") as websocket:
+            hello = websocket.receive_json()
+            self.assertFalse(hello['resumed'])
+            touches = workspace_io.histograms["touch"].count if "touch" in workspace_io.histograms else 0
+            run_cell(websocket, "x = 5", "cell-1")
+            # last_activity is written back in the workspace I/O pool, not on the event loop
+            self.assertEqual(workspace_io.histograms["touch"].count, touches + 1)
+            # Server going away (1012): the kernel must be left running
+            websocket.close(code=1012)
+
+        record = backend.session_store.get(hello['sessionId'])
+        self.assertIsNotNone(record)
+        self.assertNotIn(hello['sessionId'], backend.sessions)
+
+        with self.client.websocket_connect(f"/ws?userId=readopt_user&sessionId={hello['sessionId']}") as websocket:
+            again = websocket.receive_json()
+            self.assertEqual(again, {"type": "session", "sessionId": hello['sessionId'], "resumed": True,
+                                     "engine": "ipykernel"})
+            seen = run_cell(websocket, "x * 2", "cell-2")
+            self.assertIn('10', [d.get('text') for d in seen if d['type'] == 'execute_result'])
+
+    def test_only_the_requested_or_only_orphan_is_offered(self):
+        for session_id in ("nb1", "nb2"):
+            backend.session_store.save({"session_id": session_id, "user_id": "readopt_user",
+                                        "connection_file": os.path.join(self.tmp, f"{session_id}.json")})
+
+        def offered(session_id=None):
+            records = asyncio.run(backend.find_orphaned_sessions("readopt_user", session_id))
+            return [r["session_id"] for r in records]
+
+        self.assertEqual(offered("nb2"), ["nb2"])
+        self.assertEqual(offered("gone"), [])
+        self.assertEqual(offered(), [])  # which notebook's kernel? neither
+        backend.session_store.remove("nb1")
+        self.assertEqual(offered(), ["nb2"])
+
+    def test_dead_kernel_record_is_discarded(self):
+        backend.session_store.save({"session_id": "stale", "user_id": "readopt_user",
+                                    "connection_file": os.path.join(self.tmp, "missing.json"), "pid": None})
+        with self.client.websocket_connect("/ws?userId=readopt_user") as websocket:
+            hello = websocket.receive_json()
+            self.assertFalse(hello['resumed'])
+            self.assertNotEqual(hello['sessionId'], 'stale')
+        self.assertIsNone(backend.session_store.get("stale"))
+
+
+if __name__ == "__main__":
+    unittest.main()
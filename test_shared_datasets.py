@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+
+import backend
+from backend import app
+from luna import datasets
+
+
+class TestSharedDatasets(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.client = TestClient(app)
+        self._old_dir = datasets.DATASETS_DIR
+        self._old_token = backend.ADMIN_TOKEN
+        datasets.DATASETS_DIR = self.root
+
+    def tearDown(self):
+        datasets.DATASETS_DIR = self._old_dir
+        backend.ADMIN_TOKEN = self._old_token
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_publish_and_load_memory_mapped(self):
+        manifest = datasets.publish("user_data.csv")
+        self.assertEqual(manifest["name"], "user_data")
+
+        df = datasets.load("user_data")
+        original = pd.read_csv("user_data.csv")
+        self.assertEqual(list(df.columns), list(original.columns))
+        self.assertEqual(df["Name"].astype(str).tolist(), original["Name"].astype(str).tolist())
+        np.testing.assert_array_equal(df["Marks"].to_numpy(), original["Marks"].to_numpy())
+
+        # Numeric data is a read-only view of the shared file, not a copy
+        marks = df["Marks"].to_numpy()
+        self.assertFalse(marks.flags.writeable)
+        base = marks
+        while base is not None and not isinstance(base, np.memmap):
+            base = base.base
+        self.assertIsInstance(base, np.memmap)
+
+        self.assertEqual([d["name"] for d in datasets.catalog()], ["user_data"])
+        with self.assertRaises(ValueError):
+            datasets.load("../storage")
+
+    def publish_frame(self, frame):
+        with mock.patch.object(datasets, "_read_source", return_value=frame):
+            return datasets.publish("frame.csv")
+
+    def test_timezone_aware_columns(self):
+        frame = pd.DataFrame({"t": pd.date_range("2024-03-30", periods=3, freq="D", tz="Europe/Berlin")})
+        manifest = self.publish_frame(frame)
+        self.assertEqual(manifest["columns"][0]["tz"], "Europe/Berlin")
+        pd.testing.assert_frame_equal(datasets.load("frame"), frame)
+
+    def test_nullable_columns_keep_their_missing_values(self):
+        frame = pd.DataFrame({"n": pd.array([1, None, 3], dtype="Int64"),
+                              "b": pd.array([True, None, False], dtype="boolean"),
+                              "f": pd.array([1.5, None, 2.0], dtype="Float64")})
+        manifest = self.publish_frame(frame)
+        self.assertEqual([c["kind"] for c in manifest["columns"]], ["masked"] * 3)
+        df = datasets.load("frame")
+        pd.testing.assert_frame_equal(df, frame)
+        self.assertFalse(df["n"].array._data.flags.writeable)
+
+    def test_admin_endpoints_require_token(self):
+        backend.ADMIN_TOKEN = None
+        with open("user_data.csv", "rb") as f:
+            response = self.client.post("/admin/datasets", files={"file": ("user_data.csv", f)})
+        self.assertEqual(response.status_code, 403)
+
+        backend.ADMIN_TOKEN = "secret"
+        with open("user_data.csv", "rb") as f:
+            response = self.client.post("/admin/datasets?name=grades", files={"file": ("user_data.csv", f)},
+                                        headers={"X-Admin-Token": "secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["dataset"]["rows"], 4)
+
+        listing = self.client.get("/datasets").json()
+        self.assertEqual([d["name"] for d in listing["datasets"]], ["grades"])
+
+        response = self.client.delete("/admin/datasets/grades", headers={"X-Admin-Token": "secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/datasets").json()["datasets"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import shutil
+import time
+import unittest
+from unittest import mock
+from fastapi.testclient import TestClient
+
+import backend
+from backend import app
+
+USERS = ("shared_a", "shared_b")
+
+
+def run_cell(websocket, code, cell_id):
+    websocket.send_json({"type": "execute", "code": code, "cellId": cell_id})
+    return receive_until(websocket, lambda d: d['type'] == 'complete' and d['cellId'] == cell_id)
+
+
+def receive_until(websocket, predicate):
+    seen = []
+    while True:
+        data = websocket.receive_json()
+        seen.append(data)
+        if predicate(data):
+            return seen
+
+
+def stdout(seen):
+    return "".join(d["text"] for d in seen if d["type"] == "stream" and d["name"] == "stdout")
+
+
+class TestSharedEngine(unittest.TestCase):
+    def setUp(self):
+        # One event loop for all connections: they share the worker's pipes
+        self.client = TestClient(app)
+        self.client.__enter__()
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        for user in USERS:
+            shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", user), ignore_errors=True)
+
+    def connect(self, user):
+        return self.client.websocket_connect(f"/ws?userId={user}&engine=shared")
+
+    def test_sessions_share_a_process_but_not_namespaces(self):
+        with self.connect(USERS[0]) as a, self.connect(USERS[1]) as b:
+            pids = {backend.sessions[ws.receive_json()["sessionId"]].kernel_pid for ws in (a, b)}
+            self.assertEqual(len(pids), 1)
+
+            run_cell(a, "secret = 'a'\nopen('note.txt', 'w').write('from a')", "c1")
+            seen = run_cell(b, "print('secret' in globals())\nopen('note.txt', 'w').write('from b')", "c1")
+            self.assertEqual(stdout(seen), "False\n")
+            self.assertEqual(stdout(run_cell(a, "print(secret, open('note.txt').read())", "c2")), "a from a\n")
+            with open(os.path.join(backend.WORKING_DIR, "storage", USERS[1], "note.txt")) as f:
+                self.assertEqual(f.read(), "from b")
+
+            metrics = self.client.get("/metrics/shared").json()
+            self.assertEqual((metrics["running"], metrics["namespaces"]), (True, 2))
+            self.assertGreaterEqual(metrics["cells"], 3)
+
+    def test_relative_paths_resolve_in_each_workspace(self):
+        for user in USERS:
+            os.makedirs(os.path.join(backend.WORKING_DIR, "storage", user), exist_ok=True)
+            with open(os.path.join(backend.WORKING_DIR, "storage", user, "data.csv"), "w") as f:
+                f.write(f"name,score\n{user},1\n")
+        with self.connect(USERS[0]) as a, self.connect(USERS[1]) as b:
+            a.receive_json()
+            b.receive_json()
+            code = ("import glob, pathlib, pandas as pd\n"
+                    "df = pd.read_csv('data.csv')\n"
+                    "df.assign(score=2).to_csv('out.csv', index=False)\n"
+                    "print(df['name'][0], sorted(glob.glob('*.csv')), pathlib.Path('out.csv').exists())")
+            for user, websocket in zip(USERS, (a, b)):
+                self.assertEqual(stdout(run_cell(websocket, code, "c1")), f"{user} ['data.csv', 'out.csv'] True\n")
+                with open(os.path.join(backend.WORKING_DIR, "storage", user, "out.csv")) as f:
+                    self.assertEqual(f.read(), f"name,score\n{user},2\n")
+
+    def test_busy_namespace_does_not_starve_the_others(self):
+        with mock.patch.object(backend, "SHARED_CPU_LIMIT", 2), \
+             self.connect(USERS[0]) as a, self.connect(USERS[1]) as b:
+            busy = backend.sessions[a.receive_json()["sessionId"]]
+            b.receive_json()
+            a.send_json({"type": "execute", "code": "x = 0\nwhile True: x += 1", "cellId": "busy"})
+            time.sleep(0.3)
+            self.assertEqual(stdout(run_cell(b, "print(sum(range(10 ** 5)))", "quick")), "4999950000\n")
+            # Done while the busy loop still runs, well inside its CPU limit: not starved
+            self.assertEqual(busy.current_execution, "busy")
+
+            seen = receive_until(a, lambda d: d["type"] == "complete")
+            error = [d for d in seen if d["type"] == "error"][0]
+            self.assertEqual(error["ename"], "CpuLimitExceeded")
+            self.assertIn("2s of CPU time", error["evalue"])
+            # The namespace survives its stopped cell
+            self.assertEqual(stdout(run_cell(a, "print(x > 0)", "after")), "True\n")
+
+    def test_input_and_interrupt_are_per_namespace(self):
+        with self.connect(USERS[0]) as a, self.connect(USERS[1]) as b:
+            a.receive_json()
+            b.receive_json()
+            a.send_json({"type": "execute", "code": "import time\nprint('sleeping', flush=True)\ntime.sleep(60)",
+                         "cellId": "sleep"})
+            receive_until(a, lambda d: d["type"] == "stream")
+            b.send_json({"type": "execute", "code": "print('Hi', input('Name? '))", "cellId": "ask"})
+            receive_until(b, lambda d: d["type"] == "input_request")
+
+            a.send_json({"type": "interrupt"})
+            seen = receive_until(a, lambda d: d["type"] == "interrupt_reply")
+            self.assertEqual(seen[-1]["status"], "ok")
+            self.assertIn("KeyboardInterrupt", [d.get("ename") for d in seen])
+
+            b.send_json({"type": "input_reply", "value": "Ada", "cellId": "ask"})
+            self.assertEqual(stdout(receive_until(b, lambda d: d["type"] == "complete")), "Hi Ada\n")
+
+    def test_worker_crash_restarts_every_session(self):
+        with self.connect(USERS[0]) as a, self.connect(USERS[1]) as b:
+            a.receive_json()
+            b.receive_json()
+            old_pid = backend.shared_worker.process.pid
+            seen = run_cell(a, "import ctypes\nctypes.string_at(0)", "c1")
+            self.assertEqual([d["ename"] for d in seen if d["type"] == "error"], ["KernelDied"])
+            for websocket in (a, b):
+                receive_until(websocket, lambda d: d["type"] == "kernel_restarted")
+            self.assertNotEqual(backend.shared_worker.process.pid, old_pid)
+            self.assertEqual(stdout(run_cell(b, "print('back')", "c2")), "back\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
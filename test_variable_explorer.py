@@ -0,0 +1,57 @@
+import unittest
+from fastapi.testclient import TestClient
+from backend import app
+
+
+def run_cell(websocket, code, cell_id):
+    websocket.send_json({"type": "execute", "code": code, "cellId": cell_id})
+    while True:
+        data = websocket.receive_json()
+        if data['type'] == 'complete' and data['cellId'] == cell_id:
+            return
+
+
+class TestVariableExplorer(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def test_inspect_variables(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            run_cell(websocket, "big = pd.DataFrame({'a': np.arange(200000), 'b': 'x'})\n"
+                                "arr = np.ones((3, 4))\ncount = 7", "cell-1")
+
+            websocket.send_json({"type": "inspect_variables", "requestId": "r1"})
+            data = websocket.receive_json()
+            self.assertEqual(data['type'], 'variables')
+            self.assertEqual(data['requestId'], 'r1')
+            by_name = {v['name']: v for v in data['variables']}
+            self.assertEqual(set(by_name), {'arr', 'big', 'count'})
+
+            big = by_name['big']
+            self.assertEqual(big['shape'], [200000, 2])
+            self.assertEqual(big['dtypes'][0], 'int64')
+            self.assertEqual(len(big['preview']), 5)
+            self.assertTrue(big['stats']['sampled'])
+            self.assertEqual(by_name['arr']['memory'], 96)
+            self.assertEqual(by_name['count']['preview'], 7)
+
+            # Lazy paging deep into the frame
+            websocket.send_json({"type": "inspect_variables", "name": "big", "offset": 150000, "limit": 3})
+            data = websocket.receive_json()
+            self.assertEqual(data['type'], 'variable_page')
+            self.assertEqual(data['total'], 200000)
+            self.assertEqual(data['rows'], [[150000, "'x'"], [150001, "'x'"], [150002, "'x'"]])
+
+            websocket.send_json({"type": "inspect_variables", "name": "missing"})
+            data = websocket.receive_json()
+            self.assertIn('error', data)
+
+            # Bad paging fields get an error reply, not silence
+            for field in ("offset", "limit", "previewRows"):
+                websocket.send_json({"type": "inspect_variables", "requestId": field, field: "ten"})
+                data = websocket.receive_json()
+                self.assertEqual((data['requestId'], data['error']), (field, f"Invalid {field} 'ten'"))
+
+
+if __name__ == "__main__":
+    unittest.main()
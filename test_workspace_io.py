@@ -0,0 +1,170 @@
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+from fastapi.testclient import TestClient
+
+import backend
+import workspace_io
+from backend import app
+from workspace_io import LatencyHistogram
+
+USER = "workspace_io_user"
+# Simulated latency of each file system call on a slow disk
+DISK_LATENCY = 0.02
+
+
+class Launched(Exception):
+    pass
+
+
+class FakeKernelManager:
+    """Stands in for the kernel launch, which is not workspace I/O."""
+
+    def __init__(self, **kwargs):
+        pass
+
+    async def start_kernel(self, **kwargs):
+        raise Launched()
+
+
+def slow(fn):
+    def wrapper(*args, **kwargs):
+        time.sleep(DISK_LATENCY)
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+async def max_loop_lag(work):
+    """Longest the event loop went without running a 1ms ticker while `work` ran."""
+    lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - started - 0.001)
+
+    task = asyncio.create_task(ticker())
+    try:
+        await work
+    finally:
+        done = True
+        await task
+    return lag
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_quantiles(self):
+        histogram = LatencyHistogram()
+        for ms in [0.3] * 90 + [7] * 9 + [4000]:
+            histogram.record(ms)
+        summary = histogram.summary()
+        self.assertEqual(summary["count"], 100)
+        self.assertEqual(summary["p50_ms"], 0.5)
+        self.assertEqual(summary["p95_ms"], 10)
+        self.assertEqual(summary["max_ms"], 4000)
+        self.assertEqual(summary["buckets"]["le_5000"], 1)
+        self.assertEqual(summary["buckets"]["inf"], 0)
+
+    def test_open_bucket_reports_the_max(self):
+        histogram = LatencyHistogram()
+        histogram.record(9000)
+        self.assertEqual(histogram.quantile(0.5), 9000)
+        self.assertEqual(histogram.summary()["buckets"]["inf"], 1)
+
+
+class TestWorkspace(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.seed = os.path.join(self.root, "app")
+        os.makedirs(self.seed)
+        for name in ("data.csv", "notes.txt", "script.py"):
+            with open(os.path.join(self.seed, name), "w") as f:
+                f.write(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_new_workspace_is_seeded_once(self):
+        user_dir = os.path.join(self.root, "storage", "u")
+        self.assertTrue(workspace_io.prepare_workspace(user_dir, self.seed))
+        self.assertEqual(sorted(os.listdir(user_dir)), ["data.csv", "notes.txt"])
+        os.remove(os.path.join(user_dir, "data.csv"))
+        self.assertFalse(workspace_io.prepare_workspace(user_dir, self.seed))
+        self.assertEqual(os.listdir(user_dir), ["notes.txt"])
+
+    def test_copies_when_links_fail(self):
+        user_dir = os.path.join(self.root, "storage", "u")
+        with mock.patch("os.link", side_effect=OSError("cross-device link")):
+            workspace_io.prepare_workspace(user_dir, self.seed)
+        self.assertEqual(os.stat(os.path.join(user_dir, "data.csv")).st_nlink, 1)
+
+
+class TestLoopIsNotBlocked(unittest.TestCase):
+    def tearDown(self):
+        for i in range(8):
+            shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", f"{USER}_{i}"), ignore_errors=True)
+
+    def start_sessions(self, first):
+        # Everything a session start does before launching the kernel, four at
+        # a time, with every file system call taking DISK_LATENCY. Returns
+        # (longest loop lag, elapsed)
+        async def start(i):
+            with self.assertRaises(Launched):
+                await backend.KernelSession(f"io-{i}").start(f"{USER}_{i}")
+
+        async def starts():
+            await asyncio.gather(*(start(i) for i in range(first, first + 4)))
+
+        with mock.patch.object(backend, "AsyncKernelManager", FakeKernelManager), \
+             mock.patch("os.makedirs", slow(os.makedirs)), \
+             mock.patch("os.link", slow(os.link)), \
+             mock.patch("builtins.open", slow(open)):
+            started = time.perf_counter()
+            lag = asyncio.run(max_loop_lag(starts()))
+            return lag, time.perf_counter() - started
+
+    def test_concurrent_session_starts_on_a_slow_disk(self):
+        before = workspace_io.histograms.get("workspace", LatencyHistogram()).count
+        lag, elapsed = self.start_sessions(0)
+        self.assertGreater(elapsed, 4 * DISK_LATENCY)
+        self.assertEqual(workspace_io.histograms["workspace"].count, before + 4)
+        self.assertTrue(os.path.isdir(os.path.join(backend.WORKING_DIR, "storage", f"{USER}_0", ".packages")))
+
+        # The same starts with their I/O on the event loop, as a yardstick:
+        # relative, so a loaded machine slows both alike
+        async def inline(op, fn, *args):
+            return fn(*args)
+
+        with mock.patch.object(workspace_io, "run", inline):
+            blocked_lag, _ = self.start_sessions(4)
+        self.assertGreaterEqual(blocked_lag, DISK_LATENCY)
+        self.assertLess(lag, blocked_lag / 2)
+
+
+class TestUpload(unittest.TestCase):
+    def tearDown(self):
+        path = os.path.join(backend.WORKING_DIR, "workspace_io_upload.txt")
+        if os.path.exists(path):
+            os.remove(path)
+
+    def test_upload_is_saved_and_timed(self):
+        client = TestClient(app)
+        response = client.post("/upload", files={"file": ("workspace_io_upload.txt", io.BytesIO(b"x" * 5000))})
+        self.assertEqual(response.json()["status"], "uploaded")
+        with open(os.path.join(backend.WORKING_DIR, "workspace_io_upload.txt"), "rb") as f:
+            self.assertEqual(f.read(), b"x" * 5000)
+        metrics = client.get("/metrics/io").json()
+        self.assertGreaterEqual(metrics["operations"]["upload"]["count"], 1)
+        self.assertEqual(metrics["threads"], workspace_io.THREADS)
+
+
+if __name__ == "__main__":
+    unittest.main()
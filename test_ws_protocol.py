@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+import shutil
+import unittest
+from fastapi.testclient import TestClient
+
+import backend
+import protocol
+from backend import app
+from protocol import Codec, Connection, RawJSON, MSGPACK_SUBPROTOCOL
+
+USER = "protocol_user"
+
+
+@unittest.skipIf(protocol.msgpack is None, "msgpack not installed")
+class TestCodec(unittest.TestCase):
+    def test_round_trip_with_cell_handles(self):
+        server, client = Codec(), Codec(assign_handles=False)
+        cell = "cell-0f8fad5b-d9cb-469f-a165-70867728950e"
+        first = server.encode({"type": "stream", "cellId": cell, "name": "stdout", "text": "hi\n"})
+        second = server.encode({"type": "stream", "cellId": cell, "name": "stdout", "text": "hi\n"})
+        # The id is sent once, then only its handle
+        self.assertIn(cell.encode(), first)
+        self.assertNotIn(cell.encode(), second)
+        self.assertLess(len(second), len(json.dumps({"type": "stream", "cellId": cell})))
+
+        for frame in (first, second):
+            self.assertEqual(client.decode(frame), {"type": "stream", "cellId": cell, "name": "stdout", "text": "hi\n"})
+        # The client can now refer to the cell by handle
+        reply = client.encode({"type": "input_reply", "cellId": cell, "value": "42"})
+        self.assertEqual(server.decode(reply), {"type": "input_reply", "cellId": cell, "value": "42"})
+
+    def test_unknown_keys_and_types_pass_through(self):
+        codec = Codec()
+        message = {"type": "pong", "t": 12.5, "executing": None, "brandNew": [1, 2]}
+        self.assertEqual(Codec().decode(codec.encode(message)), message)
+        message = {"type": "something_new", "cellId": "plain-id"}
+        self.assertEqual(Codec(assign_handles=False).decode(Codec(assign_handles=False).encode(message)), message)
+
+    def test_invalid_frames(self):
+        codec = Codec()
+        for frame in (protocol.msgpack.packb([1, 2]), protocol.msgpack.packb({0: 999}),
+                      protocol.msgpack.packb({1: 7})):
+            with self.assertRaises(ValueError):
+                codec.decode(frame)
+
+    def test_negotiation(self):
+        self.assertEqual(protocol.negotiate(["other", MSGPACK_SUBPROTOCOL]), MSGPACK_SUBPROTOCOL)
+        self.assertIsNone(protocol.negotiate(["other"]))
+        self.assertIsNone(protocol.negotiate(None))
+
+
+class TestJSONEncoding(unittest.TestCase):
+    messages = [
+        {"cellId": "cell-1", "type": "stream", "text": "caf\u00e9 \"quoted\"\n\t\x1b[0m", "name": "stdout"},
+        {"cellId": "cell-1", "type": "execute_result", "html": "<table></table>", "frame": {"rows": [[1, 2.5, None]]}},
+        {"type": "pong", "t": 2 ** 70, "executing": None},
+    ]
+
+    def test_encoders_agree(self):
+        saved = protocol.orjson
+        try:
+            encoded = [Connection(None).encode_text(m) for m in self.messages]
+            protocol.orjson = None
+            connection = Connection(None)
+            fallback = [connection.encode_text(m) for m in self.messages + self.messages]
+        finally:
+            protocol.orjson = saved
+        self.assertEqual(connection._envelopes, {("cell-1", "stdout"): '{"cellId":"cell-1","type":"stream","name":"stdout","text":'})
+        for message, text in zip(self.messages * 3, encoded + fallback):
+            self.assertEqual(json.loads(text), message)
+
+    def test_splice(self):
+        self.assertEqual(json.loads(protocol.splice('{"type":"rows","requestId":3}', RawJSON(' {"rows": [[1]], "total": 1} '))),
+                         {"type": "rows", "requestId": 3, "rows": [[1]], "total": 1})
+        self.assertEqual(protocol.splice('{"type":"rows"}', RawJSON("{}")), '{"type":"rows"}')
+        self.assertEqual(protocol.splice("{}", RawJSON('{"a":1}')), '{"a":1}')
+        with self.assertRaises(ValueError):
+            protocol.splice('{"type":"rows"}', RawJSON("[1]"))
+
+    @unittest.skipIf(protocol.msgpack is None, "msgpack not installed")
+    def test_raw_json_over_msgpack(self):
+        sent = []
+
+        class FakeWebSocket:
+            async def send_bytes(self, data):
+                sent.append(data)
+
+        connection = Connection(FakeWebSocket(), MSGPACK_SUBPROTOCOL)
+        asyncio.run(connection.send_json({"type": "rows", "requestId": 1}, raw=RawJSON('{"total": 5}')))
+        self.assertEqual(Codec().decode(sent[0]), {"type": "rows", "requestId": 1, "total": 5})
+
+
+@unittest.skipIf(protocol.msgpack is None, "msgpack not installed")
+class TestMsgpackWebSocket(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        self.codec = Codec(assign_handles=False)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.join(backend.WORKING_DIR, "storage", USER), ignore_errors=True)
+
+    def run_cell(self, websocket, code, cell_id):
+        websocket.send_bytes(self.codec.encode({"type": "execute", "code": code, "cellId": cell_id}))
+        seen = []
+        while True:
+            data = self.codec.decode(websocket.receive_bytes())
+            seen.append(data)
+            if data['type'] == 'complete' and data['cellId'] == cell_id:
+                return seen
+
+    def test_execute_over_msgpack(self):
+        with self.client.websocket_connect(f"/ws?userId={USER}", subprotocols=[MSGPACK_SUBPROTOCOL]) as websocket:
+            self.assertEqual(websocket.accepted_subprotocol, MSGPACK_SUBPROTOCOL)
+            self.assertEqual(self.codec.decode(websocket.receive_bytes())["type"], "session")
+
+            seen = self.run_cell(websocket, "print('hello')", "cell-1")
+            self.assertIn({"type": "stream", "cellId": "cell-1", "name": "stdout", "text": "hello\n"}, seen)
+            seen = self.run_cell(websocket, "1 / 0", "cell-2")
+            self.assertEqual([d["ename"] for d in seen if d["type"] == "error"], ["ZeroDivisionError"])
+            self.assertEqual(self.codec.handles, {"cell-1": 1, "cell-2": 2})
+
+            # Text frames still work on a msgpack connection
+            websocket.send_text(json.dumps({"type": "ping", "t": 1}))
+            pong = self.codec.decode(websocket.receive_bytes())
+            self.assertEqual((pong["type"], pong["t"]), ("pong", 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
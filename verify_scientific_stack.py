@@ -1,102 +1,34 @@
-import jupyter_client
-import time
-import json
-import base64
+"""Check that NumPy, pandas and matplotlib work in a kernel, through /ws.
 
-def verify_stack():
-    print("Starting verification of Scientific Stack (NumPy, Pandas, Matplotlib)...")
-    
-    km = jupyter_client.KernelManager(kernel_name='python3')
-    km.start_kernel()
-    kc = km.client()
-    kc.start_channels()
-    kc.wait_for_ready(timeout=60)
-    print("Kernel started.")
+Runs the workloads of the scientific-stack benchmark suite
+(benchmarks/bench_scientific_stack.py) once each and checks their output;
+the suite also times them and compares with a baseline.
+"""
+import os
+import sys
 
-    results = {
-        "numpy": False,
-        "pandas": False,
-        "matplotlib": False
-    }
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
 
-    # Test NumPy
-    numpy_code = """
-import numpy as np
-arr = np.array([1, 2, 3])
-print(f"Numpy Array: {arr}")
-"""
-    print("Testing NumPy...")
-    outs = execute_code(kc, numpy_code)
-    if any("Numpy Array: [1 2 3]" in o.get('text', '') for o in outs):
-        print("✅ NumPy Verified")
-        results["numpy"] = True
-    else:
-        print("❌ NumPy Failed")
-        print(outs)
+from bench_scientific_stack import WORKLOADS, CheckFailed, run  # noqa: E402
 
-    # Test Pandas
-    pandas_code = """
-import pandas as pd
-df = pd.DataFrame({'A': [1, 2], 'B': [3, 4]})
-print(df.to_string())
-"""
-    print("Testing Pandas...")
-    outs = execute_code(kc, pandas_code)
-    # Check for DataFrame string representation
-    if any("   A  B" in o.get('text', '') for o in outs):
-        print("✅ Pandas Verified")
-        results["pandas"] = True
-    else:
-        print("❌ Pandas Failed")
-        print(outs)
+# library -> prefix of its workloads
+LIBRARIES = {"numpy": "numpy_", "pandas": "pandas_", "matplotlib": "plot_"}
 
-    # Test Matplotlib
-    # We need to ensure inline backend is active if we want images, 
-    # but here we just check if it runs without error and maybe produces something.
-    # Standard jupyter client might not produce image data unless configured purely via code protocols.
-    # We force `%matplotlib inline` behavior if possible, or just generate a figure and save it/show it.
-    mpl_code = """
-import matplotlib.pyplot as plt
-import io
-import base64
-fig = plt.figure()
-plt.plot([1, 2], [3, 4])
-# In a real notebook, plt.show() triggers display_data hook.
-# Here we can also manually check if it raises no error.
-print("Matplotlib OK")
-"""
-    print("Testing Matplotlib...")
-    outs = execute_code(kc, mpl_code)
-    if any("Matplotlib OK" in o.get('text', '') for o in outs):
-        print("✅ Matplotlib Import/Execution Verified")
-        results["matplotlib"] = True
-    else:
-        print("❌ Matplotlib Failed")
-        print(outs)
 
-    km.shutdown_kernel()
+def verify_stack():
+    print("Starting verification of Scientific Stack (NumPy, Pandas, Matplotlib)...")
+    results = {}
+    for library, prefix in LIBRARIES.items():
+        try:
+            run({name for name in WORKLOADS if name.startswith(prefix)}, rounds=1)
+        except CheckFailed as e:
+            print(f"❌ {library} failed: {e}")
+            results[library] = False
+        else:
+            print(f"✅ {library} verified")
+            results[library] = True
     return results
 
-def execute_code(kc, code):
-    msg_id = kc.execute(code)
-    outputs = []
-    while True:
-        try:
-            msg = kc.get_iopub_msg(timeout=2)
-            if msg['parent_header'].get('msg_id') == msg_id:
-                msg_type = msg['msg_type']
-                content = msg['content']
-                if msg_type == 'stream':
-                    outputs.append({'type': 'stream', 'text': content['text']})
-                elif msg_type in ('execute_result', 'display_data'):
-                    outputs.append({'type': 'data', 'data': content['data']})
-                elif msg_type == 'error':
-                    outputs.append({'type': 'error', 'traceback': content['traceback']})
-                elif msg_type == 'status' and content['execution_state'] == 'idle':
-                    break
-        except:
-            break
-    return outputs
 
 if __name__ == "__main__":
-    verify_stack()
+    sys.exit(0 if all(verify_stack().values()) else 1)
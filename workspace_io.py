@@ -0,0 +1,126 @@
+import asyncio
+import bisect
+import glob
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Workspace file I/O off the event loop.
+#
+# Creating and seeding a user's workspace, opening kernel logs, writing
+# session records and saving uploads all touch the disk, and on a slow or
+# network filesystem a single call can take tens of milliseconds - on the
+# event loop that stalls every connection's output. These run in a small
+# dedicated pool of THREADS workers instead: bounded, so a burst of session
+# starts queues up rather than spawning threads, and separate from the
+# default executor, so it can't be starved by (or starve) kernel helper and
+# notebook work. Every operation's latency, queueing included, goes into a
+# per-operation histogram reported at /metrics/io.
+
+THREADS = int(os.environ.get("LUNA_IO_THREADS", 4))
+# Files every new workspace starts with, linked (or copied) from the app directory
+SEED_PATTERNS = ['*.csv', '*.xlsx', '*.json', '*.txt', '*.png', '*.jpg']
+# Upper bounds (ms) of the histogram buckets; the last bucket is open
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+COPY_CHUNK = 1024 * 1024
+
+
+class LatencyHistogram:
+    def __init__(self, bounds=BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, ms: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+            self.count += 1
+            self.total += ms
+            self.max = max(self.max, ms)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (the max for the open bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max, 3),
+            "buckets": {f"le_{b}": n for b, n in zip(self.bounds, self.counts)} | {"inf": self.counts[-1]},
+        }
+
+
+_executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="workspace-io")
+histograms = {}  # operation -> LatencyHistogram
+_pending = 0
+
+
+async def run(op: str, fn, *args):
+    """Run fn(*args) in the workspace I/O pool, recording its latency under `op`."""
+    global _pending
+    histogram = histograms.get(op)
+    if histogram is None:
+        histogram = histograms[op] = LatencyHistogram()
+    started = time.perf_counter()
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _pending -= 1
+        histogram.record((time.perf_counter() - started) * 1000)
+
+
+def prepare_workspace(user_dir: str, seed_dir: str) -> bool:
+    """Create user_dir seeded with the data files in seed_dir; False if it already existed."""
+    os.makedirs(os.path.dirname(user_dir), exist_ok=True)
+    try:
+        os.makedirs(user_dir)
+    except FileExistsError:
+        return False
+    # Hard links are fast and take no space; copy across filesystems
+    try:
+        for pattern in SEED_PATTERNS:
+            for file_path in glob.glob(os.path.join(seed_dir, pattern)):
+                dest_path = os.path.join(user_dir, os.path.basename(file_path))
+                if not os.path.exists(dest_path):
+                    try:
+                        os.link(file_path, dest_path)
+                    except OSError:
+                        shutil.copy(file_path, dest_path)
+    except Exception as e:
+        logger.warning(f"Failed to populate user workspace {user_dir}: {e}")
+    return True
+
+
+def save_upload(source, path: str):
+    """Copy an uploaded file object to path."""
+    with open(path, "wb") as buffer:
+        shutil.copyfileobj(source, buffer, COPY_CHUNK)
+
+
+def metrics():
+    return {
+        "threads": THREADS,
+        "pending": _pending,
+        "operations": {op: h.summary() for op, h in sorted(histograms.items())},
+    }